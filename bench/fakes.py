@@ -0,0 +1,263 @@
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# ========== Fake Bot API and LLM Servers ========== #
+# Stand-ins for Telegram and OpenRouter so the worker can be driven at a known rate.
+# FakeBotAPI serves getUpdates from an in-memory queue and answers every other method
+# like Telegram would (messages, admins, members, True), enforcing Telegram's send
+# limits with 429 + retry_after. Each update's first send back to its chat is matched
+# to it for end-to-end latency. FakeLLM answers /v1/chat/completions after a latency
+# drawn from a distribution and fails a configurable share of calls.
+
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument", "sendSticker", "sendAnimation", "sendAudio",
+                "sendVoice", "sendVideo", "editMessageText"}
+IGNORED_METHODS = {"getUpdates", "getMe"}     # not counted as calls made for an update
+
+def parse_latency(spec):
+    """
+    A latency distribution in seconds: "fixed:0.5", "uniform:0.2,2", "exp:0.8" (mean)
+    or "lognormal:0.8,0.5" (median, sigma). Returns a function drawing one value.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / values[0])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"unknown latency distribution {spec!r}")
+
+class _Limit:
+    """Token bucket used to decide when the fake answers 429."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self):
+        """Returns 0 when allowed, else the seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class _Server:
+    """A threaded HTTP server on 127.0.0.1 running handle(method, path, headers, body) -> (status, dict)."""
+    def __init__(self, port=0):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload = owner.handle(self.command, self.path, self.headers, body)
+                out = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            do_GET = do_POST = _respond
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name=type(self).__name__).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+class FakeBotAPI(_Server):
+    def __init__(self, port=0, latency="fixed:0.02", limits=True, global_rate=30, chat_rate=1, chat_burst=3,
+                 group_rate=20 / 60, group_burst=5, bot_id=999, owner_id=1):
+        super().__init__(port)
+        self.latency = parse_latency(latency)
+        self.limits = limits
+        self.global_limit = _Limit(global_rate, global_rate)
+        self.chat_limit = lambda chat_id: (_Limit(group_rate, group_burst) if chat_id < 0
+                                           else _Limit(chat_rate, chat_burst))
+        self.chat_limits = {}
+        self.bot_id = bot_id
+        self.owner_id = owner_id
+        self.cond = threading.Condition()
+        self.updates = deque()          # offered, not yet confirmed by an offset
+        self.offered = {}               # update_id -> time it became available
+        self.waiting = defaultdict(deque)  # chat_id -> [(update_id, message_id)] without a reply yet
+        self.latencies = []             # seconds from offer to first send into the chat
+        self.calls = Counter()
+        self.rate_limited = 0
+        self.first_poll = threading.Event()
+        self.message_ids = itertools.count(10 ** 6)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/bot{{0}}/{{1}}"
+
+    def offer(self, update):
+        """Makes an update available to getUpdates, now."""
+        message = update.get("message") or {}
+        with self.cond:
+            self.updates.append(update)
+            self.offered[update["update_id"]] = time.monotonic()
+            if message:
+                self.waiting[message["chat"]["id"]].append((update["update_id"], message["message_id"]))
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                "calls": dict(self.calls),
+                "rate_limited": self.rate_limited,
+                "latencies": list(self.latencies),
+                "replied": len(self.latencies),
+            }
+
+    @staticmethod
+    def _params(path, headers, body):
+        params = {k: v[0] for k, v in parse_qs(urlparse(path).query).items()}
+        content_type = headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            # Uploads (sendDocument): only the plain fields are needed
+            for name, value in re.findall(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n', body):
+                params[name.decode()] = value.decode(errors="replace")
+        elif content_type.startswith("application/json"):
+            params.update(json.loads(body or b"{}"))
+        elif body:
+            params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+        return params
+
+    def handle(self, verb, path, headers, body):
+        method = urlparse(path).path.rsplit("/", 1)[-1]
+        params = self._params(path, headers, body)
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        time.sleep(self.latency())
+        with self.cond:
+            if method not in IGNORED_METHODS:
+                self.calls[method] += 1
+            if method in SEND_METHODS and self.limits:
+                chat_id = int(params.get("chat_id", 0))
+                limit = self.chat_limits.setdefault(chat_id, self.chat_limit(chat_id))
+                wait = max(self.global_limit.take(), limit.take())
+                if wait:
+                    self.rate_limited += 1
+                    retry_after = max(1, math.ceil(wait))
+                    return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after},
+                                 "description": f"Too Many Requests: retry after {retry_after}"}
+            if method in SEND_METHODS:
+                self._replied(int(params.get("chat_id", 0)), params.get("reply_to_message_id"))
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        self.first_poll.set()
+        with self.cond:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()   # confirmed
+            while not self.updates and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            return list(itertools.islice(self.updates, limit))
+
+    def _replied(self, chat_id, reply_to):
+        pending = self.waiting.get(chat_id)
+        if not pending:
+            return
+        match = None
+        if reply_to is not None:
+            match = next((item for item in pending if str(item[1]) == str(reply_to)), None)
+        match = match or pending[0]
+        pending.remove(match)
+        self.latencies.append(time.monotonic() - self.offered.pop(match[0]))
+
+    def _result(self, method, params):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        chat = {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private", "title": "load test"}
+        if method == "getMe":
+            return {"id": self.bot_id, "is_bot": True, "first_name": "zuzu", "username": "zuzu_loadtest_bot"}
+        if method in SEND_METHODS:
+            return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": chat,
+                    "text": params.get("text", "")}
+        if method == "getChatAdministrators":
+            return [{"status": "creator", "user": {"id": self.owner_id, "is_bot": False, "first_name": "owner"}},
+                    {"status": "administrator", "can_delete_messages": True, "can_restrict_members": True,
+                     "user": {"id": self.bot_id, "is_bot": True, "first_name": "zuzu"}}]
+        if method == "getChatMember":
+            user_id = int(params.get("user_id", 0))
+            return {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+        if method == "getChat":
+            return chat
+        return True
+
+class FakeLLM(_Server):
+    def __init__(self, port=0, latency="lognormal:0.8,0.5", error_rate=0.0, throttle_rate=0.0,
+                 reply="Sure thing, darling."):
+        super().__init__(port)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.reply = reply
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "throttled": 0, "in_flight": 0, "peak": 0}
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.stats[key] += delta
+            self.stats["peak"] = max(self.stats["peak"], self.stats["in_flight"])
+
+    def handle(self, verb, path, headers, body):
+        if not urlparse(path).path.endswith("/chat/completions"):
+            return 404, {"error": {"message": "not found"}}
+        self._count("calls")
+        self._count("in_flight")
+        try:
+            time.sleep(self.latency())
+            roll = random.random()
+            if roll < self.error_rate:
+                self._count("errors")
+                return 500, {"error": {"message": "injected upstream error", "code": 500}}
+            if roll < self.error_rate + self.throttle_rate:
+                self._count("throttled")
+                return 429, {"error": {"message": "injected rate limit", "code": 429}}
+            return 200, {
+                "id": "chatcmpl-loadtest", "object": "chat.completion", "created": int(time.time()),
+                "model": json.loads(body or b"{}").get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.reply}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        finally:
+            self._count("in_flight", -1)
@@ -0,0 +1,236 @@
+"""
+Load test for the worker against fake Telegram and LLM servers.
+
+    python bench/loadtest.py --rate 20 --duration 60
+    python bench/loadtest.py --engine asyncio --rate 100 --llm-latency lognormal:1.5,0.6
+    python bench/loadtest.py --replay updates.jsonl --rate 50
+
+Starts bench/fakes.py's FakeBotAPI and FakeLLM, runs bot/worker.py against them in
+polling mode with a throwaway state directory, offers updates at --rate for
+--duration seconds, waits --settle seconds for the last replies and prints reply
+latency percentiles, throughput, Bot API calls per update and 429 counts.
+Updates are synthetic (private and group chats, mentions, commands, chatter) or
+replayed from a JSON-lines file of raw Bot API updates (as returned by getUpdates).
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from fakes import FakeBotAPI, FakeLLM
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "123456:LOADTEST"
+OWNER_ID = 1
+
+CHATTER = [
+    "lol did anyone see the match last night",
+    "brb getting coffee",
+    "can someone send the link again?",
+    "that's wild, no way",
+    "good morning everyone",
+    "I still think the first version was better tbh",
+    "who's joining the call later",
+    "ok that's actually hilarious",
+]
+QUESTIONS = [
+    "zuzu what do you think about pineapple on pizza",
+    "hey bot, tell me something nice",
+    "zuzu settle this: cats or dogs?",
+    "assistant, how do I stop procrastinating",
+    "zuzu roast my playlist please",
+]
+COMMANDS = ["/start", "/rules", "/tea", "/help"]
+
+class SyntheticUpdates:
+    """Private chats always get an AI reply; group messages mention the bot, run a command or are chatter."""
+    def __init__(self, chats=200, group_ratio=0.5, mention_ratio=0.3, command_ratio=0.1, seed=1):
+        self.random = random.Random(seed)
+        self.groups = [-1000000000000 - i for i in range(int(chats * group_ratio))]
+        self.privates = [10000 + i for i in range(chats - len(self.groups))]
+        self.mention_ratio = mention_ratio
+        self.command_ratio = command_ratio
+
+    def __iter__(self):
+        rnd = self.random
+        while True:
+            chat_id = rnd.choice(self.groups if self.groups and (not self.privates or rnd.random() < 0.5)
+                                 else self.privates)
+            user_id = chat_id if chat_id > 0 else rnd.randint(20000, 29999)
+            roll = rnd.random()
+            if roll < self.command_ratio:
+                text = rnd.choice(COMMANDS)
+            elif chat_id > 0 or roll < self.command_ratio + self.mention_ratio:
+                text = rnd.choice(QUESTIONS)
+            else:
+                text = rnd.choice(CHATTER)
+            message = {
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup", "title": "load test"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            }
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+            yield {"message": message}
+
+class RecordedUpdates:
+    """Cycles through a JSON-lines file of raw updates."""
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as f:
+            self.updates = [json.loads(line) for line in f if line.strip()]
+        if not self.updates:
+            raise SystemExit(f"{path} has no updates")
+
+    def __iter__(self):
+        for update in itertools.cycle(self.updates):
+            yield {k: v for k, v in update.items() if k != "update_id"}
+
+def _stamp(update, update_id):
+    """Gives a template update a fresh id, message id and date."""
+    update = json.loads(json.dumps(update))
+    update["update_id"] = update_id
+    message = update.get("message")
+    if message:
+        message["message_id"] = update_id
+        message["date"] = int(time.time())
+    return update
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def start_worker(args, telegram, llm, state_dir):
+    env = dict(os.environ)
+    env.update({
+        "ENV_FILE": os.devnull,   # ignore the repo's .env
+        "BOT_TOKEN": BOT_TOKEN,
+        "OPENROUTER_API_KEY": "loadtest",
+        "OWNER_ID": str(OWNER_ID),
+        "TELEGRAM_API_URL": telegram.url,
+        "AI_BASE_URL": llm.url,
+        "STATE_DIR": state_dir,
+        "LOG_FILE": os.path.join(state_dir, "bot.log"),
+        "WORKER_SOCKET": os.path.join(state_dir, "worker.sock"),
+        "UPDATE_MODE": "polling",
+        "WORKER_COUNT": "1",
+        "WORKER_SHARD": "0",
+        "WORKER_ENGINE": args.engine,
+        "POLLING_TIMEOUT": "1",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    env.pop("WORKER_STANDBY", None)
+    return subprocess.Popen([sys.executable, "bot/worker.py"], cwd=ROOT_DIR, env=env)
+
+def run(args):
+    telegram = FakeBotAPI(latency=args.tg_latency, limits=not args.no_limits, owner_id=OWNER_ID).start()
+    llm = FakeLLM(latency=args.llm_latency, error_rate=args.llm_error_rate,
+                  throttle_rate=args.llm_429_rate).start()
+    source = RecordedUpdates(args.replay) if args.replay else SyntheticUpdates(
+        args.chats, args.group_ratio, args.mention_ratio, args.command_ratio, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="zuzu-loadtest-") as state_dir:
+        worker = start_worker(args, telegram, llm, state_dir)
+        try:
+            deadline = time.monotonic() + args.warmup
+            while not telegram.first_poll.wait(0.5):
+                if worker.poll() is not None or time.monotonic() > deadline:
+                    raise SystemExit("worker did not start polling")
+            started = time.monotonic()
+            sent = 0
+            for update_id, update in enumerate(source, start=1):
+                due = started + (update_id - 1) / args.rate
+                if due - started >= args.duration:
+                    break
+                time.sleep(max(0, due - time.monotonic()))
+                telegram.offer(_stamp(update, update_id))
+                sent = update_id
+            offered_for = time.monotonic() - started
+
+            settle_until = time.monotonic() + args.settle
+            while time.monotonic() < settle_until and worker.poll() is None:
+                time.sleep(0.5)
+            elapsed = time.monotonic() - started
+            result = report(sent, offered_for, elapsed, telegram.snapshot(), llm.snapshot())
+        finally:
+            worker.send_signal(signal.SIGTERM)
+            try:
+                worker.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        if args.keep_log:
+            with open(os.path.join(state_dir, "bot.log"), encoding="utf-8") as src, open(args.keep_log, "w") as dst:
+                dst.write(src.read())
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(args, result)
+
+def report(sent, offered_for, elapsed, telegram, llm):
+    latencies = telegram["latencies"]
+    calls = sum(telegram["calls"].values())
+    return {
+        "updates": sent,
+        "offered_rate": round(sent / offered_for, 2) if offered_for else None,
+        "replied": telegram["replied"],
+        "unanswered": sent - telegram["replied"],
+        "throughput": round(telegram["replied"] / elapsed, 2) if elapsed else None,
+        "latency_ms": {f"p{q}": round(percentile(latencies, q) * 1000) if latencies else None
+                       for q in (50, 90, 95, 99, 100)},
+        "bot_api_calls": calls,
+        "calls_per_update": round(calls / sent, 3) if sent else None,
+        "calls_by_method": dict(sorted(telegram["calls"].items(), key=lambda item: -item[1])),
+        "rate_limited_429": telegram["rate_limited"],
+        "llm": llm,
+    }
+
+def print_report(args, result):
+    latency = result["latency_ms"]
+    print(f"engine {args.engine}, {result['updates']} updates at {result['offered_rate']}/s "
+          f"({'replay ' + args.replay if args.replay else 'synthetic'})")
+    print(f"replied       {result['replied']} ({result['unanswered']} without a reply), "
+          f"{result['throughput']} replies/s")
+    print("latency ms    " + "  ".join(f"{name} {value}" for name, value in latency.items()))
+    print(f"Bot API       {result['bot_api_calls']} calls, {result['calls_per_update']} per update, "
+          f"{result['rate_limited_429']} answered 429")
+    print("  by method   " + ", ".join(f"{name} {count}" for name, count in result["calls_by_method"].items()))
+    llm = result["llm"]
+    print(f"LLM           {llm['calls']} calls, {llm['errors']} errors, {llm['throttled']} throttled, "
+          f"peak {llm['peak']} in flight")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of updates")
+    parser.add_argument("--settle", type=float, default=15, help="seconds to wait for late replies")
+    parser.add_argument("--warmup", type=float, default=60, help="seconds to wait for the worker's first poll")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--replay", help="JSON-lines file of recorded updates")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--group-ratio", type=float, default=0.5)
+    parser.add_argument("--mention-ratio", type=float, default=0.3, help="group messages addressing the bot")
+    parser.add_argument("--command-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tg-latency", default="fixed:0.02", help="Bot API latency distribution")
+    parser.add_argument("--no-limits", action="store_true", help="never answer 429")
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.5",
+                        help="fixed:S, uniform:A,B, exp:MEAN or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of calls answered 500")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="share of calls answered 429")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra worker environment, e.g. OUTBOUND_GLOBAL_RATE=30")
+    parser.add_argument("--keep-log", metavar="PATH", help="copy the worker's log here")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
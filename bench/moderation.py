@@ -0,0 +1,209 @@
+"""
+Micro-benchmarks for the per-message moderation path.
+
+    python bench/moderation.py
+    python bench/moderation.py --sizes 100,10000 --messages 5000 --hit-ratio 0.05
+    python bench/moderation.py --corpus messages.txt --api-latency 0.05 --json
+
+Runs in-process with the Bot API stubbed behind the outbound dispatcher (no network,
+no pacing). For each bad-word list size it measures:
+  get_effective_badwords  for a group with its own list (read from the moderation
+                          config) and for one using the global list
+  auto_moderate           a group text message through flood check and word match,
+                          with --hit-ratio of the messages containing a listed word
+and, once, the wake-word check (ai_response.mentions_bot). Reports messages per
+second and the per-message latency distribution in microseconds.
+The corpus is generated chat text or one message per line from --corpus.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix="zuzu-bench-")
+os.environ["ENV_FILE"] = os.devnull   # ignore the repo's .env
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ["STATE_DIR"] = STATE_DIR
+os.environ["LOG_FILE"] = os.path.join(STATE_DIR, "bot.log")
+sys.path.insert(0, os.path.join(ROOT_DIR, "bot"))
+
+import requests
+from telebot import types
+import modules.moderations as moderations
+from core.dispatcher import OutboundDispatcher, install
+from core.ai_response import mentions_bot
+
+GROUP_ID = -1001234567890
+GLOBAL_GROUP_ID = -1009876543210
+BOT_ID = 999
+
+VOCABULARY = (
+    "the a to and of is in it you that i for on was with he she they we be this have are not but at "
+    "what so if my your just like get do no can all out up there about one when time know think "
+    "going really good right now people want see back then some would could well yeah okay lol "
+    "tomorrow tonight meeting game match link group channel photo video music movie weekend work "
+    "coffee sleep phone update news admin rules please thanks sorry happy funny crazy weird maybe"
+).split()
+
+class StubBotAPI:
+    """CUSTOM_REQUEST_SENDER that answers like Telegram without a network round trip."""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.next_id = 1
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        name = url.rsplit("/", 1)[-1]
+        params = params or {}
+        if name == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "zuzu", "username": "zuzu_bench_bot"}
+        elif name == "getChatAdministrators":
+            result = [{"status": "creator", "user": {"id": 1, "is_bot": False, "first_name": "owner"}}]
+        elif name.startswith("send"):
+            self.next_id += 1
+            result = {"message_id": self.next_id, "date": int(time.time()), "text": params.get("text", ""),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "supergroup"}}
+        else:
+            result = True
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = json.dumps({"ok": True, "result": result}).encode()
+        return response
+
+def make_badwords(size, rnd):
+    """The shipped list, padded with generated words up to `size`."""
+    words = [w for w in moderations.load_from_file(os.path.join(ROOT_DIR, "data", "badwords.txt")) if w]
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(4, 10)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words[:size]
+
+def make_corpus(count, rnd, path=None):
+    """Chat-like messages: mostly short, some long. Or the lines of `path`."""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return [lines[i % len(lines)] for i in range(count)]
+    corpus = []
+    for _ in range(count):
+        length = min(200, max(1, int(rnd.lognormvariate(2.0, 0.8))))   # median ~7 words
+        corpus.append(" ".join(rnd.choice(VOCABULARY) for _ in range(length)).capitalize())
+    return corpus
+
+def with_hits(corpus, badwords, ratio, rnd):
+    """Puts a listed word into `ratio` of the messages."""
+    result = []
+    for text in corpus:
+        if rnd.random() < ratio:
+            words = text.split()
+            words.insert(rnd.randint(0, len(words)), rnd.choice(badwords))
+            text = " ".join(words)
+        result.append(text)
+    return result
+
+def write_config(badwords, other_chats):
+    """A moderation config with the benchmark group's own list plus other groups' settings."""
+    config = {str(GROUP_ID): {"badwords": badwords, "welcome": True}}
+    for i in range(other_chats):
+        config[str(-1000000000000 - i)] = {"welcome": i % 2 == 0, "welcome_msg": "Welcome to the group!"}
+    moderations.save_mod_config(config)
+
+def message(chat_id, user_id, message_id, text):
+    return types.Message.de_json({
+        "message_id": message_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+    })
+
+def measure(func, inputs, warmup=50):
+    for item in inputs[:warmup]:
+        func(item)
+    timings = []
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter_ns()
+        func(item)
+        timings.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+
+    def pct(q):
+        return round(timings[min(len(timings) - 1, int(q / 100 * len(timings)))] / 1000, 1)
+
+    return {"messages": len(inputs), "per_sec": round(len(inputs) / elapsed),
+            "p50_us": pct(50), "p90_us": pct(90), "p99_us": pct(99), "max_us": round(timings[-1] / 1000, 1)}
+
+def run(args):
+    rnd = random.Random(args.seed)
+    stub = StubBotAPI(args.api_latency)
+    # The outbound dispatcher with the stub behind it and limits out of reach: no pacing, no network
+    install(OutboundDispatcher(global_rate=1e9, chat_rate=1e9, group_rate=1e9, burst=10 ** 9, sender=stub))
+    moderations.MOD_CONFIG_FILE = os.path.join(STATE_DIR, "moderation_config.json")
+    corpus = make_corpus(args.messages, rnd, args.corpus)
+    results = []
+
+    # Flood control keys on the user; every message comes from a different one so it never trips
+    user_ids = iter(range(10 ** 6, 10 ** 9))
+
+    for size in args.sizes:
+        badwords = make_badwords(size, rnd)
+        moderations.global_badwords[:] = badwords
+        write_config(badwords, args.config_chats)
+        texts = with_hits(corpus, badwords, args.hit_ratio, rnd)
+        messages = [message(GROUP_ID, next(user_ids), i, text) for i, text in enumerate(texts)]
+
+        cases = (
+            ("get_effective_badwords (group list)", lambda _: moderations.get_effective_badwords(GROUP_ID), texts),
+            ("get_effective_badwords (global list)", lambda _: moderations.get_effective_badwords(GLOBAL_GROUP_ID), texts),
+            ("auto_moderate", moderations.auto_moderate, messages),
+        )
+        for name, func, inputs in cases:
+            calls = stub.calls
+            result = measure(func, inputs, warmup=0 if name == "auto_moderate" else 50)
+            result.update(case=name, words=size, api_calls=round((stub.calls - calls) / len(inputs), 3))
+            results.append(result)
+            report(result, args.json)
+
+    result = measure(mentions_bot, corpus)
+    result.update(case="wake-word check", words=None, api_calls=0)
+    results.append(result)
+    report(result, args.json)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+def report(result, quiet):
+    if quiet:
+        return
+    words = f"{result['words']:>7}" if result["words"] else "      -"
+    print(f"{result['case']:<38} {words} words  {result['per_sec']:>9}/s  p50 {result['p50_us']:>9}us  "
+          f"p90 {result['p90_us']:>9}us  p99 {result['p99_us']:>9}us  max {result['max_us']:>9}us  "
+          f"api {result['api_calls']}/msg", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[100, 1000, 10000, 100000],
+                        help="bad-word list sizes, comma separated")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per case")
+    parser.add_argument("--hit-ratio", type=float, default=0.02, help="share of messages with a listed word")
+    parser.add_argument("--config-chats", type=int, default=200, help="other groups in the moderation config")
+    parser.add_argument("--corpus", help="file with one message per line instead of generated text")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per stubbed Bot API call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    run(parser.parse_args())
+
+if __name__ == "__main__":
+    main()
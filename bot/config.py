@@ -1,17 +1,19 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 import logging
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (ENV_FILE overrides the .env lookup; the benches point it at an empty file)
+load_dotenv(os.getenv("ENV_FILE"))
 
-# Configure logging
-LOG_FILE = "bot.log"
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+# Logging (bot.log in the project root, shared by supervisor and worker; see core/log_setup.py)
+LOG_FILE = os.getenv("LOG_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.log"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")          # e.g. "dispatcher=DEBUG,werkzeug=WARNING"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")      # "text" or "json" (one object per line)
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "0") == "1"
 
 def get_env(key, default=None, required=False):
     value = os.getenv(key, default)
@@ -36,18 +38,38 @@ AI_MODEL = get_env("AI_MODEL", default="cognitivecomputations/dolphin-mistral-24
 TEMPERATURE = float(get_env("AI_TEMPERATURE", default="0.7"))
 TOP_P = float(get_env("AI_TOP_P", default="0.9"))
 MAX_RETRIES = int(get_env("AI_MAX_RETRIES", default="3"))
+AI_BASE_URL = get_env("AI_BASE_URL", default="https://openrouter.ai/api/v1")   # any OpenAI-compatible endpoint
 MEMORY_LIMIT = int(get_env("MEMORY_LIMIT", default="10"))
 
+# Bot API endpoint, e.g. "http://127.0.0.1:8081/bot{0}/{1}" for a local Bot API server or the load-test fake
+TELEGRAM_API_URL = get_env("TELEGRAM_API_URL", default=None)
+
 # Web Configuration
 HOST_DOMAIN = get_env("HOST_DOMAIN", default=None)
 
+# Update ingestion: "polling" (getUpdates) or "webhook" (Telegram POSTs to the supervisor).
+# WEBHOOK_URL defaults to https://HOST_DOMAIN + WEBHOOK_PATH; if the webhook can't be set the
+# supervisor long-polls instead.
+UPDATE_MODE = get_env("UPDATE_MODE", default="polling")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_URL = get_env("WEBHOOK_URL", default=None)
+WEBHOOK_SECRET = get_env("WEBHOOK_SECRET", default=hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()[:32])
+WEBHOOK_BUFFER = int(get_env("WEBHOOK_BUFFER", default="1000"))   # updates held per worker while it is busy or restarting
+
+# Sharding: the supervisor runs WORKER_COUNT workers and routes each update to one by its chat id.
+# A single worker in polling mode polls by itself; otherwise the supervisor is the one place updates
+# come in (SUPERVISOR_INGEST) and forwards them to workers over IPC.
+WORKER_COUNT = max(1, int(get_env("WORKER_COUNT", default="1")))
+WORKER_SHARD = int(get_env("WORKER_SHARD", default="0"))   # set by the supervisor for each worker
+SUPERVISOR_INGEST = UPDATE_MODE == "webhook" or WORKER_COUNT > 1
+
 # Paths
 # BASE_DIR is now .../bot
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.dirname(BASE_DIR)
 
 DATA_DIR = os.path.join(ROOT_DIR, "data")
-STATE_DIR = os.path.join(ROOT_DIR, "state")
+STATE_DIR = get_env("STATE_DIR", default=os.path.join(ROOT_DIR, "state"))
 
 # Files
 PROMPT_FILE = os.path.join(DATA_DIR, "prompt.txt")
@@ -57,7 +79,48 @@ FUN_FILE = os.path.join(DATA_DIR, "fun.json")
 # State Files
 GROUPS_FILE = os.path.join(STATE_DIR, "groups.txt")
 MOD_CONFIG_FILE = os.path.join(STATE_DIR, "moderation_config.json")
+MEMORY_DB_FILE = os.path.join(STATE_DIR, "bot_memory.db")
 NOTES_DIR = os.path.join(STATE_DIR, "notes")
+SCHEDULER_DB_FILE = os.path.join(STATE_DIR, "scheduler.db")
+MODLOG_DB_FILE = os.path.join(STATE_DIR, "modlog.db")
+BROADCAST_DB_FILE = os.path.join(STATE_DIR, "broadcast.db")
+# Unix socket the worker listens on for supervisor commands/metrics
+WORKER_SOCKET = get_env("WORKER_SOCKET", default=os.path.join(STATE_DIR, "worker.sock"))
+
+# Worker restarts hand polling over from the old worker to a warmed-up new one
+POLLING_TIMEOUT = int(get_env("POLLING_TIMEOUT", default="10"))   # long-poll seconds, bounds the handoff wait
+WORKER_WARMUP_TIMEOUT = int(get_env("WORKER_WARMUP_TIMEOUT", default="60"))
+WORKER_DRAIN_TIMEOUT = int(get_env("WORKER_DRAIN_TIMEOUT", default="60"))
+
+# Worker engine: "threads" (telebot's handler pool) or "asyncio" (handlers dispatched on one event
+# loop; AI replies and image requests run as coroutines, the other handlers on ASYNC_HANDLER_THREADS,
+# and blocking SQLite/crypto/Bot API work from coroutines on ASYNC_IO_THREADS)
+WORKER_ENGINE = get_env("WORKER_ENGINE", default="threads")
+ASYNC_HANDLER_THREADS = int(get_env("ASYNC_HANDLER_THREADS", default="16"))
+ASYNC_IO_THREADS = int(get_env("ASYNC_IO_THREADS", default="32"))
+
+# Profiling (/profile and the dashboard): stack sampling interval, share of handler calls run
+# under cProfile in "cprofile" mode, and the longest allowed session
+PROFILE_INTERVAL = float(get_env("PROFILE_INTERVAL", default="0.01"))
+PROFILE_CPROFILE_RATE = float(get_env("PROFILE_CPROFILE_RATE", default="0.1"))
+PROFILE_MAX_SECONDS = int(get_env("PROFILE_MAX_SECONDS", default="300"))
+
+# Deferred actions (auto-deletes, expiry notices, polling)
+SCHEDULER_WORKERS = int(get_env("SCHEDULER_WORKERS", default="4"))
+
+# Outbound pacing for every Bot API send (Telegram: ~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group)
+OUTBOUND_GLOBAL_RATE = float(get_env("OUTBOUND_GLOBAL_RATE", default="25"))
+OUTBOUND_CHAT_RATE = float(get_env("OUTBOUND_CHAT_RATE", default="1"))
+OUTBOUND_GROUP_RATE = float(get_env("OUTBOUND_GROUP_RATE", default="0.33"))
+OUTBOUND_CHAT_BURST = int(get_env("OUTBOUND_CHAT_BURST", default="3"))
+# Threads making the queued sends, the most sends one chat may have waiting, and how long a
+# caller waits for its turn before the send is withdrawn and fails with a 429
+OUTBOUND_SENDERS = int(get_env("OUTBOUND_SENDERS", default="8"))
+OUTBOUND_CHAT_QUEUE = int(get_env("OUTBOUND_CHAT_QUEUE", default="100"))
+OUTBOUND_SEND_TIMEOUT = float(get_env("OUTBOUND_SEND_TIMEOUT", default="30"))
+
+# Broadcasts (paced by the outbound dispatcher as background traffic)
+BROADCAST_CONCURRENCY = int(get_env("BROADCAST_CONCURRENCY", default="8"))
 
 # Ensure state directories exist
 if not os.path.exists(STATE_DIR):
@@ -1,27 +1,28 @@
+import asyncio
 import telebot
 import os
 import time
 import random
 import logging
 import traceback
-from openai import OpenAI
+import threading
+from openai import OpenAI, AsyncOpenAI
 from core.helper import load_from_file
 import core.memory as memory
 from config import (
-    OPENROUTER_API_KEY, AI_MODEL, TEMPERATURE, TOP_P, MAX_RETRIES, 
+    OPENROUTER_API_KEY, AI_BASE_URL, AI_MODEL, TEMPERATURE, TOP_P, MAX_RETRIES, 
     MEMORY_LIMIT, PROMPT_FILE
 )
 from core.bot_instance import bot
-
-# Configure logging
-logging.basicConfig(
-    filename="bot.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from core.async_engine import engine
 
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=AI_BASE_URL,
+    api_key=OPENROUTER_API_KEY,
+)
+# Used only on the asyncio engine's loop
+async_client = AsyncOpenAI(
+    base_url=AI_BASE_URL,
     api_key=OPENROUTER_API_KEY,
 )
 
@@ -39,6 +40,18 @@ def load_prompt():
 
 system_prompt = load_prompt()
 
+def reload_prompt():
+    global system_prompt
+    system_prompt = load_prompt()
+
+# Live counters for the supervisor's metrics view
+llm_stats = {"in_flight": 0, "calls": 0, "errors": 0}
+_llm_stats_lock = threading.Lock()
+
+def _count_llm(key, delta=1):
+    with _llm_stats_lock:
+        llm_stats[key] += delta
+
 
 # ========== Helper for specific requests ==========
 def get_ai_reply(system_msg, user_msg, max_tokens=150):
@@ -67,7 +80,21 @@ def get_ai_reply(system_msg, user_msg, max_tokens=150):
     return None
 
 # ========== AI Response Handling ==========
-def process_ai_response(message, group_id=None, message_text=None):
+# Split in steps so the threaded handler and the asyncio engine share them: preparing and
+# delivering read and write chat memory (SQLite, Fernet) and call the Bot API, so the
+# coroutine version runs them on the engine's IO pool and only awaits the LLM itself.
+WAKE_WORDS = ["zuzu", "zuzu-bot", "bot", "assistant"]
+
+def mentions_bot(text):
+    """True if any wake word appears anywhere in the text."""
+    text = text.lower()
+    return any(wake in text for wake in WAKE_WORDS)
+
+def _prepare_reply(message, group_id=None, message_text=None, bot_id=None):
+    """
+    Decides whether to answer and builds the conversation. Returns None to stay quiet,
+    else the reply state for _deliver_reply(). bot_id saves a getMe call when known.
+    """
     # Remove @mention from text if present
     clean_text = ""
     if message and hasattr(message, 'text') and message.text:
@@ -91,102 +118,171 @@ def process_ai_response(message, group_id=None, message_text=None):
         is_private = chat_type == "private"
         message_thread_id = message.message_thread_id if hasattr(message, 'message_thread_id') and message.chat.is_forum else None
 
-    # Define wake words
-    wake_words = ["zuzu", "zuzu-bot", "bot", "assistant"]
-    message_text_lower = clean_text.lower()
-    
-    try:
-        # Rate limiting logic using helper if needed, or simple check?
-        # Keeping it simple as before
-        pass
+    started = time.monotonic()
+
+    is_mentioned = mentions_bot(clean_text)
+
+    is_reply_to_bot = (
+        message.reply_to_message and
+        message.reply_to_message.from_user.id == (bot_id or bot.get_me().id)
+    ) if hasattr(message, 'reply_to_message') and message.reply_to_message else False
+
+    # In groups, only respond to mentions or replies
+    # Exception: if group_id is provided, we force send
+    if group_id is None and not is_private and not (is_reply_to_bot or is_mentioned):
+        return None
+
+    # Choose the right memory context
+    if is_private:
+        chat_memory = memory.chat_memory.get(user_id, None, "private", [])
+    else:
+        chat_memory = memory.chat_memory.get(None, chat_id, chat_type, [])
+
+    # Get formatted timestamp
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    # Add user message
+    chat_memory.append({
+        "role": "user", 
+        "content": f"{user_name}: {clean_text}",
+        "timestamp": timestamp
+    })
 
-        # Check if any wake word is present anywhere in the message
-        is_mentioned = any(wake in message_text_lower for wake in wake_words)
+    # Personalize system prompt for DMs
+    system_message = system_prompt
+    if is_private:
+        system_message = f"{system_prompt} Always refer to the user by their name: {user_name}."
 
+    return {
+        "message": message,
+        "group_id": group_id,
+        "chat_id": chat_id,
+        "chat_type": chat_type,
+        "user_id": user_id,
+        "is_private": is_private,
+        "thread_id": message_thread_id,
+        "memory": chat_memory,
+        "conversation": [{"role": "system", "content": system_message}] + chat_memory[-MEMORY_LIMIT:],
+        "started": started,
+    }
 
-        is_reply_to_bot = (
-            message.reply_to_message and
-            message.reply_to_message.from_user.id == bot.get_me().id
-        ) if hasattr(message, 'reply_to_message') and message.reply_to_message else False
+def _deliver_reply(reply, ai_reply):
+    """Stores the exchange in chat memory and sends the answer."""
+    message, chat_id, is_private = reply["message"], reply["chat_id"], reply["is_private"]
+    chat_memory = reply["memory"]
+    chat_memory.append({
+        "role": "assistant", 
+        "content": ai_reply,
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    })
 
-        # In groups, only respond to mentions or replies
-        # Exception: if group_id is provided, we force send
-        if group_id is None and not is_private and not (is_reply_to_bot or is_mentioned):
+    if is_private:
+        memory.chat_memory[(reply["user_id"], None, "private")] = chat_memory[-MEMORY_LIMIT:]
+    else:
+        memory.chat_memory[(None, chat_id, reply["chat_type"])] = chat_memory[-MEMORY_LIMIT:]
+
+    memory.save_memory()
+
+    bot.send_message(
+        chat_id,
+        ai_reply,
+        message_thread_id=reply["thread_id"],
+        reply_to_message_id=message.message_id if hasattr(message, 'message_id') and not is_private else None
+    )
+
+    logging.info(
+        f"AI response sent to {'user' if is_private else 'group'} {chat_id}",
+        extra={"latency_ms": round((time.monotonic() - reply["started"]) * 1000)}
+    )
+
+def _retry_wait(error, attempt):
+    _count_llm("errors")
+    wait_time = (2 ** attempt) + random.uniform(0, 1)
+    logging.error(f"AI backend error: {error}, retrying in {wait_time:.2f}s (Attempt {attempt + 1}/{MAX_RETRIES})")
+    return wait_time
+
+def _give_up(reply):
+    if reply["group_id"] is None: # Only complain if prompted by user
+        bot.send_message(reply["chat_id"], "Ugh, my brain lagged out. Try again later! 😭")
+    logging.error(f"All {MAX_RETRIES} attempts failed for chat {reply['chat_id']}")
+
+def _report_error(message, error):
+    try:
+        if hasattr(message, 'chat'):
+            bot.send_message(message.chat.id, "Oops, something went wrong.")
+        logging.error(f"AI response error: {error}")
+        logging.error("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+    except:
+        logging.critical("Critical error in error handler")
+
+def _completion(response):
+    return response.choices[0].message.content.strip() if response.choices else None
+
+def process_ai_response(message, group_id=None, message_text=None):
+    try:
+        reply = _prepare_reply(message, group_id, message_text)
+        if reply is None:
             return
 
-        # Choose the right memory context
-        if is_private:
-            chat_memory = memory.chat_memory.get(user_id, None, "private", [])
-        else:
-            chat_memory = memory.chat_memory.get(None, chat_id, chat_type, [])
+        for attempt in range(MAX_RETRIES):
+            try:
+                _count_llm("in_flight")
+                _count_llm("calls")
+                try:
+                    response = client.chat.completions.create(
+                        model=AI_MODEL,
+                        messages=reply["conversation"],
+                        temperature=TEMPERATURE,
+                        top_p=TOP_P
+                    )
+                finally:
+                    _count_llm("in_flight", -1)
+
+                ai_reply = _completion(response)
+                if ai_reply is not None:
+                    _deliver_reply(reply, ai_reply)
+                    return
 
-        # Get formatted timestamp
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            except Exception as e:
+                time.sleep(_retry_wait(e, attempt))
 
-        # Add user message
-        chat_memory.append({
-            "role": "user", 
-            "content": f"{user_name}: {clean_text}",
-            "timestamp": timestamp
-        })
+        _give_up(reply)
 
-        # Personalize system prompt for DMs
-        system_message = system_prompt
-        if is_private:
-            system_message = f"{system_prompt} Always refer to the user by their name: {user_name}."
+    except Exception as e:
+        _report_error(message, e)
 
-        conversation = [{"role": "system", "content": system_message}] + chat_memory[-MEMORY_LIMIT:]
+async def process_ai_response_async(message, group_id=None, message_text=None):
+    """process_ai_response() for the asyncio engine: the LLM call is awaited, not waited on by a thread."""
+    try:
+        reply = await engine.run_blocking(_prepare_reply, message, group_id, message_text, engine.me.id)
+        if reply is None:
+            return
 
         for attempt in range(MAX_RETRIES):
             try:
-                response = client.chat.completions.create(
-                    model=AI_MODEL,
-                    messages=conversation,
-                    temperature=TEMPERATURE,
-                    top_p=TOP_P
-                )
-
-                if response.choices:
-                    ai_reply = response.choices[0].message.content.strip()
-                    chat_memory.append({
-                        "role": "assistant", 
-                        "content": ai_reply,
-                        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
-                    })
-
-                    if is_private:
-                        memory.chat_memory[(user_id, None, "private")] = chat_memory[-MEMORY_LIMIT:]
-                    else:
-                        memory.chat_memory[(None, chat_id, chat_type)] = chat_memory[-MEMORY_LIMIT:]
-
-                    memory.save_memory()
-
-                    bot.send_message(
-                        chat_id,
-                        ai_reply,
-                        message_thread_id=message_thread_id,
-                        reply_to_message_id=message.message_id if hasattr(message, 'message_id') and not is_private else None
+                _count_llm("in_flight")
+                _count_llm("calls")
+                try:
+                    response = await async_client.chat.completions.create(
+                        model=AI_MODEL,
+                        messages=reply["conversation"],
+                        temperature=TEMPERATURE,
+                        top_p=TOP_P
                     )
+                finally:
+                    _count_llm("in_flight", -1)
 
-                    logging.info(f"AI response sent to {'user' if is_private else 'group'} {chat_id}")
+                ai_reply = _completion(response)
+                if ai_reply is not None:
+                    await engine.run_blocking(_deliver_reply, reply, ai_reply)
                     return
 
             except Exception as e:
-                wait_time = (2 ** attempt) + random.uniform(0, 1)
-                logging.error(f"AI backend error: {e}, retrying in {wait_time:.2f}s (Attempt {attempt + 1}/{MAX_RETRIES})")
-                time.sleep(wait_time)
+                await asyncio.sleep(_retry_wait(e, attempt))
 
-        if group_id is None: # Only complain if prompted by user
-            bot.send_message(chat_id, "Ugh, my brain lagged out. Try again later! 😭")
-        logging.error(f"All {MAX_RETRIES} attempts failed for chat {chat_id}")
+        await engine.run_blocking(_give_up, reply)
 
     except Exception as e:
-        try:
-            if hasattr(message, 'chat'):
-                bot.send_message(message.chat.id, "Oops, something went wrong.")
-            logging.error(f"AI response error: {e}")
-            logging.error(traceback.format_exc())
-        except:
-            logging.critical("Critical error in error handler")
+        await engine.run_blocking(_report_error, message, e)
 
 logging.info("Zuzu is online and ready to slay!")
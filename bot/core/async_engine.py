@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from telebot.async_telebot import AsyncTeleBot
+from config import BOT_TOKEN, ASYNC_HANDLER_THREADS, ASYNC_IO_THREADS
+
+# ========== Asyncio Worker Engine ========== #
+# WORKER_ENGINE=asyncio. Updates still come in through the sync bot (polling or IPC) but
+# are dispatched by telebot's AsyncTeleBot on one event loop instead of the sync bot's
+# thread pool. Handlers keep being registered on the sync bot; the engine copies them
+# with their filters. A handler with a coroutine port (@native) runs on the loop, so a
+# reply waiting on the LLM holds a coroutine instead of a thread; the rest run unchanged
+# on a bounded pool. Coroutines hand blocking work (SQLite, Fernet, Bot API sends, which
+# stay paced by the dispatcher) to run_blocking().
+
+_natives = {}   # sync handler -> coroutine port
+
+def native(sync_func):
+    """Registers the decorated coroutine to run instead of `sync_func` on the asyncio engine."""
+    def decorator(coro):
+        _natives[sync_func] = coro
+        return coro
+    return decorator
+
+class AsyncEngine:
+    def __init__(self, handler_threads=ASYNC_HANDLER_THREADS, io_threads=ASYNC_IO_THREADS):
+        self.handler_threads = handler_threads
+        self.io_threads = io_threads
+        self.handler_pool = None
+        self.io_pool = None
+        self.bot = None
+        self.loop = None
+        self.me = None
+        self.pending = 0        # update batches handed to the loop and not finished
+        self.stats = {"batches": 0, "native": 0, "pooled": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def start(self, sync_bot, track):
+        """
+        Starts the loop thread, copies sync_bot's handlers and routes its process_new_updates
+        (polling and IPC) here. track(update, name) is the context manager every handler runs in.
+        """
+        self.handler_pool = ThreadPoolExecutor(self.handler_threads, thread_name_prefix="handler")
+        self.io_pool = ThreadPoolExecutor(self.io_threads, thread_name_prefix="async-io")
+        self.bot = AsyncTeleBot(BOT_TOKEN)
+        self._mirror(sync_bot, track)
+        self.me = sync_bot.get_me()
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.io_pool)
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="async-engine").start()
+        sync_bot.process_new_updates = partial(self._submit, sync_bot)
+        logging.info(f"Asyncio engine started ({len(_natives)} native handlers)")
+
+    def _mirror(self, sync_bot, track):
+        pairs = (
+            (sync_bot.message_handlers, self.bot.message_handlers),
+            (sync_bot.callback_query_handlers, self.bot.callback_query_handlers),
+        )
+        for source, target in pairs:
+            for handler in source:
+                target.append({**handler, "function": self._adapt(handler["function"], track)})
+
+    def _adapt(self, func, track):
+        # Registered handlers are already instrumented; ports are keyed by the original function
+        original = getattr(func, "__wrapped__", func)
+        coro = _natives.get(original)
+        if coro is not None:
+            async def handler(update):
+                self._count("native")
+                with track(update, original.__name__):
+                    await coro(update)
+        else:
+            async def handler(update):
+                self._count("pooled")
+                await self.loop.run_in_executor(self.handler_pool, func, update)
+        return handler
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _submit(self, sync_bot, updates):
+        """Replaces sync_bot.process_new_updates: hands the batch to the loop without waiting for it."""
+        if not updates:
+            return
+        sync_bot.last_update_id = max(sync_bot.last_update_id, max(u.update_id for u in updates))
+        with self.lock:
+            self.pending += 1
+            self.stats["batches"] += 1
+        future = asyncio.run_coroutine_threadsafe(self.bot.process_new_updates(updates), self.loop)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+        if not future.cancelled() and future.exception() is not None:
+            self._count("errors")
+            logging.error(f"Update batch failed on the asyncio engine: {future.exception()}")
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Awaits a blocking call on the IO pool; the caller's log context goes along."""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.io_pool, partial(context.run, func, *args, **kwargs)
+        )
+
+    def idle(self):
+        with self.lock:
+            return self.pending == 0
+
+    def snapshot(self):
+        if self.loop is None:
+            return {"mode": "threads"}
+        with self.lock:
+            return {"mode": "asyncio", "pending": self.pending, **self.stats}
+
+engine = AsyncEngine()
@@ -1,5 +1,12 @@
 import telebot
-from config import BOT_TOKEN
+from config import BOT_TOKEN, TELEGRAM_API_URL
+from core import dispatcher
+
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
+
+# Every Bot API call goes through the outbound dispatcher (pacing, ordering, retry_after)
+dispatcher.install()
 
 # Initialize the bot
 bot = telebot.TeleBot(BOT_TOKEN)
@@ -0,0 +1,346 @@
+import fcntl
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import BROADCAST_DB_FILE, BROADCAST_CONCURRENCY, GROUPS_FILE, WORKER_SHARD, WORKER_COUNT
+from core.bot_instance import bot
+from core.dispatcher import background_traffic
+from core.helper import atomic_write
+
+# ========== Broadcast Engine ========== #
+# A broadcast is a job row plus one target row per group. Sends run on a small pool as
+# background traffic: the outbound dispatcher paces them (and retries retry_after)
+# behind live replies, and this pool waits for each outcome. A 429 from a full or
+# slow chat queue is retried here like Telegram's own.
+# Every target's outcome is committed as it happens, so a job interrupted by a restart
+# resumes with only the groups still pending. A job belongs to the worker that started
+# it; only that worker (or the first one, if its shard is gone) resumes it.
+# groups.txt is shared by every worker: appends and the /prunegroups rewrite take a
+# file lock, and each sighting of the bot in a group is recorded so a group that was
+# dead once but has the bot back isn't pruned for its old outcome.
+
+PROGRESS_INTERVAL = 3   # seconds between progress message edits
+MAX_ATTEMPTS = 3        # per group, for 429s and transient errors
+
+DB_CONN = None
+DB_LOCK = threading.Lock()
+_runner = None
+_runner_lock = threading.Lock()
+_stop = threading.Event()
+
+def init_db():
+    global DB_CONN
+    with DB_LOCK:
+        if DB_CONN is not None:
+            return
+        DB_CONN = sqlite3.connect(BROADCAST_DB_FILE, check_same_thread=False)
+        cursor = DB_CONN.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL;")
+        cursor.execute("PRAGMA synchronous=NORMAL;")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            report_chat_id INTEGER,
+            report_message_id INTEGER,
+            created REAL NOT NULL,
+            finished REAL
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_targets (
+            job_id INTEGER NOT NULL,
+            chat_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            new_chat_id TEXT,
+            PRIMARY KEY (job_id, chat_id)
+        )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_targets_status ON broadcast_targets (job_id, status)")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS group_joins (
+            chat_id TEXT PRIMARY KEY,
+            joined REAL NOT NULL
+        )
+        ''')
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(broadcast_jobs)")}
+        if "shard" not in columns:
+            cursor.execute("ALTER TABLE broadcast_jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+        DB_CONN.commit()
+
+def _execute(query, params=(), fetch=False):
+    with DB_LOCK:
+        cursor = DB_CONN.cursor()
+        cursor.execute(query, params)
+        DB_CONN.commit()
+        return cursor.fetchall() if fetch else cursor.lastrowid
+
+@contextmanager
+def groups_file_lock():
+    """Serializes changes to groups.txt across threads and worker processes."""
+    with open(GROUPS_FILE + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def add_group_id(chat_id):
+    """Registers a group for broadcasts and records that the bot is in it. Returns True if it was new."""
+    chat_id = str(chat_id)
+    init_db()
+    _execute(
+        "INSERT INTO group_joins (chat_id, joined) VALUES (?, ?) ON CONFLICT(chat_id) DO UPDATE SET joined = excluded.joined",
+        (chat_id, time.time())
+    )
+    with groups_file_lock():
+        if chat_id in load_group_ids():
+            return False
+        with open(GROUPS_FILE, "a") as f:
+            f.write(f"{chat_id}\n")
+    return True
+
+def load_group_ids():
+    try:
+        with open(GROUPS_FILE, "r") as f:
+            group_ids, seen = [], set()
+            for line in f:
+                gid = line.strip()
+                if gid and gid not in seen:
+                    seen.add(gid)
+                    group_ids.append(gid)
+            return group_ids
+    except FileNotFoundError:
+        return []
+
+# ========== Job Control ========== #
+def start_broadcast(text, report_chat_id):
+    """Creates a job for every registered group and starts sending. Returns the job id, or None if busy/empty."""
+    init_db()
+    if active_job() is not None:
+        return None
+    group_ids = load_group_ids()
+    if not group_ids:
+        return None
+
+    with DB_LOCK:
+        cursor = DB_CONN.cursor()
+        cursor.execute(
+            "INSERT INTO broadcast_jobs (text, status, report_chat_id, created, shard) VALUES (?, 'running', ?, ?, ?)",
+            (text, report_chat_id, time.time(), WORKER_SHARD)
+        )
+        job_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO broadcast_targets (job_id, chat_id) VALUES (?, ?)",
+            [(job_id, gid) for gid in group_ids]
+        )
+        DB_CONN.commit()
+
+    _start_runner(job_id)
+    return job_id
+
+def resume_broadcasts():
+    """Picks up a job that was still running when the worker stopped."""
+    init_db()
+    rows = _execute(
+        "SELECT id FROM broadcast_jobs WHERE status = 'running' AND (shard = ? OR (? = 0 AND shard >= ?)) "
+        "ORDER BY id DESC LIMIT 1",
+        (WORKER_SHARD, WORKER_SHARD, WORKER_COUNT), fetch=True
+    )
+    job_id = rows[0][0] if rows else None
+    if job_id is not None:
+        logging.info(f"Resuming broadcast job {job_id}")
+        _start_runner(job_id)
+
+def active_job():
+    init_db()
+    rows = _execute("SELECT id FROM broadcast_jobs WHERE status = 'running' ORDER BY id DESC LIMIT 1", fetch=True)
+    return rows[0][0] if rows else None
+
+def job_progress(job_id=None):
+    """Returns {"id", "status", "total", "<target status>": count, ...} for a job (latest by default)."""
+    init_db()
+    if job_id is None:
+        rows = _execute("SELECT id FROM broadcast_jobs ORDER BY id DESC LIMIT 1", fetch=True)
+        if not rows:
+            return None
+        job_id = rows[0][0]
+    job = _execute("SELECT status FROM broadcast_jobs WHERE id = ?", (job_id,), fetch=True)
+    if not job:
+        return None
+    counts = _execute(
+        "SELECT status, COUNT(*) FROM broadcast_targets WHERE job_id = ? GROUP BY status", (job_id,), fetch=True
+    )
+    progress = {"id": job_id, "status": job[0][0], "pending": 0, "sent": 0, "failed": 0, "dead": 0, "migrated": 0}
+    progress.update(dict(counts))
+    progress["total"] = sum(c for _, c in counts)
+    return progress
+
+def format_progress(progress):
+    done = progress["total"] - progress["pending"]
+    text = (
+        f"📢 Broadcast #{progress['id']} — {progress['status']}\n"
+        f"Progress: {done}/{progress['total']}\n"
+        f"✅ Sent: {progress['sent'] + progress['migrated']}  ❌ Failed: {progress['failed']}  💀 Dead: {progress['dead']}"
+    )
+    if progress["dead"] or progress["migrated"]:
+        text += "\nUse /prunegroups to clean up groups.txt."
+    return text
+
+def prune_dead_groups():
+    """
+    Removes groups whose latest broadcast outcome was dead (unless the bot was seen in
+    them since that job started) and swaps in migrated supergroup ids. Returns (removed, migrated).
+    """
+    init_db()
+    # SQLite takes the bare columns from the row with MAX(job_id): each chat's latest outcome
+    latest = _execute(
+        "SELECT t.chat_id, t.status, t.new_chat_id, j.created, MAX(t.job_id) FROM broadcast_targets t "
+        "JOIN broadcast_jobs j ON j.id = t.job_id WHERE t.status != 'pending' GROUP BY t.chat_id",
+        fetch=True
+    )
+    joined = dict(_execute("SELECT chat_id, joined FROM group_joins", fetch=True))
+    dead = {chat for chat, status, _, created, _ in latest if status == "dead" and joined.get(chat, 0) < created}
+    moved = {chat: new_chat for chat, status, new_chat, _, _ in latest if status == "migrated"}
+
+    with groups_file_lock():
+        kept, seen, removed, migrated = [], set(), 0, 0
+        for gid in load_group_ids():
+            if gid in dead:
+                removed += 1
+                continue
+            if gid in moved:
+                gid = moved[gid]
+                migrated += 1
+            if gid not in seen:
+                seen.add(gid)
+                kept.append(gid)
+        atomic_write(GROUPS_FILE, "".join(f"{gid}\n" for gid in kept).encode("utf-8"))
+    return removed, migrated
+
+# ========== Runner ========== #
+def _start_runner(job_id):
+    global _runner
+    with _runner_lock:
+        if _runner is not None and _runner.is_alive():
+            return
+        _runner = threading.Thread(target=_run_job, args=(job_id,), daemon=True)
+        _runner.start()
+
+def stop_runner():
+    """Stops sending after the in-flight groups; the job stays 'running' so the next worker resumes it."""
+    with _runner_lock:
+        runner = _runner
+    if runner is None or not runner.is_alive():
+        return
+    _stop.set()
+    runner.join()
+    _stop.clear()
+
+def _classify_error(error):
+    """Returns ('dead' | 'migrated' | 'retry' | 'failed', extra)."""
+    result_json = getattr(error, "result_json", None) or {}
+    code = result_json.get("error_code")
+    description = (result_json.get("description") or "").lower()
+    params = result_json.get("parameters") or {}
+    if code == 429:
+        return "retry", params.get("retry_after", 1)
+    if params.get("migrate_to_chat_id"):
+        return "migrated", str(params["migrate_to_chat_id"])
+    if code == 403 or "chat not found" in description or "bot was kicked" in description:
+        return "dead", None
+    if code is None or code >= 500:
+        return "retry", 1  # Network trouble or Telegram hiccup
+    return "failed", None
+
+def _send_to_group(job_id, chat_id, text):
+    target = chat_id
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            bot.send_message(target, text)
+            status, extra = ("migrated", target) if target != chat_id else ("sent", None)
+            break
+        except Exception as e:
+            status, extra = _classify_error(e)
+            if status == "migrated" and target == chat_id:
+                target = extra
+                continue
+            if status == "retry" and attempt < MAX_ATTEMPTS - 1:
+                time.sleep(extra)
+                continue
+            if status == "retry":
+                status = "failed"
+            logging.warning(f"Broadcast {job_id}: {chat_id} -> {status}: {e}")
+            extra = str(e) if status != "migrated" else extra
+            break
+
+    if status == "migrated":
+        _execute(
+            "UPDATE broadcast_targets SET status = ?, new_chat_id = ? WHERE job_id = ? AND chat_id = ?",
+            (status, extra, job_id, chat_id)
+        )
+    else:
+        _execute(
+            "UPDATE broadcast_targets SET status = ?, error = ? WHERE job_id = ? AND chat_id = ?",
+            (status, extra if status != "sent" else None, job_id, chat_id)
+        )
+
+def _report(job_id, progress):
+    rows = _execute("SELECT report_chat_id, report_message_id FROM broadcast_jobs WHERE id = ?", (job_id,), fetch=True)
+    if not rows or not rows[0][0]:
+        return
+    chat_id, message_id = rows[0]
+    text = format_progress(progress)
+    try:
+        if message_id:
+            bot.edit_message_text(text, chat_id, message_id)
+        else:
+            msg = bot.send_message(chat_id, text)
+            _execute("UPDATE broadcast_jobs SET report_message_id = ? WHERE id = ?", (msg.message_id, job_id))
+    except Exception as e:
+        # "message is not modified" and similar are harmless
+        logging.debug(f"Broadcast {job_id}: progress update skipped: {e}")
+
+def _run_job(job_id):
+    with background_traffic():
+        _run_job_inner(job_id)
+
+def _run_job_inner(job_id):
+    text = _execute("SELECT text FROM broadcast_jobs WHERE id = ?", (job_id,), fetch=True)[0][0]
+    pending = [r[0] for r in _execute(
+        "SELECT chat_id FROM broadcast_targets WHERE job_id = ? AND status = 'pending'", (job_id,), fetch=True
+    )]
+    logging.info(f"Broadcast {job_id}: {len(pending)} groups to send")
+
+    slots = threading.BoundedSemaphore(BROADCAST_CONCURRENCY)
+    last_report = 0
+    _report(job_id, job_progress(job_id))
+
+    def send(chat_id):
+        try:
+            with background_traffic():
+                _send_to_group(job_id, chat_id, text)
+        except Exception as e:
+            logging.error(f"Broadcast {job_id}: unexpected error for {chat_id}: {e}")
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=BROADCAST_CONCURRENCY, thread_name_prefix="broadcast") as pool:
+        for chat_id in pending:
+            if _stop.is_set():
+                break
+            slots.acquire()
+            pool.submit(send, chat_id)
+            if time.time() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.time()
+                _report(job_id, job_progress(job_id))
+
+    if _stop.is_set():
+        logging.info(f"Broadcast {job_id}: paused for handoff")
+        return
+    _execute("UPDATE broadcast_jobs SET status = 'done', finished = ? WHERE id = ?", (time.time(), job_id))
+    progress = job_progress(job_id)
+    _report(job_id, progress)
+    logging.info(f"Broadcast {job_id} finished: {progress}")
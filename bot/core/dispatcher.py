@@ -0,0 +1,405 @@
+import json
+import threading
+import time
+import logging
+from collections import deque, Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+import requests
+from telebot import apihelper
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST,
+                    OUTBOUND_SENDERS, OUTBOUND_CHAT_QUEUE, OUTBOUND_SEND_TIMEOUT, WORKER_COUNT)
+from core.ratelimit import TokenBucket
+
+# ========== Outbound Bot API Dispatcher ========== #
+# Installed as telebot's CUSTOM_REQUEST_SENDER, so every bot.send_message / reply_to /
+# send_photo / delete_message from any module passes through here without changes
+# at the call sites. Sends are queued per chat and a few dedicated sender threads
+# drain the queues: one send in flight per chat (FIFO), a per-chat rate, a global
+# token bucket where replies go ahead of background traffic (broadcasts, scheduled
+# actions), 429s retried after retry_after. The caller waits for Telegram's answer,
+# but only up to OUTBOUND_SEND_TIMEOUT: a send still queued by then is withdrawn, and
+# one to a chat that already has OUTBOUND_CHAT_QUEUE waiting is refused. Both fail
+# like a Telegram 429 (ApiTelegramException with retry_after), so the caller's usual
+# error handling sees them. Fire-and-forget notices can opt out of waiting with
+# send_later(): to a backlogged chat they are queued and answered at once with a
+# placeholder (message_id 0), and a later failure is only logged. Code that needs the
+# sent message (to delete it later) gets it from an after_send() callback.
+# Repeated chat actions ("typing") are answered locally while the last one is live.
+# With several workers each one gets an equal share of the global rate; per-chat queues
+# need no sharing since a chat always lands on the same worker.
+
+# Methods that count against a chat's message limit (and keep per-chat order)
+CHAT_PACED_PREFIXES = ("send", "edit", "copy", "forward")
+# Methods that only take a global token
+GLOBAL_ONLY_METHODS = {
+    "deleteMessage", "deleteMessages", "answerCallbackQuery", "restrictChatMember",
+    "banChatMember", "unbanChatMember", "pinChatMessage", "unpinChatMessage", "sendChatAction"
+}
+# Paced methods whose result is a list of messages
+LIST_RESULT_METHODS = {"sendMediaGroup", "forwardMessages", "copyMessages"}
+CHAT_ACTION_TTL = 5     # seconds Telegram keeps showing a chat action
+MAX_RETRIES = 3
+LANE_IDLE_TTL = 600     # drop per-chat state after 10 idle minutes
+
+_local = threading.local()
+
+@contextmanager
+def background_traffic():
+    """Marks Bot API calls made inside the block as low priority."""
+    previous = getattr(_local, "background", False)
+    _local.background = True
+    try:
+        yield
+    finally:
+        _local.background = previous
+
+@contextmanager
+def send_later():
+    """
+    Bot API calls made inside the block don't wait for a backlogged chat: they are queued
+    and return a placeholder (message_id 0) at once. Failures after that are only logged.
+    """
+    previous = getattr(_local, "later", False)
+    _local.later = True
+    try:
+        yield
+    finally:
+        _local.later = previous
+
+@contextmanager
+def after_send(callback):
+    """Calls callback(result) with Telegram's result for each call made inside the block, once it succeeded."""
+    previous = getattr(_local, "after_send", None)
+    _local.after_send = callback
+    try:
+        yield
+    finally:
+        _local.after_send = previous
+
+def _is_background():
+    return getattr(_local, "background", False)
+
+class _Send:
+    """One queued Bot API call."""
+    __slots__ = ("method", "url", "kwargs", "background", "detached", "attempts", "future")
+
+    def __init__(self, method, url, kwargs, background):
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.background = background
+        self.detached = False       # the caller already got a placeholder answer
+        self.attempts = 0
+        self.future = Future()
+
+class _ChatLane:
+    """Send queue plus rate limit for one chat."""
+    def __init__(self, chat_id, rate, burst):
+        self.chat_id = chat_id
+        self.bucket = TokenBucket(rate, burst)
+        self.sends = deque()
+        self.busy = False           # a send for this chat is in flight
+        self.last_used = time.monotonic()
+
+class OutboundDispatcher:
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE / WORKER_COUNT, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, burst=OUTBOUND_CHAT_BURST, senders=OUTBOUND_SENDERS,
+                 chat_queue=OUTBOUND_CHAT_QUEUE, send_timeout=OUTBOUND_SEND_TIMEOUT, sender=None):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.senders = senders
+        self.chat_queue = chat_queue
+        self.send_timeout = send_timeout
+        self.sender = sender or (lambda method, url, **kwargs: apihelper._get_req_session().request(method, url, **kwargs))
+        self.cond = threading.Condition()
+        self.lanes = {}
+        self.backlog = {}           # chat_id -> lane, lanes with queued sends, oldest first
+        self.unordered = deque()    # global-only calls, no per-chat order
+        self.in_flight = 0
+        self.threads = []
+        self.last_sweep = time.monotonic()
+        self.chat_actions = {}
+        self.priority_cond = threading.Condition()
+        self.foreground_waiting = 0
+        self.stats = Counter()
+
+    # ----- pacing -----
+    def _lane(self, chat_id):
+        """Caller holds self.cond."""
+        now = time.monotonic()
+        if now - self.last_sweep > LANE_IDLE_TTL:
+            self.last_sweep = now
+            for key in [k for k, lane in self.lanes.items()
+                        if not lane.sends and not lane.busy and now - lane.last_used > LANE_IDLE_TTL]:
+                del self.lanes[key]
+        lane = self.lanes.get(chat_id)
+        if lane is None:
+            # Negative ids are groups/channels, which Telegram limits harder
+            rate = self.group_rate if str(chat_id).startswith("-") else self.chat_rate
+            lane = self.lanes[chat_id] = _ChatLane(chat_id, rate, self.burst)
+        return lane
+
+    def _acquire_global(self, background):
+        if not background:
+            with self.priority_cond:
+                self.foreground_waiting += 1
+        try:
+            while True:
+                if background:
+                    with self.priority_cond:
+                        # Let replies go first
+                        while self.foreground_waiting:
+                            self.priority_cond.wait(0.1)
+                wait = self.global_bucket.try_acquire()
+                if not wait:
+                    return
+                time.sleep(min(wait, 0.05) if background else wait)
+        finally:
+            if not background:
+                with self.priority_cond:
+                    self.foreground_waiting -= 1
+                    self.priority_cond.notify_all()
+
+    def _collapse_chat_action(self, params):
+        key = (str(params.get("chat_id")), params.get("action"), params.get("message_thread_id"))
+        now = time.monotonic()
+        with self.cond:
+            if self.chat_actions.get(key, 0) > now:
+                return True
+            if len(self.chat_actions) > 10000:
+                self.chat_actions = {k: v for k, v in self.chat_actions.items() if v > now}
+            self.chat_actions[key] = now + CHAT_ACTION_TTL
+        return False
+
+    # ----- sender threads -----
+    def _ensure_senders(self):
+        """Caller holds self.cond."""
+        while len(self.threads) < self.senders:
+            thread = threading.Thread(target=self._sender_loop, daemon=True, name=f"outbound_{len(self.threads)}")
+            self.threads.append(thread)
+            thread.start()
+
+    def _next_send(self):
+        """
+        Caller holds self.cond. Returns (send, lane, 0) for the next call to make, replies
+        before background traffic, or (None, None, seconds until a chat has a token).
+        """
+        soonest = None
+        for background in (False, True):
+            for send in self.unordered:
+                if send.background == background:
+                    self.unordered.remove(send)
+                    return send, None, 0
+            for lane in list(self.backlog.values()):
+                if lane.busy or lane.sends[0].background != background:
+                    continue
+                wait = lane.bucket.try_acquire()
+                if wait:
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    continue
+                send = lane.sends.popleft()
+                del self.backlog[lane.chat_id]
+                if lane.sends:
+                    self.backlog[lane.chat_id] = lane  # to the back of the line
+                lane.busy = True
+                return send, lane, 0
+        return None, None, soonest
+
+    def _sender_loop(self):
+        while True:
+            with self.cond:
+                send, lane, wait = self._next_send()
+                while send is None:
+                    self.cond.wait(wait)
+                    send, lane, wait = self._next_send()
+                self.in_flight += 1
+            self._acquire_global(send.background)
+            response, error = None, None
+            try:
+                response = self.sender(send.method, send.url, **send.kwargs)
+                self.stats["sent"] += 1
+            except Exception as e:
+                error = e
+            retry = self._retry_after(response) if response is not None else None
+            if retry is not None:
+                self.stats["429"] += 1
+                retry = retry if send.attempts < MAX_RETRIES else None
+            with self.cond:
+                self.in_flight -= 1
+                if lane is not None:
+                    lane.busy = False
+                    lane.last_used = time.monotonic()
+                if retry is not None:
+                    # Same place in line, after Telegram's wait
+                    logging.warning(f"Bot API 429 on {send.url.rsplit('/', 1)[-1]}, retrying in {retry}s")
+                    (lane.bucket if lane is not None else self.global_bucket).pause(retry)
+                    self.stats["retried"] += 1
+                    send.attempts += 1
+                    self._rewind(send.kwargs.get("files"))
+                    if lane is not None:
+                        lane.sends.appendleft(send)
+                        self.backlog.setdefault(lane.chat_id, lane)
+                    else:
+                        self.unordered.appendleft(send)
+                self.cond.notify_all()
+            if retry is None:
+                self._resolve(send, response, error)
+
+    def _resolve(self, send, response, error):
+        if send.detached and (error is not None or response.status_code != 200):
+            self.stats["failed_queued"] += 1
+            detail = error if error is not None else f"{response.status_code} {response.text[:200]}"
+            logging.warning(f"Queued {send.url.rsplit('/', 1)[-1]} failed: {detail}")
+        if error is not None:
+            send.future.set_exception(error)
+        else:
+            send.future.set_result(response)
+
+    # ----- sending -----
+    @staticmethod
+    def _ok_response(result=True):
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = json.dumps({"ok": True, "result": result}).encode()
+        return response
+
+    @staticmethod
+    def _rejected(retry_after, reason):
+        """A Telegram-style 429, which telebot raises as ApiTelegramException."""
+        response = requests.models.Response()
+        response.status_code = 429
+        response._content = json.dumps({
+            "ok": False, "error_code": 429, "description": f"Too Many Requests: {reason}",
+            "parameters": {"retry_after": retry_after}
+        }).encode()
+        return response
+
+    @staticmethod
+    def _placeholder(method_name, chat_id):
+        """What a queued call answers right away: the shape telebot expects, with message_id 0."""
+        if method_name.startswith("edit"):
+            return True
+        if method_name in LIST_RESULT_METHODS:
+            return []
+        if method_name == "copyMessage":
+            return {"message_id": 0}
+        chat_type = "supergroup" if str(chat_id).startswith("-") else "private"
+        return {"message_id": 0, "date": int(time.time()), "chat": {"id": chat_id, "type": chat_type}}
+
+    @staticmethod
+    def _retry_after(response):
+        if response.status_code != 429:
+            return None
+        try:
+            return response.json().get("parameters", {}).get("retry_after", 1)
+        except ValueError:
+            return 1
+
+    @staticmethod
+    def _rewind(files):
+        for value in (files or {}).values():
+            handle = value[1] if isinstance(value, tuple) else value
+            if hasattr(handle, "seek"):
+                try:
+                    handle.seek(0)
+                except Exception:
+                    pass
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        """CUSTOM_REQUEST_SENDER entry point: same signature and return value as requests.request."""
+        method_name = url.rsplit("/", 1)[-1]
+        kwargs.update(params=params, files=files)
+        params = params or {}
+
+        if method_name == "sendChatAction" and self._collapse_chat_action(params):
+            self.stats["collapsed"] += 1
+            return self._ok_response()
+
+        paced = method_name in GLOBAL_ONLY_METHODS or method_name.startswith(CHAT_PACED_PREFIXES)
+        if not paced:
+            # Reads (getUpdates, getMe, getChatAdministrators, ...) are not paced
+            return self.sender(method, url, **kwargs)
+
+        send = _Send(method, url, kwargs, _is_background())
+        chat_id = params.get("chat_id")
+        lane = None
+        with self.cond:
+            if method_name in GLOBAL_ONLY_METHODS or chat_id is None:
+                self.unordered.append(send)
+            else:
+                lane = self._lane(str(chat_id))
+                if len(lane.sends) >= self.chat_queue:
+                    self.stats["rejected"] += 1
+                    logging.warning(f"Outbound queue for chat {chat_id} is full, refused {method_name}")
+                    return self._rejected(self._queue_wait(lane), "outbound queue for this chat is full")
+                backlogged = lane.sends or lane.busy or lane.bucket.ready_in()
+                # Uploads always wait: the caller may close the file as soon as the call returns
+                if backlogged and getattr(_local, "later", False) and not files:
+                    send.detached = True
+                    self.stats["queued"] += 1
+                lane.sends.append(send)
+                self.backlog.setdefault(str(chat_id), lane)
+            self._ensure_senders()
+            self.cond.notify()
+        callback = getattr(_local, "after_send", None)
+        if callback is not None:
+            send.future.add_done_callback(lambda future: self._call_back(callback, future))
+        if send.detached:
+            return self._ok_response(self._placeholder(method_name, chat_id))
+        try:
+            return send.future.result(timeout=self.send_timeout)
+        except FutureTimeout:
+            pass
+        with self.cond:
+            withdrawn = self._withdraw(send, lane)
+            retry_after = self._queue_wait(lane) if lane is not None else 1
+        if withdrawn:
+            self.stats["timed_out"] += 1
+            logging.warning(f"Outbound {method_name} to chat {chat_id} waited {self.send_timeout:g}s, withdrawn")
+            return self._rejected(retry_after, "outbound queue wait timed out")
+        # Already on the wire; its answer is moments away
+        return send.future.result()
+
+    def _withdraw(self, send, lane):
+        """Caller holds self.cond. Takes a send that hasn't started out of its queue; False if it has."""
+        queue = lane.sends if lane is not None else self.unordered
+        if send not in queue:
+            return False
+        queue.remove(send)
+        if lane is not None and not lane.sends:
+            self.backlog.pop(lane.chat_id, None)
+        return True
+
+    @staticmethod
+    def _queue_wait(lane):
+        """Caller holds self.cond. Rough seconds until a chat's queue has drained."""
+        return max(1, int(len(lane.sends) / lane.bucket.rate + 0.999))
+
+    @staticmethod
+    def _call_back(callback, future):
+        if future.exception() is not None or future.result().status_code != 200:
+            return
+        try:
+            callback(future.result().json()["result"])
+        except Exception as e:
+            logging.error(f"after_send callback failed: {e}")
+
+    def idle(self):
+        with self.cond:
+            return not self.backlog and not self.unordered and not self.in_flight
+
+    def snapshot(self):
+        with self.cond:
+            lanes = len(self.lanes)
+            waiting = sum(len(lane.sends) for lane in self.backlog.values()) + len(self.unordered)
+            in_flight = self.in_flight
+        return {"lanes": lanes, "waiting": waiting, "in_flight": in_flight, **self.stats}
+
+dispatcher = OutboundDispatcher()
+
+def install(dispatcher=dispatcher):
+    """Routes all of telebot's Bot API requests through the dispatcher."""
+    apihelper.CUSTOM_REQUEST_SENDER = dispatcher.request
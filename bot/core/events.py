@@ -0,0 +1,118 @@
+import json
+import queue
+import threading
+import time
+import logging
+
+# ========== Dashboard Event Hub ========== #
+# Server-Sent Events for the dashboard. Producers are registered as sources (a function
+# and an interval); one sampler thread runs them while at least one browser is connected
+# and publishes only when a value changes, so the work is shared by every client.
+# Each client gets a small queue of pre-encoded frames; a client that falls behind is
+# told to resync instead of holding up the others.
+
+TICK = 0.5
+CLIENT_QUEUE_SIZE = 256
+KEEPALIVE = 15
+
+class EventHub:
+    def __init__(self, tick=TICK):
+        self.tick = tick
+        self.sources = {}
+        self.subscribers = set()
+        self.latest = {}        # event -> last frame, replayed to new clients
+        self.last_values = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_source(self, name, func, interval, replay=True):
+        """func() returns the event payload, or None for "nothing new"."""
+        with self.lock:
+            self.sources[name] = {"func": func, "interval": interval, "due": 0.0, "replay": replay}
+
+    def source(self, name, interval, replay=True):
+        def decorator(func):
+            self.add_source(name, func, interval, replay)
+            return func
+        return decorator
+
+    @staticmethod
+    def _frame(name, data):
+        return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    def publish(self, name, data, replay=True):
+        frame = self._frame(name, data)
+        with self.lock:
+            if replay:
+                self.latest[name] = frame
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(frame)
+            except queue.Full:
+                self._resync(q)
+
+    def _resync(self, q):
+        # Drop the backlog; the client refetches current state
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(self._frame("resync", {}))
+
+    def subscribe(self):
+        q = queue.Queue(CLIENT_QUEUE_SIZE)
+        with self.lock:
+            for frame in self.latest.values():
+                q.put_nowait(frame)
+            self.subscribers.add(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True, name="event-hub")
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def stream(self):
+        """Generator of SSE frames for one client; ends when the client disconnects."""
+        q = self.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(q)
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    # Nobody is watching; stop sampling until the next client connects
+                    self.thread = None
+                    self.last_values.clear()
+                    return
+                now = time.monotonic()
+                due = []
+                for name, source in self.sources.items():
+                    if source["due"] <= now:
+                        source["due"] = now + source["interval"]
+                        due.append((name, source))
+            for name, source in due:
+                try:
+                    value = source["func"]()
+                except Exception as e:
+                    logging.error(f"Event source '{name}' failed: {e}")
+                    continue
+                if value is None or (source["replay"] and self.last_values.get(name) == value):
+                    continue
+                self.last_values[name] = value
+                self.publish(name, value, replay=source["replay"])
+            time.sleep(self.tick)
+
+hub = EventHub()
@@ -1,8 +1,41 @@
+import logging
+import os
+import tempfile
+
 ## This is a help script to handle loading files from .txts . In the future it can be used for different functions.
 def load_from_file(filename, default_list=None):
     try:
         with open(filename, "r", encoding="utf-8") as file:
             return [line.strip() for line in file.readlines()]
     except Exception as e:
-        print(f"Error loading {filename}: {e}")
-        return default_list or []
\ No newline at end of file
+        logging.error(f"Error loading {filename}: {e}")
+        return default_list or []
+
+
+def get_retry_after(error):
+    """Returns the `retry_after` seconds from a Telegram 429 error, or None."""
+    result_json = getattr(error, "result_json", None) or {}
+    if result_json.get("error_code") != 429:
+        return None
+    return result_json.get("parameters", {}).get("retry_after", 1)
+
+
+def atomic_write(path, data):
+    """
+    Writes bytes to `path` via a temp file in the same directory, fsync and rename,
+    so readers never see a truncated file even if the process dies mid-write.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,172 @@
+import bisect
+import hashlib
+import queue
+import threading
+import time
+import logging
+from telebot import apihelper
+from config import (BOT_TOKEN, HOST_DOMAIN, UPDATE_MODE, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+                    WEBHOOK_BUFFER, POLLING_TIMEOUT, TELEGRAM_API_URL)
+from core import ipc
+
+# ========== Update Ingestion (supervisor) ========== #
+# With several workers, or in webhook mode, updates enter through the supervisor only:
+# Telegram POSTs to the webhook route, or the supervisor long-polls getUpdates itself
+# when the webhook can't be set. Each update goes to the worker that owns its chat,
+# picked on a consistent-hash ring, so one chat is always handled (in order, with its
+# memory cached) by the same worker and changing WORKER_COUNT moves few chats.
+# Every worker has a bounded buffer and one forwarding thread that sends batches over
+# IPC and retries while that worker restarts. A full buffer makes the webhook answer
+# 503 (Telegram redelivers) and the poller wait.
+
+BATCH_SIZE = 100
+FORWARD_TIMEOUT = 10
+RETRY_MAX = 2.0
+RING_REPLICAS = 64
+
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL   # the supervisor doesn't load core.bot_instance
+
+CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member",
+               "chat_member", "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost",
+               "removed_chat_boost", "business_message", "edited_business_message")
+
+def update_chat_id(update):
+    """The chat an update belongs to; the sender for chat-less updates (inline queries, poll answers)."""
+    for field in CHAT_FIELDS:
+        chat = (update.get(field) or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    callback = update.get("callback_query")
+    if callback and callback.get("message"):
+        return callback["message"]["chat"]["id"]
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if sender:
+                return sender.get("id")
+    return update.get("update_id")
+
+class HashRing:
+    def __init__(self, nodes, replicas=RING_REPLICAS):
+        points = []
+        for node in range(nodes):
+            for replica in range(replicas):
+                points.append((self._hash(f"{node}:{replica}"), node))
+        points.sort()
+        self.keys = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+    def node_for(self, key):
+        index = bisect.bisect(self.keys, self._hash(key)) % len(self.keys)
+        return self.nodes[index]
+
+class _Lane:
+    def __init__(self, shard, size):
+        self.shard = shard
+        self.buffer = queue.Queue(size)
+        self.stats = {"received": 0, "forwarded": 0, "rejected": 0, "retries": 0}
+
+class UpdateForwarder:
+    def __init__(self, size=WEBHOOK_BUFFER):
+        self.size = size
+        self.ring = None
+        self.lanes = []
+        self.socket_for = None
+
+    def start(self, workers, socket_for):
+        """Starts one forwarding thread per worker. socket_for(shard) returns that worker's current socket."""
+        self.ring = HashRing(workers)
+        self.socket_for = socket_for
+        self.lanes = [_Lane(shard, self.size) for shard in range(workers)]
+        for lane in self.lanes:
+            threading.Thread(target=self._loop, args=(lane,), daemon=True, name=f"forwarder-{lane.shard}").start()
+
+    def submit(self, update, timeout=0):
+        """Queues one update for its worker. Returns False if that worker's buffer stays full."""
+        lane = self.lanes[self.ring.node_for(update_chat_id(update))]
+        try:
+            lane.buffer.put(update, timeout=timeout) if timeout else lane.buffer.put_nowait(update)
+        except queue.Full:
+            lane.stats["rejected"] += 1
+            return False
+        lane.stats["received"] += 1
+        return True
+
+    def _send(self, lane, batch):
+        delay = 0.1
+        while True:
+            try:
+                ipc.call(self.socket_for(lane.shard), "updates", timeout=FORWARD_TIMEOUT, updates=batch)
+                lane.stats["forwarded"] += len(batch)
+                return
+            except ipc.IPCError as e:
+                # Worker down, in standby or draining: hold the batch until one is active
+                lane.stats["retries"] += 1
+                if lane.stats["retries"] % 50 == 1:
+                    logging.warning(f"Forwarding {len(batch)} updates to worker {lane.shard} failed, retrying: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX)
+
+    def _loop(self, lane):
+        while True:
+            batch = [lane.buffer.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(lane.buffer.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(lane, batch)
+
+    def snapshot(self):
+        return [{"shard": lane.shard, **lane.stats, "buffered": lane.buffer.qsize()} for lane in self.lanes]
+
+update_forwarder = UpdateForwarder()
+
+# ----- Sources -----
+def _webhook_url():
+    if WEBHOOK_URL:
+        return WEBHOOK_URL
+    if HOST_DOMAIN:
+        return f"https://{HOST_DOMAIN.split('://', 1)[-1].rstrip('/')}{WEBHOOK_PATH}"
+    return None
+
+def _poll_loop(forwarder):
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(BOT_TOKEN, offset=offset, timeout=POLLING_TIMEOUT,
+                                            long_polling_timeout=POLLING_TIMEOUT)
+        except Exception as e:
+            logging.error(f"getUpdates failed: {e}")
+            time.sleep(3)
+            continue
+        for update in updates:
+            # Wait for room rather than drop; the offset only moves past buffered updates
+            while not forwarder.submit(update, timeout=1):
+                pass
+            offset = update["update_id"] + 1
+
+def start_ingestion(forwarder=update_forwarder):
+    """Registers the webhook in webhook mode; otherwise, or if that fails, long-polls here. Returns the mode."""
+    if UPDATE_MODE == "webhook":
+        url = _webhook_url()
+        try:
+            if not url:
+                raise ValueError("neither WEBHOOK_URL nor HOST_DOMAIN is set")
+            apihelper.set_webhook(BOT_TOKEN, url=url, secret_token=WEBHOOK_SECRET)
+            logging.info(f"Receiving updates by webhook at {url}")
+            return "webhook"
+        except Exception as e:
+            logging.warning(f"Webhook not set, falling back to long polling: {e}")
+    try:
+        apihelper.delete_webhook(BOT_TOKEN)  # getUpdates is refused while a webhook is registered
+    except Exception as e:
+        logging.warning(f"Removing the webhook failed: {e}")
+    threading.Thread(target=_poll_loop, args=(forwarder,), daemon=True, name="update-poller").start()
+    logging.info("Receiving updates by long polling")
+    return "polling"
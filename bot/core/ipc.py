@@ -0,0 +1,163 @@
+import json
+import os
+import socket
+import threading
+import logging
+from config import WORKER_SOCKET, STATE_DIR, WORKER_COUNT, WORKER_SHARD
+
+# ========== Supervisor <-> Worker IPC ========== #
+# A Unix domain socket owned by the worker. The protocol is one JSON object per line:
+#   -> {"cmd": "metrics", "args": {...}}
+#   <- {"ok": true, "result": ...}  or  {"ok": false, "error": "..."}
+# The worker registers commands with @ipc_server.command(name); the supervisor calls
+# one worker with call() or all of them with worker_call_all(); a worker reaches the
+# other shards with peer_call_all(). Connections are
+# short-lived, one request each is typical but a client may send several lines.
+
+CALL_TIMEOUT = 3
+MAX_LINE = 1024 * 1024
+
+class IPCError(Exception):
+    pass
+
+class IPCServer:
+    def __init__(self):
+        self.commands = {}
+        self.path = None
+        self.sock = None
+
+    def command(self, name):
+        def decorator(func):
+            self.commands[name] = func
+            return func
+        return decorator
+
+    def start(self, path=WORKER_SOCKET):
+        self.path = path
+        try:
+            os.unlink(path)  # Stale socket from a previous run
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)
+        self.sock.listen(16)
+        threading.Thread(target=self._accept_loop, daemon=True, name="ipc-accept").start()
+        logging.info(f"IPC listening on {path}")
+
+    def stop(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.close()
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.sock = None
+
+    def _accept_loop(self):
+        while self.sock is not None:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True, name="ipc-conn").start()
+
+    def _dispatch(self, request):
+        func = self.commands.get(request.get("cmd"))
+        if func is None:
+            return {"ok": False, "error": f"unknown command {request.get('cmd')!r}"}
+        try:
+            return {"ok": True, "result": func(**(request.get("args") or {}))}
+        except IPCError as e:
+            # Refused on purpose (e.g. not active); the caller retries or reports it
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            logging.error(f"IPC command {request.get('cmd')} failed: {e}")
+            return {"ok": False, "error": str(e)}
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                if len(line) > MAX_LINE:
+                    break
+                try:
+                    response = self._dispatch(json.loads(line))
+                except ValueError:
+                    response = {"ok": False, "error": "malformed request"}
+                stream.write(json.dumps(response, default=str).encode() + b"\n")
+                stream.flush()
+
+ipc_server = IPCServer()
+
+def worker_socket_paths(shard):
+    """The two sockets a shard's worker alternates between, so a blue/green restart can overlap."""
+    return [os.path.join(STATE_DIR, f"worker{shard}-{side}.sock") for side in ("a", "b")]
+
+# ----- Supervisor side -----
+_worker_sockets = [WORKER_SOCKET]
+
+def set_worker_sockets(paths):
+    """Points worker calls at the current workers, one socket per shard (the supervisor updates it on swaps)."""
+    global _worker_sockets
+    _worker_sockets = list(paths)
+
+def call(path, cmd, timeout=CALL_TIMEOUT, **args):
+    """Sends one command to the worker listening on `path` and returns its result. Raises IPCError."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps({"cmd": cmd, "args": args}).encode() + b"\n")
+            with sock.makefile("rb") as stream:
+                line = stream.readline(MAX_LINE)
+    except (OSError, socket.timeout) as e:
+        raise IPCError(f"worker unreachable: {e}") from e
+    if not line:
+        raise IPCError("worker closed the connection")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise IPCError(response.get("error", "command failed"))
+    return response.get("result")
+
+def worker_call_all(cmd, timeout=CALL_TIMEOUT, **args):
+    """Sends a command to every worker at once. Returns one result, or the IPCError, per shard."""
+    paths = list(_worker_sockets)
+    results = [None] * len(paths)
+
+    def run(index):
+        try:
+            results[index] = call(paths[index], cmd, timeout=timeout, **args)
+        except IPCError as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(1, len(paths))]
+    for thread in threads:
+        thread.start()
+    run(0)
+    for thread in threads:
+        thread.join()
+    return results
+
+# ----- Worker side -----
+def peer_call_all(cmd, timeout=CALL_TIMEOUT, **args):
+    """
+    Sends a command to the workers of every other shard, through whichever of each shard's
+    sockets answer (both, mid-restart). Returns {shard: result or IPCError}.
+    """
+    results = {}
+    for shard in range(WORKER_COUNT):
+        if shard == WORKER_SHARD:
+            continue
+        results[shard] = IPCError("worker not running")
+        for path in worker_socket_paths(shard):
+            if not os.path.exists(path):
+                continue
+            try:
+                result = call(path, cmd, timeout=timeout, **args)
+            except IPCError as e:
+                if isinstance(results[shard], IPCError):
+                    results[shard] = e
+                continue
+            results[shard] = result
+    return results
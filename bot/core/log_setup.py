@@ -0,0 +1,155 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_FILE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_CONSOLE
+from core.logfile import SharedRotatingFileHandler
+
+# ========== Logging Pipeline ========== #
+# One setup for both processes. Handler threads only put the record on a bounded queue;
+# a listener thread formats and writes it (rotating bot.log, optionally stderr).
+# LOG_FORMAT=json writes one JSON object per line with chat_id/user_id/latency_ms
+# when known. LOG_LEVELS="dispatcher=DEBUG,werkzeug=WARNING" sets levels per module:
+# named loggers get the level directly, calls through the root logger (logging.info)
+# are matched on their module name. The chat/user context is a ContextVar, so every
+# thread and every asyncio task sees its own.
+
+QUEUE_SIZE = 10000
+CONTEXT_FIELDS = ("chat_id", "user_id", "latency_ms")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+_dropped = 0
+_plain = logging.Formatter()
+
+@contextmanager
+def log_context(**fields):
+    """Attaches fields (chat_id, user_id, ...) to every record logged by this thread or task inside the block."""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+class _ContextFilter(logging.Filter):
+    def __init__(self, role, module_levels, default_level):
+        super().__init__()
+        self.role = role
+        self.module_levels = module_levels
+        self.default_level = default_level
+
+    def _level_for(self, record):
+        if record.name == "root":
+            return self.module_levels.get(record.module, self.default_level)
+        name = record.name
+        while name:
+            if name in self.module_levels:
+                return self.module_levels[name]
+            name = name.rpartition(".")[0]
+        return self.default_level
+
+    def filter(self, record):
+        # Root is opened up to the lowest configured level; enforce per-module levels here
+        if record.levelno < self._level_for(record):
+            return False
+        record.role = self.role
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the writer falls behind, records are counted and dropped."""
+    def prepare(self, record):
+        # Merge args and render the traceback now; formatting happens on the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "proc": getattr(record, "role", None),
+            "module": record.module if record.name == "root" else record.name,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def _parse_levels(spec):
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in levels.items() if isinstance(level, int)}
+
+def setup_logging(role="worker"):
+    """Installs the queue handler on the root logger and starts the writer thread. Safe to call twice."""
+    global _listener
+    if _listener is not None:
+        return
+
+    default_level = logging.getLevelName(LOG_LEVEL.upper())
+    if not isinstance(default_level, int):
+        default_level = logging.INFO
+    module_levels = _parse_levels(LOG_LEVELS)
+    for name, level in module_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(f"%(asctime)s - %(levelname)s - [{role}] %(message)s")
+    handlers = [SharedRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)]
+    if LOG_CONSOLE:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter(role, module_levels, default_level))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(min([default_level, *module_levels.values()]))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """Drains the queue and stops the writer thread."""
+    global _listener
+    if _listener is None:
+        return
+    if _dropped:
+        logging.warning(f"Logging queue overflowed, {_dropped} records dropped")
+    _listener.stop()
+    _listener = None
@@ -0,0 +1,144 @@
+import os
+import fcntl
+from logging.handlers import RotatingFileHandler
+
+# ========== Log File Rotation & Tailing ========== #
+# The supervisor and the worker append to the same bot.log, so rotation takes a lock
+# file and re-checks the size on disk; a process that finds the file already rotated
+# underneath it just reopens. Readers never load the whole file: tail_lines() seeks
+# backwards from the end, read_since() returns only bytes after a cursor and follows
+# the cursor into bot.log.1 when a rotation happened in between.
+
+TAIL_BLOCK = 8192
+MAX_READ_BYTES = 256 * 1024   # per incremental read; older backlog is skipped
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that is safe to share between processes appending to one file."""
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+
+    def _stream_is_stale(self):
+        if self.stream is None:
+            return False
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def shouldRollover(self, record):
+        if self._stream_is_stale():
+            # Another process rotated; continue in the new file
+            self.stream.close()
+            self.stream = self._open()
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.baseFilename + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                size = os.path.getsize(self.baseFilename)
+            except FileNotFoundError:
+                size = 0
+            if size >= self.maxBytes:
+                super().doRollover()
+            elif self.stream is not None:
+                self.stream.close()
+                self.stream = self._open()
+
+def _file_id(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+def make_cursor(path, offset):
+    return f"{_file_id(path) or 0}:{offset}"
+
+def parse_cursor(cursor):
+    try:
+        inode, offset = cursor.split(":", 1)
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+def tail_lines(path, count=100):
+    """Returns (last `count` lines, cursor at end of file), reading only the end of the file."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            pos, data = end, b""
+            while pos > 0 and data.count(b"\n") <= count:
+                step = min(TAIL_BLOCK, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+            inode = os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return [], make_cursor(path, 0)
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return lines[-count:], f"{inode}:{end}"
+
+def _read_range(path, offset, limit):
+    """Reads up to `limit` bytes from offset, cut back to the last complete line. Returns (bytes, new_offset)."""
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if offset > size:
+            offset = 0  # Truncated (logs cleared)
+        f.seek(offset)
+        data = f.read(limit)
+    if len(data) == limit and b"\n" in data:
+        data = data[:data.rindex(b"\n") + 1]
+    elif not data.endswith(b"\n"):
+        # Don't hand out a line that is still being written
+        data = data[:data.rindex(b"\n") + 1] if b"\n" in data else b""
+    return data, offset + len(data)
+
+def read_since(path, cursor, limit=MAX_READ_BYTES):
+    """
+    Returns (lines, new_cursor, truncated) for everything appended after `cursor`.
+    Follows a rotation into `path.1`; if more than `limit` bytes are behind, skips ahead.
+    """
+    parsed = parse_cursor(cursor)
+    current = _file_id(path)
+    if parsed is None or current is None:
+        lines, new_cursor = tail_lines(path)
+        return lines, new_cursor, False
+
+    inode, offset = parsed
+    chunks, truncated = [], False
+    if inode != current:
+        rotated = path + ".1"
+        if _file_id(rotated) == inode:
+            data, _ = _read_range(rotated, offset, limit)
+            chunks.append(data)
+        else:
+            truncated = True  # Rotated more than once since the cursor
+        offset = 0
+
+    size = os.path.getsize(path)
+    budget = limit - sum(len(c) for c in chunks)
+    mid_line = False
+    if size - offset > budget:
+        truncated = True
+        chunks = []
+        offset = max(0, size - limit)
+        mid_line = offset > 0
+        budget = limit
+    data, offset = _read_range(path, offset, budget)
+    if mid_line:
+        # Started inside a line: drop the partial first one
+        data = data[data.find(b"\n") + 1:]
+    chunks.append(data)
+
+    text = b"".join(chunks).decode("utf-8", errors="replace")
+    return text.splitlines(keepends=True), f"{current}:{offset}", truncated
+
+def clear_logs(path):
+    """Empties the live log and removes rotated backups."""
+    with open(path, "a") as f:
+        f.truncate(0)
+    directory, name = os.path.split(path)
+    for entry in os.listdir(directory or "."):
+        if entry.startswith(name + ".") and entry[len(name) + 1:].isdigit():
+            os.remove(os.path.join(directory, entry))
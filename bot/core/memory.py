@@ -7,17 +7,10 @@ import threading
 import time
 import logging
 from cryptography.fernet import Fernet
-from config import MEMORY_ENCRYPTION_KEY
-
-# Configure logging
-logging.basicConfig(
-    filename="bot.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+from config import MEMORY_ENCRYPTION_KEY, MEMORY_DB_FILE
 
 # ========== Database Configuration ========== #
-DB_FILE="state/bot_memory.db"
+DB_FILE = MEMORY_DB_FILE
 DB_CONN = None
 DB_LOCK = threading.Lock()
 CIPHER = Fernet(MEMORY_ENCRYPTION_KEY)
@@ -39,16 +32,74 @@ def init_db():
             CREATE TABLE IF NOT EXISTS chat_memory (
                 memory_key TEXT PRIMARY KEY,
                 messages TEXT NOT NULL,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                message_count INTEGER,
+                size_bytes INTEGER,
+                kind TEXT
             )
             ''')
-            
+
+            # Per-key stats live in columns so listing never has to decrypt; kind ("group"
+            # or "dm") lets the dashboard filter by type through an index
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(chat_memory)")}
+            for column, column_type in (("message_count", "INTEGER"), ("size_bytes", "INTEGER"), ("kind", "TEXT")):
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE chat_memory ADD COLUMN {column} {column_type}")
+            cursor.execute(
+                "UPDATE chat_memory SET kind = CASE WHEN memory_key LIKE 'group:%' THEN 'group' ELSE 'dm' END "
+                "WHERE kind IS NULL"
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_memory_updated ON chat_memory (last_updated, memory_key)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_memory_kind ON chat_memory (kind, last_updated, memory_key)")
             DB_CONN.commit()
+            _backfill_stats(cursor)
             logging.info("Database initialized successfully with WAL mode")
         except Exception as e:
             logging.error(f"Database initialization error: {e}")
             raise e
 
+def decode_messages(blob):
+    """Decrypts a stored memory blob, falling back to plain JSON (pre-encryption rows)."""
+    try:
+        return json.loads(CIPHER.decrypt(blob.encode()).decode())
+    except Exception:
+        return json.loads(blob)
+
+def memory_kind(key):
+    """"group" for group:<chat id> keys, "dm" for <user id>:dm ones."""
+    return "group" if key.startswith("group:") else "dm"
+
+def write_memory(cursor, key, messages):
+    """Encrypts and upserts one memory key together with its list stats."""
+    plain = json.dumps(messages)
+    cursor.execute(
+        "INSERT OR REPLACE INTO chat_memory (memory_key, messages, last_updated, message_count, size_bytes, kind) "
+        "VALUES (?, ?, CURRENT_TIMESTAMP, ?, ?, ?)",
+        (key, CIPHER.encrypt(plain.encode()).decode(), len(messages), len(plain.encode()), memory_kind(key))
+    )
+
+def _backfill_stats(cursor, batch=500):
+    """One-time fill of message_count/size_bytes for rows written before those columns existed."""
+    total = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT memory_key, messages FROM chat_memory WHERE message_count IS NULL LIMIT ?", (batch,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for key, blob in rows:
+            try:
+                messages = decode_messages(blob)
+                updates.append((len(messages), len(json.dumps(messages).encode()), key))
+            except Exception:
+                updates.append((0, 0, key))
+        cursor.executemany("UPDATE chat_memory SET message_count = ?, size_bytes = ? WHERE memory_key = ?", updates)
+        DB_CONN.commit()
+        total += len(rows)
+    if total:
+        logging.info(f"Backfilled memory stats for {total} keys")
+
 # Initialize database on module import
 init_db()
 
@@ -58,6 +109,8 @@ class MemoryManager:
         self.memory_cache = {}
         self.dirty_keys = set()
         self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
         
     def _get_key(self, key_info):
         """Helper to resolve memory key from various input formats"""
@@ -84,7 +137,10 @@ class MemoryManager:
             memory_key = f"{user_id}:dm"
             
         with self.cache_lock:
-            if memory_key not in self.memory_cache:
+            if memory_key in self.memory_cache:
+                self.hits += 1
+            else:
+                self.misses += 1
                 # Load from DB if not in cache
                 try:
                     with DB_LOCK:
@@ -132,11 +188,7 @@ class MemoryManager:
                     
                     if messages is not None:
                         # Encrypt data before saving
-                        encrypted_data = CIPHER.encrypt(json.dumps(messages).encode()).decode()
-                        cursor.execute(
-                            "INSERT OR REPLACE INTO chat_memory (memory_key, messages, last_updated) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                            (key, encrypted_data)
-                        )
+                        write_memory(cursor, key, messages)
                 
                 DB_CONN.commit()
                 # logging.info(f"Committed {len(keys_to_save)} modified memory contexts to database.")
@@ -149,6 +201,23 @@ class MemoryManager:
                     self.dirty_keys.update(keys_to_save)
                 return False
     
+    def invalidate(self, memory_key):
+        """Drops a key from the cache (and any unsaved change) so the next access reads the database."""
+        with self.cache_lock:
+            self.memory_cache.pop(memory_key, None)
+            self.dirty_keys.discard(memory_key)
+
+    def stats(self):
+        with self.cache_lock:
+            lookups = self.hits + self.misses
+            return {
+                "cached_keys": len(self.memory_cache),
+                "dirty_keys": len(self.dirty_keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None
+            }
+
     def __getitem__(self, key_info):
         """Support for legacy access"""
         memory_key = self._get_key(key_info)
@@ -0,0 +1,207 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from config import MODLOG_DB_FILE
+
+# ========== Moderation Event Store ========== #
+# Handlers call log_action(), which only enqueues. A background thread writes the
+# queue to SQLite in batches and keeps per-chat counters up to date in the same
+# transaction, so the dashboard never has to scan the full history for totals.
+
+FLUSH_INTERVAL = 2      # seconds between batch writes
+BATCH_SIZE = 500        # max events per transaction
+PAGE_LIMIT = 200        # max rows per query page
+
+_queue = queue.Queue()
+_wake = threading.Event()
+_writer_thread = None
+_writer_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(MODLOG_DB_FILE, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    return conn
+
+def init_db(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS mod_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        chat_id INTEGER NOT NULL,
+        actor_id INTEGER,
+        target_id INTEGER,
+        action TEXT NOT NULL,
+        reason TEXT
+    )
+    ''')
+    # Pages are read newest first by id: filtered reads walk (column, id) backwards
+    # instead of sorting every matching row. Replaces the earlier (column, ts) indexes.
+    for old_index in ("idx_mod_events_chat_ts", "idx_mod_events_target_ts", "idx_mod_events_actor_ts"):
+        cursor.execute(f"DROP INDEX IF EXISTS {old_index}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mod_events_chat_id ON mod_events (chat_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mod_events_target_id ON mod_events (target_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mod_events_actor_id ON mod_events (actor_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mod_events_ts ON mod_events (ts)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS mod_counts (
+        chat_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        last_ts REAL,
+        PRIMARY KEY (chat_id, action)
+    )
+    ''')
+    conn.commit()
+
+# ========== Writing ========== #
+def log_action(chat_id, action, actor_id=None, target_id=None, reason=None):
+    """
+    Records a moderation action without touching the disk on the caller's thread.
+    actor_id is None for automatic actions taken by the bot itself.
+    """
+    _queue.put((time.time(), int(chat_id), actor_id, target_id, action, reason))
+    _ensure_writer()
+    _wake.set()
+
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is not None:
+        return
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+            _writer_thread.start()
+
+def _drain(max_items):
+    batch = []
+    while len(batch) < max_items:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+def _write_batch(conn, batch):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        cursor.executemany(
+            "INSERT INTO mod_events (ts, chat_id, actor_id, target_id, action, reason) VALUES (?, ?, ?, ?, ?, ?)",
+            batch
+        )
+        cursor.executemany(
+            '''INSERT INTO mod_counts (chat_id, action, count, last_ts) VALUES (?, ?, 1, ?)
+               ON CONFLICT(chat_id, action) DO UPDATE SET count = count + 1, last_ts = excluded.last_ts''',
+            [(e[1], e[4], e[0]) for e in batch]
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Moderation log: failed to write {len(batch)} events: {e}")
+
+def flush(conn=None):
+    """Writes everything currently queued. Used by the writer thread and at exit."""
+    own_conn = conn is None
+    if own_conn:
+        if _queue.empty():
+            return
+        conn = _connect()
+        init_db(conn)
+    try:
+        while True:
+            batch = _drain(BATCH_SIZE)
+            if not batch:
+                break
+            _write_batch(conn, batch)
+    finally:
+        if own_conn:
+            conn.close()
+
+def _writer_loop():
+    conn = _connect()
+    init_db(conn)
+    while True:
+        # Sleep until there is work, then give the burst a moment to accumulate
+        _wake.wait()
+        _wake.clear()
+        time.sleep(FLUSH_INTERVAL)
+        flush(conn)
+
+atexit.register(flush)
+
+# ========== Querying ========== #
+def query_events(chat_id=None, user_id=None, since=None, until=None, before_id=None, limit=50):
+    """
+    Returns (events, next_cursor), newest first. Pass next_cursor back as before_id
+    for the next page; it is None on the last page. user_id matches actor or target.
+    """
+    limit = max(1, min(int(limit), PAGE_LIMIT))
+    clauses, params = [], []
+    if chat_id is not None:
+        clauses.append("chat_id = ?")
+        params.append(int(chat_id))
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(float(since))
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(float(until))
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(int(before_id))
+    columns = "id, ts, chat_id, actor_id, target_id, action, reason"
+    if user_id is None:
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT {columns} FROM mod_events {where} ORDER BY id DESC LIMIT ?"
+        params = params + [limit + 1]
+    else:
+        # One bounded walk per index instead of an OR that sorts all of the user's rows
+        where = " AND ".join(clauses + ["{column} = ?"])
+        walk = f"SELECT * FROM (SELECT {columns} FROM mod_events WHERE {where} ORDER BY id DESC LIMIT ?)"
+        sql = (f"{walk.format(column='target_id')} UNION {walk.format(column='actor_id')} "
+               f"ORDER BY id DESC LIMIT ?")
+        params = params + [int(user_id), limit + 1] + params + [int(user_id), limit + 1, limit + 1]
+
+    conn = _connect()
+    try:
+        init_db(conn)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    events = [
+        {"id": r[0], "ts": r[1], "chat_id": r[2], "actor_id": r[3], "target_id": r[4], "action": r[5], "reason": r[6]}
+        for r in rows[:limit]
+    ]
+    return events, next_cursor
+
+def chat_counts(chat_id=None):
+    """Per-chat, per-action totals from the counter table (no history scan)."""
+    conn = _connect()
+    try:
+        init_db(conn)
+        cursor = conn.cursor()
+        if chat_id is not None:
+            cursor.execute("SELECT chat_id, action, count, last_ts FROM mod_counts WHERE chat_id = ?", (int(chat_id),))
+        else:
+            cursor.execute("SELECT chat_id, action, count, last_ts FROM mod_counts")
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    counts = {}
+    for chat, action, count, last_ts in rows:
+        entry = counts.setdefault(str(chat), {"total": 0, "actions": {}, "last_ts": None})
+        entry["actions"][action] = count
+        entry["total"] += count
+        if last_ts and (entry["last_ts"] is None or last_ts > entry["last_ts"]):
+            entry["last_ts"] = last_ts
+    return counts
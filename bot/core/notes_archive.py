@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+import logging
+from config import NOTES_DIR, STATE_DIR
+from core.helper import atomic_write
+
+# ========== Bulk Notes Backup ========== #
+# Export streams every notes/<chat_id>.json into a tar.gz one file at a time.
+# Import reads an archive entry by entry, validates each chat against the notes
+# schema into a staging directory, and only swaps files into NOTES_DIR once the
+# whole archive has passed. A failure while swapping rolls back to the old files.
+
+ARCHIVE_PREFIX = "notes/"
+MAX_ENTRY_BYTES = 5 * 1024 * 1024
+MAX_ENTRIES = 100000
+NOTE_TYPES = {"text", "photo", "video", "document", "sticker", "animation", "audio", "voice"}
+CHAT_FILE_RE = re.compile(r"^-?\d+\.json$")
+
+class ArchiveError(Exception):
+    pass
+
+class _ChunkWriter:
+    """File-like sink that collects what tarfile writes so it can be yielded in chunks."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_notes_archive():
+    """Yields a tar.gz of all chats' notes as byte chunks, holding one chat in memory at a time."""
+    sink = _ChunkWriter()
+    with tarfile.open(fileobj=sink, mode="w|gz") as tar:
+        with os.scandir(NOTES_DIR) as entries:
+            for entry in entries:
+                if not entry.is_file() or not CHAT_FILE_RE.match(entry.name):
+                    continue
+                info = tar.gettarinfo(entry.path, arcname=ARCHIVE_PREFIX + entry.name)
+                with open(entry.path, "rb") as f:
+                    tar.addfile(info, f)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+def write_notes_archive(fileobj):
+    """Streams the export into an open binary file. Returns the number of bytes written."""
+    size = 0
+    for chunk in iter_notes_archive():
+        fileobj.write(chunk)
+        size += len(chunk)
+    return size
+
+def validate_notes(data):
+    """Raises ArchiveError unless `data` matches the notes file schema. Returns it with defaults filled."""
+    if not isinstance(data, dict) or not isinstance(data.get("notes"), dict):
+        raise ArchiveError("missing 'notes' object")
+    for name, note in data["notes"].items():
+        if not isinstance(name, str) or not name:
+            raise ArchiveError("note names must be non-empty strings")
+        if isinstance(note, str):
+            continue # Legacy plain-text note
+        if not isinstance(note, dict):
+            raise ArchiveError(f"note '{name}' is not an object")
+        if note.get("type", "text") not in NOTE_TYPES:
+            raise ArchiveError(f"note '{name}' has unknown type '{note.get('type')}'")
+        for field in ("content", "file_id"):
+            if note.get(field) is not None and not isinstance(note[field], str):
+                raise ArchiveError(f"note '{name}' field '{field}' must be a string")
+    pinned = data.get("pinned")
+    if pinned is not None and pinned not in data["notes"]:
+        data["pinned"] = None
+    if not isinstance(data.get("enabled", True), bool):
+        raise ArchiveError("'enabled' must be true or false")
+    data.setdefault("pinned", None)
+    data.setdefault("enabled", True)
+    return data
+
+def import_notes_archive(fileobj):
+    """
+    Validates and applies a notes archive read from a binary stream.
+    Returns the list of chat ids that were replaced. Nothing is changed if any entry is invalid.
+    """
+    staging = tempfile.mkdtemp(prefix="notes-import-", dir=STATE_DIR)
+    try:
+        chat_ids = set()
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    name = member.name[len(ARCHIVE_PREFIX):] if member.name.startswith(ARCHIVE_PREFIX) else member.name
+                    if "/" in name or not CHAT_FILE_RE.match(name):
+                        raise ArchiveError(f"unexpected entry '{member.name}'")
+                    if member.size > MAX_ENTRY_BYTES:
+                        raise ArchiveError(f"entry '{member.name}' is too large")
+                    if len(chat_ids) >= MAX_ENTRIES:
+                        raise ArchiveError("too many entries")
+
+                    try:
+                        data = json.load(tar.extractfile(member))
+                    except ValueError:
+                        raise ArchiveError(f"entry '{member.name}' is not valid JSON")
+                    try:
+                        validate_notes(data)
+                    except ArchiveError as e:
+                        raise ArchiveError(f"{member.name}: {e}")
+
+                    with open(os.path.join(staging, name), "w", encoding="utf-8") as f:
+                        json.dump(data, f, separators=(",", ":"), ensure_ascii=False)
+                    chat_ids.add(name[:-len(".json")])
+        except tarfile.TarError as e:
+            raise ArchiveError(f"not a readable archive: {e}")
+
+        if not chat_ids:
+            raise ArchiveError("archive contains no notes")
+        chat_ids = sorted(chat_ids)
+        _apply_staged(staging, chat_ids)
+        logging.info(f"Imported notes archive with {len(chat_ids)} chats")
+        return chat_ids
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _apply_staged(staging, chat_ids):
+    """Moves staged files into NOTES_DIR, restoring the previous files if any step fails."""
+    backup = os.path.join(staging, "backup")
+    os.makedirs(backup)
+    applied = []
+    try:
+        for chat_id in chat_ids:
+            name = f"{chat_id}.json"
+            target = os.path.join(NOTES_DIR, name)
+            if os.path.exists(target):
+                shutil.copy2(target, os.path.join(backup, name))
+            with open(os.path.join(staging, name), "rb") as f:
+                atomic_write(target, f.read())
+            applied.append(chat_id)
+    except Exception:
+        for chat_id in applied:
+            name = f"{chat_id}.json"
+            target = os.path.join(NOTES_DIR, name)
+            saved = os.path.join(backup, name)
+            try:
+                if os.path.exists(saved):
+                    os.replace(saved, target)
+                else:
+                    os.remove(target)
+            except OSError as e:
+                logging.error(f"Notes import rollback failed for {chat_id}: {e}")
+        raise
+
+def archive_filename():
+    return time.strftime("notes-backup-%Y%m%d-%H%M%S.tar.gz", time.gmtime())
@@ -0,0 +1,198 @@
+import cProfile
+import glob
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from config import STATE_DIR, WORKER_SHARD, PROFILE_INTERVAL, PROFILE_CPROFILE_RATE, PROFILE_MAX_SECONDS
+
+# ========== Worker Profiling ========== #
+# Two views of a worker that got slow, both taken on live traffic:
+# - HandlerStats is always on: every handler run (see the instrumentation in worker.py)
+#   adds its wall time to per-handler counters.
+# - Profiler runs on demand (/profile, dashboard) for a bounded time. "sample" mode
+#   records every thread's stack each PROFILE_INTERVAL and writes collapsed stacks
+#   ("thread;file:func;... count" per line, for flamegraph.pl or speedscope);
+#   "cprofile" mode runs PROFILE_CPROFILE_RATE of handler calls under cProfile and
+#   merges them into one pstats file.
+# Results go to STATE_DIR/profiles, where the supervisor serves them for download.
+
+PROFILE_DIR = os.path.join(STATE_DIR, "profiles")
+MODES = ("sample", "cprofile")
+KEEP_RESULTS = 10               # per worker
+
+class HandlerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = {}      # name -> [calls, errors, total seconds, max seconds]
+        self.since = time.time()
+
+    def record(self, name, elapsed, failed=False):
+        with self.lock:
+            entry = self.handlers.get(name)
+            if entry is None:
+                entry = self.handlers[name] = [0, 0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] += elapsed
+            entry[3] = max(entry[3], elapsed)
+
+    def snapshot(self, limit=None):
+        """Handlers by cumulative time, slowest first."""
+        with self.lock:
+            items = [(name, *entry) for name, entry in self.handlers.items()]
+        items.sort(key=lambda item: -item[3])
+        return {
+            "since": self.since,
+            "handlers": [
+                {"name": name, "calls": calls, "errors": errors, "total_s": round(total, 3),
+                 "avg_ms": round(total / calls * 1000, 1), "max_ms": round(longest * 1000, 1)}
+                for name, calls, errors, total, longest in items[:limit]
+            ],
+        }
+
+class Profiler:
+    def __init__(self, interval=PROFILE_INTERVAL, rate=PROFILE_CPROFILE_RATE, directory=PROFILE_DIR):
+        self.interval = interval
+        self.rate = rate
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.session = None     # the running session, if any
+        self.last = None        # result of the last finished one
+        self.profiles = []      # cProfile runs collected by the running "cprofile" session
+        self.labels = {}        # code object -> "file:func", shared across sessions
+        self.cprofile_lock = threading.Lock()   # one cProfile at a time (3.12+ refuses a second)
+
+    def start(self, seconds, mode="sample", on_done=None):
+        """
+        Profiles for `seconds` in the background and calls on_done(result) when the file is
+        written. Raises ValueError for bad arguments or when a session is already running.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        seconds = float(seconds)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+        with self.lock:
+            if self.session is not None:
+                raise ValueError("a profile is already running")
+            now = time.time()
+            self.session = {"mode": mode, "seconds": seconds, "started": now, "ends": now + seconds}
+            self.profiles = []
+            session = self.session
+        threading.Thread(target=self._run, args=(session, on_done), daemon=True, name="profiler").start()
+        logging.info(f"Profiling for {seconds:g}s ({mode})")
+        return dict(session)
+
+    def status(self):
+        with self.lock:
+            return {"running": dict(self.session) if self.session else None, "last": self.last}
+
+    def call(self, func, *args, **kwargs):
+        """Runs a handler; under cProfile for a sampled share of calls while a "cprofile" session runs."""
+        session = self.session
+        if session is None or session["mode"] != "cprofile" or random.random() >= self.rate:
+            return func(*args, **kwargs)
+        # Calls that arrive while another one is being profiled just run unprofiled
+        if not self.cprofile_lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Some other profiler (or tracer) holds the hook
+            self.cprofile_lock.release()
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            self.cprofile_lock.release()
+            with self.lock:
+                if self.session is session:
+                    self.profiles.append(profile)
+
+    def _run(self, session, on_done):
+        try:
+            if session["mode"] == "sample":
+                result = self._sample(session["seconds"])
+            else:
+                time.sleep(session["seconds"])
+                result = self._merge()
+        except Exception as e:
+            logging.error(f"Profiling failed: {e}")
+            result = {"error": str(e)}
+        result.update(mode=session["mode"], seconds=session["seconds"], started=session["started"])
+        with self.lock:
+            self.session = None
+            self.profiles = []
+            self.last = result
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                logging.error(f"Could not deliver the profile: {e}")
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _sample(self, seconds):
+        stacks = Counter()
+        samples = 0
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            # Pool threads are numbered (handler_3, async-io_12); count them as one
+            names = {thread.ident: re.sub(r"[-_]?\d+$", "", thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        lines = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        path = self._path("collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(lines)
+        return {"path": path, "file": os.path.basename(path), "samples": samples}
+
+    def _merge(self):
+        with self.lock:
+            profiles, self.profiles = self.profiles, []
+        if not profiles:
+            raise ValueError("no handler call was profiled, try a longer session or a higher PROFILE_CPROFILE_RATE")
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self._path("pstats")
+        stats.dump_stats(path)
+        return {"path": path, "file": os.path.basename(path), "calls": len(profiles)}
+
+    def _path(self, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        for old in result_files(WORKER_SHARD, self.directory)[KEEP_RESULTS - 1:]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return os.path.join(self.directory, f"worker{WORKER_SHARD}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+def result_files(shard, directory=PROFILE_DIR):
+    """A worker's profile files, newest first."""
+    return sorted(glob.glob(os.path.join(directory, f"worker{shard}-*")), key=os.path.getmtime, reverse=True)
+
+handler_stats = HandlerStats()
+profiler = Profiler()
@@ -0,0 +1,183 @@
+import json
+import heapq
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import SCHEDULER_DB_FILE, SCHEDULER_WORKERS, WORKER_SHARD, WORKER_COUNT
+from core.dispatcher import background_traffic
+
+# ========== Deferred Action Scheduler ========== #
+# Handlers register named actions once, then schedule them with a JSON-able payload.
+# Pending actions live in a heap (one timer thread sleeping until the next deadline)
+# and in SQLite, so they survive a worker restart. With several workers each one only
+# restores its own jobs; the first also takes jobs of shards that no longer exist.
+
+class Scheduler:
+    def __init__(self, db_file=SCHEDULER_DB_FILE, workers=SCHEDULER_WORKERS):
+        self.db_file = db_file
+        self.workers = workers
+        self.actions = {}
+        self.heap = []          # (run_at, job_id)
+        self.jobs = {}          # job_id -> (action, payload)
+        self.cond = threading.Condition()
+        self.db_conn = None
+        self.db_lock = threading.Lock()
+        self.pool = None
+        self.thread = None
+        self.stopping = False
+
+    def _init_db(self):
+        with self.db_lock:
+            if self.db_conn is not None:
+                return
+            self.db_conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            cursor = self.db_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL;")
+            cursor.execute("PRAGMA synchronous=NORMAL;")
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_at REAL NOT NULL,
+                action TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+            ''')
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(scheduled_actions)")}
+            if "shard" not in columns:
+                cursor.execute("ALTER TABLE scheduled_actions ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+            self.db_conn.commit()
+
+    def register(self, name, func):
+        """Registers `func(**payload)` as the handler for action `name`."""
+        self.actions[name] = func
+
+    def action(self, name):
+        """Decorator form of register()."""
+        def decorator(func):
+            self.register(name, func)
+            return func
+        return decorator
+
+    def schedule(self, delay, action, **payload):
+        """Runs `action` with `payload` after `delay` seconds. Returns the job id."""
+        run_at = time.time() + delay
+        self._init_db()
+        with self.db_lock:
+            cursor = self.db_conn.cursor()
+            cursor.execute(
+                "INSERT INTO scheduled_actions (run_at, action, payload, shard) VALUES (?, ?, ?, ?)",
+                (run_at, action, json.dumps(payload), WORKER_SHARD)
+            )
+            self.db_conn.commit()
+            job_id = cursor.lastrowid
+        self._push(job_id, run_at, action, payload)
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancels a pending job. The heap entry is skipped lazily when it comes due."""
+        with self.cond:
+            found = self.jobs.pop(job_id, None) is not None
+        self._delete_row(job_id)
+        return found
+
+    def pending(self):
+        with self.cond:
+            return len(self.jobs)
+
+    def _push(self, job_id, run_at, action, payload):
+        with self.cond:
+            self.jobs[job_id] = (action, payload)
+            heapq.heappush(self.heap, (run_at, job_id))
+            # Only wake the timer thread if this job is now the earliest
+            if self.heap[0][1] == job_id:
+                self.cond.notify()
+
+    def _delete_row(self, job_id):
+        try:
+            with self.db_lock:
+                self.db_conn.execute("DELETE FROM scheduled_actions WHERE id = ?", (job_id,))
+                self.db_conn.commit()
+        except Exception as e:
+            logging.error(f"Scheduler: failed to remove job {job_id}: {e}")
+
+    def _load_pending(self):
+        with self.db_lock:
+            cursor = self.db_conn.cursor()
+            cursor.execute(
+                "SELECT id, run_at, action, payload FROM scheduled_actions WHERE shard = ? OR (? = 0 AND shard >= ?)",
+                (WORKER_SHARD, WORKER_SHARD, WORKER_COUNT)
+            )
+            rows = cursor.fetchall()
+        for job_id, run_at, action, payload in rows:
+            if job_id in self.jobs:
+                continue
+            try:
+                self._push(job_id, run_at, action, json.loads(payload))
+            except Exception as e:
+                logging.error(f"Scheduler: dropping unreadable job {job_id}: {e}")
+                self._delete_row(job_id)
+        if rows:
+            logging.info(f"Scheduler: restored {len(rows)} pending actions")
+
+    def _run(self, job_id, action, payload):
+        func = self.actions.get(action)
+        try:
+            if func is None:
+                logging.warning(f"Scheduler: no handler registered for '{action}', dropping job {job_id}")
+            else:
+                # Deferred deletes and notices yield to live replies
+                with background_traffic():
+                    func(**payload)
+        except Exception as e:
+            logging.error(f"Scheduler: action '{action}' (job {job_id}) failed: {e}")
+        finally:
+            self._delete_row(job_id)
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.stopping:
+                        return
+                    # Drop cancelled entries from the top of the heap
+                    while self.heap and self.heap[0][1] not in self.jobs:
+                        heapq.heappop(self.heap)
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    run_at, job_id = self.heap[0]
+                    wait = run_at - time.time()
+                    if wait <= 0:
+                        heapq.heappop(self.heap)
+                        action, payload = self.jobs.pop(job_id)
+                        break
+                    self.cond.wait(timeout=wait)
+            self.pool.submit(self._run, job_id, action, payload)
+
+    def start(self):
+        """Restores persisted jobs and starts the timer thread. Call after all actions are registered."""
+        if self.thread:
+            return
+        self._init_db()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+        self._load_pending()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logging.info("Scheduler started")
+
+    def stop(self):
+        """Stops firing jobs and waits for running ones. Pending jobs stay in the database for the next start."""
+        if not self.thread:
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+        self.thread = None
+        logging.info("Scheduler stopped")
+
+# Global scheduler instance
+scheduler = Scheduler()
@@ -0,0 +1,239 @@
+import itertools
+import math
+import threading
+import time
+import logging
+from array import array
+import psutil
+
+# ========== Resource Time Series ========== #
+# Fixed-size ring buffers at three resolutions, filled by one sampler thread in the
+# supervisor. Each 1s sample is also folded into the current 1m bucket, and each
+# closed 1m bucket into the current 1h bucket, so memory use never grows.
+# Coarse buckets keep the mean of every field plus the peak CPU and RSS.
+
+FIELDS = ("cpu", "cpu_max", "rss", "rss_max", "threads", "fds", "read_bps", "write_bps")
+MAX_FIELDS = {"cpu_max", "rss_max"}
+RESOLUTIONS = (
+    (1, 3600),      # 1 hour of seconds
+    (60, 1440),     # 1 day of minutes
+    (3600, 720),    # 30 days of hours
+)
+MAX_POINTS = 500
+
+class RingBuffer:
+    """Preallocated columns of floats; the oldest point is overwritten when full."""
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.ts = array("d", [math.nan]) * capacity
+        self.columns = {name: array("d", [math.nan]) * capacity for name in fields}
+        self.next = 0
+        self.count = 0
+
+    def append(self, ts, values):
+        i = self.next
+        self.ts[i] = ts
+        for name in self.fields:
+            value = values.get(name)
+            self.columns[name][i] = math.nan if value is None else value
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def oldest(self):
+        return self.ts[(self.next - self.count) % self.capacity] if self.count else None
+
+    def points(self, since=0.0, until=math.inf):
+        """Yields (ts, {field: value}) in time order within [since, until]."""
+        start = (self.next - self.count) % self.capacity
+        for k in range(self.count):
+            i = (start + k) % self.capacity
+            ts = self.ts[i]
+            if since <= ts <= until:
+                yield ts, {name: _value(self.columns[name][i]) for name in self.fields}
+
+def _value(value):
+    # Missing readings are stored as NaN, which JSON can't carry
+    return None if math.isnan(value) else value
+
+class _Bucket:
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.counts = dict.fromkeys(FIELDS, 0)
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.maxes = dict.fromkeys(FIELDS, -math.inf)
+
+    def add(self, values):
+        self.count += 1
+        for name in FIELDS:
+            value = values.get(name)
+            if value is not None and not math.isnan(value):
+                self.counts[name] += 1
+                self.sums[name] += value
+                self.maxes[name] = max(self.maxes[name], value)
+
+    def result(self):
+        result = {}
+        for name in FIELDS:
+            if not self.counts[name]:
+                result[name] = None
+            elif name in MAX_FIELDS:
+                result[name] = self.maxes[name]
+            else:
+                result[name] = self.sums[name] / self.counts[name]
+        return result
+
+class TimeSeries:
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.levels = [(step, RingBuffer(capacity)) for step, capacity in resolutions]
+        self.buckets = [None] * len(self.levels)
+        self.lock = threading.Lock()
+        self.latest = None
+
+    def add(self, ts, values):
+        with self.lock:
+            self.latest = (ts, values)
+            self._add(0, ts, values)
+
+    def _add(self, level, ts, values):
+        step, ring = self.levels[level]
+        if level == 0:
+            ring.append(ts, values)
+            if len(self.levels) > 1:
+                self._add(1, ts, values)
+            return
+        start = ts - ts % step
+        bucket = self.buckets[level]
+        if bucket is not None and bucket.start != start:
+            # The bucket is complete: store it and fold it into the next coarser level
+            closed = bucket.result()
+            ring.append(bucket.start, closed)
+            if level + 1 < len(self.levels):
+                self._add(level + 1, bucket.start, closed)
+            bucket = None
+        if bucket is None:
+            bucket = self.buckets[level] = _Bucket(start)
+        bucket.add(values)
+
+    def _pick_level(self, since):
+        """The finest level reaching back to `since`, else the one holding the oldest data."""
+        best = 0
+        for index, (_, ring) in enumerate(self.levels):
+            oldest = ring.oldest()
+            if oldest is None:
+                continue
+            if oldest <= since:
+                return index
+            best_oldest = self.levels[best][1].oldest()
+            if best_oldest is None or oldest < best_oldest:
+                best = index
+        return best
+
+    def query(self, since, until=None, points=MAX_POINTS):
+        """
+        Returns {"step", "resolution", "points": [[ts, {field: value}], ...]} for [since, until],
+        read from the finest resolution that covers `since` and averaged down to at most `points`.
+        """
+        until = until or time.time()
+        points = max(1, min(int(points), MAX_POINTS))
+        width = max(1.0, (until - since) / points)
+        series, bucket = [], None
+        with self.lock:
+            level = self._pick_level(since)
+            step, ring = self.levels[level]
+            width = max(width, step)
+            raw = ring.points(since, until)
+            pending = self.buckets[level]
+            if pending is not None and pending.count and since <= pending.start <= until:
+                # Include the bucket still being filled so the newest data shows up
+                raw = itertools.chain(raw, [(pending.start, pending.result())])
+            for ts, values in raw:
+                start = since + ((ts - since) // width) * width
+                if bucket is None or bucket.start != start:
+                    if bucket is not None:
+                        series.append([bucket.start, bucket.result()])
+                    bucket = _Bucket(start)
+                bucket.add(values)
+        if bucket is not None:
+            series.append([bucket.start, bucket.result()])
+        return {"step": width, "resolution": step, "points": series}
+
+    def last(self):
+        with self.lock:
+            return self.latest
+
+class ResourceSampler:
+    """
+    Samples processes once per interval and records their sum. get_pids() returns the pids
+    to watch (all workers); a sample is skipped while a new process gets its first reading.
+    """
+    def __init__(self, get_pids, series=None, interval=1.0):
+        self.get_pids = get_pids
+        self.series = series or TimeSeries()
+        self.interval = interval
+        self.procs = {}         # pid -> [psutil.Process, last io reading]
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True, name="resource-sampler").start()
+
+    def _sample(self, now):
+        pids = set(self.get_pids())
+        for pid in set(self.procs) - pids:
+            del self.procs[pid]
+        if not pids:
+            return
+        fresh = False
+        for pid in pids - set(self.procs):
+            # cpu_percent and IO rates need a previous reading; the first one is not recorded
+            proc = psutil.Process(pid)
+            proc.cpu_percent(interval=None)
+            self.procs[pid] = [proc, self._io(proc, now)]
+            fresh = True
+        if fresh:
+            return
+
+        cpu = rss = threads = fds = read = write = 0.0
+        has_fds = has_io = False
+        for entry in self.procs.values():
+            proc, last_io = entry
+            with proc.oneshot():
+                cpu += proc.cpu_percent(interval=None) / psutil.cpu_count()
+                rss += proc.memory_info().rss
+                threads += proc.num_threads()
+                if hasattr(proc, "num_fds"):
+                    fds += proc.num_fds()
+                    has_fds = True
+            io = self._io(proc, now)
+            if io and last_io:
+                elapsed = io[0] - last_io[0] or self.interval
+                read += (io[1] - last_io[1]) / elapsed
+                write += (io[2] - last_io[2]) / elapsed
+                has_io = True
+            entry[1] = io
+        self.series.add(now, {
+            "cpu": cpu, "cpu_max": cpu, "rss": rss, "rss_max": rss, "threads": threads,
+            "fds": fds if has_fds else None,
+            "read_bps": read if has_io else None,
+            "write_bps": write if has_io else None,
+        })
+
+    @staticmethod
+    def _io(proc, now):
+        try:
+            counters = proc.io_counters()
+            return now, counters.read_bytes, counters.write_bytes
+        except (psutil.AccessDenied, AttributeError, NotImplementedError):
+            return None
+
+    def _loop(self):
+        next_run = time.monotonic()
+        while True:
+            try:
+                self._sample(time.time())
+            except psutil.NoSuchProcess as e:
+                self.procs.pop(e.pid, None)
+            except Exception as e:
+                logging.error(f"Resource sampler error: {e}")
+            next_run = max(next_run + self.interval, time.monotonic())
+            time.sleep(next_run - time.monotonic())
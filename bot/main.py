@@ -5,74 +5,285 @@ import time
 import sys
 import logging
 import psutil
-from config import FLASK_SECRET_KEY, BASE_DIR
+import queue
+from collections import deque
+from config import (FLASK_SECRET_KEY, BASE_DIR, WORKER_WARMUP_TIMEOUT, WORKER_DRAIN_TIMEOUT,
+                    UPDATE_MODE, WEBHOOK_PATH, WEBHOOK_SECRET, WORKER_COUNT, SUPERVISOR_INGEST)
+from core.log_setup import setup_logging
 from dotenv import dotenv_values
 import os
-from modules.dashboard import dashboard_bp, login_required
-
-# Configure basic logging for Main Process
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - [SUPERVISOR] - %(message)s")
 
-# Filter out /api/logs requests
-class StatsFilter(logging.Filter):
-    def filter(self, record):
-        msg = record.getMessage()
-        # Hide polling endpoints
-        if "/api/stats" in msg or "/api/logs" in msg or "/api/control/status" in msg or "/api/memory/list" in msg:
-            return False
-        return True
+setup_logging("supervisor")
 
-logging.getLogger("werkzeug").addFilter(StatsFilter())
+from modules.dashboard import dashboard_bp, login_required
+from core.events import hub
+import core.ipc as ipc
+from core.timeseries import ResourceSampler
+from core.ingest import update_forwarder, start_ingestion
+import hmac
+import signal
 
 app = flask.Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY
 app.register_blueprint(dashboard_bp)
 
 # Global variables for worker management
-BOT_PROCESS = None
+# One slot per shard. A slot alternates between two sockets so a blue/green restart can
+# start the replacement while the current worker is still listening.
+def _slot(shard):
+    sockets = ipc.worker_socket_paths(shard)
+    return {"shard": shard, "process": None, "sockets": sockets, "socket": sockets[0]}
+
+WORKERS = [_slot(shard) for shard in range(WORKER_COUNT)]
 SHOULD_RESTART = True
+RESTART_LOCK = threading.Lock()   # Held while workers are started or swapped; the monitor stays out
+
+# Crash handling: restart after BACKOFF_BASE, doubling up to BACKOFF_MAX. A worker that ran
+# for STABLE_AFTER seconds resets the backoff. CRASH_LOOP_LIMIT crashes within
+# CRASH_LOOP_WINDOW (of any worker) open the circuit: no more automatic restarts until
+# started by hand.
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+STABLE_AFTER = 60
+CRASH_LOOP_LIMIT = 5
+CRASH_LOOP_WINDOW = 300
+
+EXITED = queue.Queue()            # Worker processes that exited (None just wakes the monitor)
+RUN_HISTORY = deque(maxlen=20)
+SUPERVISION = {
+    "started_at": None,
+    "restarts": 0,                # automatic restarts after crashes
+    "backoff": BACKOFF_BASE,
+    "next_restart_at": None,
+    "circuit_open": False,
+    "crash_times": deque(),
+    "last_handoff": None,
+}
+
+def _label(shard):
+    return "Bot worker" if WORKER_COUNT == 1 else f"Bot worker {shard}"
+
+def _alive(slot):
+    process = slot["process"]
+    return process is not None and process.poll() is None
+
+def _sync_sockets():
+    ipc.set_worker_sockets([slot["socket"] for slot in WORKERS])
+
+def _watch_process(process):
+    """Blocks in wait() so an exit is seen the moment it happens."""
+    process.wait()
+    EXITED.put(process)
 
-def start_bot_worker():
-    """Starts the bot worker process."""
-    global BOT_PROCESS
-    logging.info("Starting Bot Worker Process...")
-    
+def spawn_worker(slot, socket_path, standby=False):
+    """Starts a worker for the slot's shard, listening on socket_path. Standby workers wait for an activate command."""
     # Reload environment variables from .env file to ensure fresh config
     # We pass this modified environment to the subprocess
     env_updates = dotenv_values(os.path.join(BASE_DIR, '.env'))
     current_env = os.environ.copy()
     current_env.update(env_updates)
-    
+    current_env.update(WORKER_SOCKET=socket_path, WORKER_STANDBY="1" if standby else "0", SUPERVISED="1",
+                       WORKER_SHARD=str(slot["shard"]), WORKER_COUNT=str(WORKER_COUNT))
+
     # Run bot/worker.py using the same python executable
-    BOT_PROCESS = subprocess.Popen([sys.executable, "bot/worker.py"], env=current_env)
+    process = subprocess.Popen([sys.executable, "bot/worker.py"], env=current_env)
+    process.shard = slot["shard"]
+    process.started_at = time.time()
+    process.retired = None        # Set to the reason when the supervisor stops it on purpose
+    threading.Thread(target=_watch_process, args=(process,), daemon=True).start()
+    return process
+
+def start_bot_worker(slot):
+    """Starts the bot worker process of one shard."""
+    logging.info(f"Starting {_label(slot['shard'])} Process...")
+    slot["process"] = spawn_worker(slot, slot["socket"])
+    _sync_sockets()
+    _publish_status()
+
+def start_missing_workers():
+    for slot in WORKERS:
+        if not _alive(slot):
+            start_bot_worker(slot)
+    SUPERVISION["next_restart_at"] = None
+
+def _record_exit(process):
+    now = time.time()
+    entry = {
+        "shard": process.shard,
+        "pid": process.pid,
+        "started": process.started_at,
+        "ended": now,
+        "uptime": round(now - process.started_at, 1),
+        "exit_code": process.returncode,
+        "reason": process.retired or "crash",
+    }
+    RUN_HISTORY.appendleft(entry)
+    return entry
+
+def _schedule_restart(entry):
+    """Returns the delay before restarting a crashed worker, or None if the crash-loop circuit opened."""
+    now = time.time()
+    crashes = SUPERVISION["crash_times"]
+    if entry["uptime"] >= STABLE_AFTER:
+        SUPERVISION["backoff"] = BACKOFF_BASE
+        crashes.clear()
+    crashes.append(now)
+    while crashes and crashes[0] < now - CRASH_LOOP_WINDOW:
+        crashes.popleft()
+    if len(crashes) >= CRASH_LOOP_LIMIT:
+        SUPERVISION["circuit_open"] = True
+        return None
+    delay = SUPERVISION["backoff"]
+    SUPERVISION["backoff"] = min(delay * 2, BACKOFF_MAX)
+    return delay
+
+def _handle_exit(process, due):
+    entry = _record_exit(process)
+    slot = WORKERS[process.shard]
+    with RESTART_LOCK:
+        if process is not slot["process"]:
+            # Retired by a handoff or a stop, or a standby that never took over
+            logging.info(f"Worker {process.pid} exited ({entry['reason']}, code {entry['exit_code']})")
+            return
+        slot["process"] = None
+    if process.retired or not SHOULD_RESTART:
+        _publish_status()
+        return
+
+    delay = _schedule_restart(entry)
+    if delay is None:
+        logging.error(
+            f"{_label(process.shard)} crashed, {CRASH_LOOP_LIMIT} crashes within {CRASH_LOOP_WINDOW}s "
+            f"(last exit code {entry['exit_code']}). Not restarting until started from the dashboard."
+        )
+    else:
+        logging.warning(
+            f"{_label(process.shard)} exited with code {entry['exit_code']} after {entry['uptime']}s. "
+            f"Restarting in {delay}s..."
+        )
+        due[process.shard] = time.time() + delay
+        SUPERVISION["next_restart_at"] = min(due.values())
+    _publish_status()
 
 def monitor_bot_worker():
-    """Monitors the worker and restarts it if it crashes."""
-    global BOT_PROCESS, SHOULD_RESTART
-    while True:
+    """Restarts workers that crash. Sleeps until a worker exits or a restart is due; nothing is polled."""
+    with RESTART_LOCK:
         if SHOULD_RESTART:
-            if BOT_PROCESS is None:
-                start_bot_worker()
-            elif BOT_PROCESS.poll() is not None:
-                # Process exited
-                exit_code = BOT_PROCESS.returncode
-                logging.warning(f"Bot worker exited with code {exit_code}. Restarting in 3 seconds...")
-                time.sleep(3)
-                start_bot_worker()
-        time.sleep(1)
+            start_missing_workers()
+    due = {}    # shard -> when its restart is due
+    while True:
+        timeout = max(0, min(due.values()) - time.time()) if due else None
+        try:
+            process = EXITED.get(timeout=timeout)
+        except queue.Empty:
+            process = None
+        if process is not None:
+            _handle_exit(process, due)
+        if not SHOULD_RESTART or SUPERVISION["circuit_open"]:
+            due.clear()
 
-def restart_bot_process():
-    """Manually restarts the bot process"""
-    global BOT_PROCESS
-    if BOT_PROCESS:
-        logging.info("Killing current bot process...")
-        BOT_PROCESS.terminate()
+        now = time.time()
+        with RESTART_LOCK:
+            for shard, at in list(due.items()):
+                if at > now:
+                    continue
+                del due[shard]
+                if WORKERS[shard]["process"] is None:
+                    SUPERVISION["restarts"] += 1
+                    SUPERVISION["next_restart_at"] = min(due.values()) if due else None
+                    start_bot_worker(WORKERS[shard])
+        SUPERVISION["next_restart_at"] = min(due.values()) if due else None
+
+def _stop_process(process, timeout=5, reason="stopped"):
+    process.retired = reason
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def _wait_until_ready(process, socket_path, timeout):
+    """Waits for a standby worker to answer ping. False if it exits or times out."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
         try:
-            BOT_PROCESS.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            BOT_PROCESS.kill()
-        BOT_PROCESS = None
-    # monitor loop will pick it up
+            if ipc.call(socket_path, "ping", timeout=1)["state"] == "standby":
+                return True
+        except ipc.IPCError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def _handoff(slot):
+    """
+    Blue/green restart of one worker: boot a standby worker, drain the current one (it stops
+    taking updates, finishes handlers and jobs, flushes memory) and activate the new one at
+    the drained worker's update offset, so no update is lost or handled twice.
+    """
+    began = time.monotonic()
+    old = slot["process"]
+    if old is None or old.poll() is not None:
+        start_bot_worker(slot)
+        return True
+
+    label = _label(slot["shard"])
+    new_socket = slot["sockets"][1] if slot["socket"] == slot["sockets"][0] else slot["sockets"][0]
+    logging.info(f"Restart: starting standby for {label}...")
+    new = spawn_worker(slot, new_socket, standby=True)
+    if not _wait_until_ready(new, new_socket, WORKER_WARMUP_TIMEOUT):
+        logging.error(f"Restart aborted: new {label} did not come up, keeping the current one")
+        if new.poll() is None:
+            _stop_process(new, reason="standby failed")
+        return False
+    warmed = time.monotonic()
+
+    try:
+        drained = ipc.call(slot["socket"], "drain", timeout=WORKER_DRAIN_TIMEOUT + 5)
+        offset = drained["offset"]
+        logging.info(f"Restart: old {label} drained at update offset {offset} (clean: {drained['clean']})")
+    except ipc.IPCError as e:
+        # Old worker is wedged; stop it first so two workers never poll at once
+        logging.warning(f"Restart: drain failed ({e}), stopping old {label} without handoff")
+        _stop_process(old, reason="replaced")
+        offset = None
+    drained_at = time.monotonic()
+
+    try:
+        ipc.call(new_socket, "activate", offset=offset)
+    except ipc.IPCError as e:
+        # The standby died or hung after the drain. The old worker no longer takes updates,
+        # so stop both and let the monitor restart the slot as after a crash (backoff, circuit)
+        logging.error(f"Restart: new {label} could not be activated ({e}), restarting it as after a crash")
+        if new.poll() is None:
+            _stop_process(new, reason="standby failed")
+        if old.poll() is None:
+            _stop_process(old, reason=None)  # Not retired: its exit goes through the crash path
+        return False
+    slot["process"], slot["socket"] = new, new_socket
+    _sync_sockets()
+    if old.poll() is None:
+        _stop_process(old, reason="replaced")
+    else:
+        old.retired = old.retired or "replaced"
+    SUPERVISION["last_handoff"] = {
+        "at": time.time(),
+        "shard": slot["shard"],
+        "warmup": round(warmed - began, 2),
+        "drain": round(drained_at - warmed, 2),
+        "total": round(time.monotonic() - began, 2),
+        "offset": offset,
+    }
+    logging.info(f"Restart: new {label} is active")
+    return True
+
+def restart_bot_process():
+    """Blue/green restart of every worker, one at a time, so the other shards keep serving."""
+    with RESTART_LOCK:
+        results = [_handoff(slot) for slot in WORKERS]
+    _publish_status()
+    return all(results)
 
 # --- Routes ---
 
@@ -88,57 +299,138 @@ def api_restart():
 
 @app.route('/api/control/status')
 def api_status():
-    status = "running" if BOT_PROCESS and BOT_PROCESS.poll() is None else "stopped"
-    return flask.jsonify({"status": status})
+    """Up/down for anyone (health checks); pids, exit history and handoffs only for the dashboard."""
+    if not flask.session.get('logged_in'):
+        return flask.jsonify({"status": worker_status()["status"]})
+    return flask.jsonify(worker_status(detail=True))
 
 @app.route('/api/control/stop', methods=['POST'])
 @login_required
 def api_stop():
-    global BOT_PROCESS, SHOULD_RESTART
+    global SHOULD_RESTART
     SHOULD_RESTART = False
-    if BOT_PROCESS:
-        logging.info("Stopping bot process via dashboard...")
-        BOT_PROCESS.terminate()
-        try:
-            BOT_PROCESS.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            BOT_PROCESS.kill()
-        BOT_PROCESS = None
+    EXITED.put(None)  # Cancel pending restarts
+    with RESTART_LOCK:
+        for slot in WORKERS:
+            if slot["process"]:
+                logging.info(f"Stopping {_label(slot['shard'])} process via dashboard...")
+                _stop_process(slot["process"])
+                slot["process"] = None
+    _publish_status()
     return flask.jsonify({"success": True, "message": "Bot stopped."})
 
 @app.route('/api/control/start', methods=['POST'])
 @login_required
 def api_start():
-    global BOT_PROCESS, SHOULD_RESTART
-    if BOT_PROCESS and BOT_PROCESS.poll() is None:
+    global SHOULD_RESTART
+    if all(_alive(slot) for slot in WORKERS):
         return flask.jsonify({"success": False, "message": "Bot is already running."})
     SHOULD_RESTART = True
-    threading.Thread(target=start_bot_worker).start()
+    # A manual start also closes the crash-loop circuit
+    SUPERVISION.update(circuit_open=False, backoff=BACKOFF_BASE)
+    SUPERVISION["crash_times"].clear()
+    EXITED.put(None)
+
+    def start():
+        with RESTART_LOCK:
+            start_missing_workers()
+    threading.Thread(target=start).start()
     return flask.jsonify({"success": True, "message": "Bot start signal sent."})
 
+def worker_status(detail=False):
+    now = time.time()
+    running = [slot for slot in WORKERS if _alive(slot)]
+    if len(running) == len(WORKERS):
+        status = "running"
+    elif SUPERVISION["circuit_open"]:
+        status = "crash_loop"
+    elif SUPERVISION["next_restart_at"] and SHOULD_RESTART:
+        status = "backoff"
+    elif running:
+        status = "degraded"   # Some shards are down and not coming back on their own
+    else:
+        status = "stopped"
+    first = WORKERS[0]
+    result = {
+        "status": status,
+        "pid": first["process"].pid if _alive(first) else None,
+        "workers_running": len(running),
+        "workers_total": len(WORKERS),
+        "restarts": SUPERVISION["restarts"],
+        "circuit_open": SUPERVISION["circuit_open"],
+        "last_exit_code": RUN_HISTORY[0]["exit_code"] if RUN_HISTORY else None,
+    }
+    if detail:
+        next_restart = SUPERVISION["next_restart_at"]
+        result.update(
+            uptime=round(now - first["process"].started_at, 1) if _alive(first) else None,
+            backoff=SUPERVISION["backoff"],
+            next_restart_in=round(max(0, next_restart - now), 1) if next_restart and SHOULD_RESTART else None,
+            recent_crashes=len(SUPERVISION["crash_times"]),
+            last_handoff=SUPERVISION["last_handoff"],
+            history=list(RUN_HISTORY),
+            workers=[{
+                "shard": slot["shard"],
+                "pid": slot["process"].pid if _alive(slot) else None,
+                "uptime": round(now - slot["process"].started_at, 1) if _alive(slot) else None,
+            } for slot in WORKERS],
+            ingest=update_forwarder.snapshot() if SUPERVISOR_INGEST else None,
+        )
+    return result
+
+def _publish_status():
+    hub.publish("status", worker_status())
+
+def _running_pids():
+    return [slot["process"].pid for slot in WORKERS if _alive(slot)]
+
+resource_sampler = ResourceSampler(_running_pids)
+TOTAL_MEMORY = psutil.virtual_memory().total
+
+def system_sample():
+    """Latest CPU and memory reading of the workers (summed), taken from the resource sampler."""
+    latest = resource_sampler.series.last() if _running_pids() else None
+    if latest is None:
+        return {"cpu": 0.0, "memory_percent": 0.0, "ts": time.time()}
+    ts, values = latest
+    return {"cpu": values["cpu"], "memory_percent": values["rss"] * 100 / TOTAL_MEMORY, "ts": ts}
+
+hub.add_source("system", system_sample, interval=2, replay=False)
+
 @app.route('/api/stats/system')
 @login_required
 def api_stats_system():
-    global BOT_PROCESS
-    cpu_percent = 0.0
-    memory_percent = 0.0
-    
-    if BOT_PROCESS and BOT_PROCESS.poll() is None:
-        try:
-            proc = psutil.Process(BOT_PROCESS.pid)
-            # interval=None is non-blocking, but first call usually 0.0
-            # Dividing by cpu_count to normalize 
-            cpu_percent = proc.cpu_percent(interval=None) / psutil.cpu_count()
-            
-            # Memory percent
-            memory_percent = proc.memory_percent()
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
-            
-    return flask.jsonify({
-        "cpu": cpu_percent,
-        "memory_percent": memory_percent
-    })
+    return flask.jsonify(system_sample())
+
+@app.route('/api/stats/series')
+@login_required
+def api_stats_series():
+    """Worker resource history: ?since=<unix ts>&until=<unix ts>&points=<max points>."""
+    now = time.time()
+    try:
+        since = float(flask.request.args.get("since", now - 3600))
+        until = float(flask.request.args.get("until", now))
+        points = int(flask.request.args.get("points", 300))
+    except ValueError:
+        return flask.jsonify({"error": "since, until and points must be numbers"}), 400
+    if until <= since:
+        return flask.jsonify({"error": "until must be after since"}), 400
+    return flask.jsonify(resource_sampler.series.query(since, until, points))
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Telegram update delivery (UPDATE_MODE=webhook). Answers as soon as the update is buffered."""
+    if UPDATE_MODE != "webhook" or not update_forwarder.lanes:
+        return "", 404
+    token = flask.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return "", 403
+    update = flask.request.get_json(silent=True)
+    if not isinstance(update, dict) or "update_id" not in update:
+        return "", 400
+    if not update_forwarder.submit(update):
+        return "", 503  # That worker's buffer is full; Telegram retries the delivery
+    return "", 200
 
 def run_flask():
     # Use PORT from environment or default to 5000
@@ -146,6 +438,12 @@ def run_flask():
     app.run(host="0.0.0.0", port=port)
 
 if __name__ == "__main__":
+    # /restart in the worker asks for a handoff with SIGUSR1
+    signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=restart_bot_process).start())
+    resource_sampler.start()
+    if SUPERVISOR_INGEST:
+        update_forwarder.start(WORKER_COUNT, lambda shard: WORKERS[shard]["socket"])
+        start_ingestion()
     # Start Monitor Thread
     threading.Thread(target=monitor_bot_worker, daemon=True).start()
     # Start Flask
@@ -1,23 +1,57 @@
-from flask import Blueprint, render_template, jsonify, request, send_file, session, redirect, url_for, flash
+from flask import Blueprint, render_template, jsonify, request, send_file, session, redirect, url_for, flash, Response, stream_with_context, g
 import os
 import json
 import logging
+import threading
+import time
+import hashlib
+import secrets
+from collections import OrderedDict
+from contextlib import closing
 from functools import wraps
-from config import DATA_DIR, STATE_DIR, ROOT_DIR, LOG_FILE, ADMIN_PASSWORD, MEMORY_ACCESS_PASSWORD
+from config import DATA_DIR, STATE_DIR, ROOT_DIR, LOG_FILE, ADMIN_PASSWORD, MEMORY_ACCESS_PASSWORD, MEMORY_DB_FILE
 import sqlite3
 import psutil
 from dotenv import dotenv_values
-from core.memory import CIPHER
+from core.memory import decode_messages, write_memory
+import core.modlog as modlog
+from core.events import hub
+from core.ipc import worker_call_all, IPCError
+from core.profiler import result_files
+from core.logfile import tail_lines, read_since, clear_logs as clear_log_files
+from core.notes_archive import iter_notes_archive, import_notes_archive, archive_filename, ArchiveError
 
 dashboard_bp = Blueprint('dashboard', __name__, template_folder='../templates', static_folder='../static')
-DB_FILE = "state/bot_memory.db"
+DB_FILE = MEMORY_DB_FILE
 
 # Paths
 GROUPS_FILE = os.path.join(STATE_DIR, "groups.txt")
 PROMPT_FILE = os.path.join(DATA_DIR, "prompt.txt")
 BADWORDS_FILE = os.path.join(DATA_DIR, "badwords.txt")
 FUN_FILE = os.path.join(DATA_DIR, "fun.json")
-LOG_PATH = os.path.join(ROOT_DIR, "bot.log")
+LOG_PATH = LOG_FILE
+
+MEMORY_PAGE_SIZE = 50
+MEMORY_PAGE_LIMIT = 200
+MEMORY_VIEW_PAGE = 100
+MEMORY_VIEW_PAGE_LIMIT = 500
+MEMORY_VIEW_TTL = 60           # seconds a decrypted memory stays cached for a session
+MEMORY_VIEW_CACHE_SIZE = 32
+
+_view_cache = OrderedDict()    # (session id, key) -> (version, messages, expires)
+_view_cache_lock = threading.Lock()
+
+def _memory_db():
+    """Read connection to the memory database for this request, closed when it ends."""
+    if "memory_db" not in g:
+        g.memory_db = sqlite3.connect(DB_FILE)
+    return g.memory_db
+
+@dashboard_bp.teardown_app_request
+def _close_memory_db(exception=None):
+    conn = g.pop("memory_db", None)
+    if conn is not None:
+        conn.close()
 
 def login_required(f):
     @wraps(f)
@@ -77,22 +111,150 @@ def api_stats():
 @dashboard_bp.route('/api/logs')
 @login_required
 def api_logs():
+    """Last 100 lines, or with ?since=<cursor> only the lines appended after it."""
     try:
-        if os.path.exists(LOG_PATH):
-            with open(LOG_PATH, 'r') as f:
-                lines = f.readlines()
-                return jsonify({"logs": lines[-100:]}) # Last 100 lines
-        return jsonify({"logs": []})
+        since = request.args.get('since')
+        if since:
+            lines, cursor, truncated = read_since(LOG_PATH, since)
+            return jsonify({"logs": lines, "cursor": cursor, "truncated": truncated})
+        lines, cursor = tail_lines(LOG_PATH, 100)
+        return jsonify({"logs": lines, "cursor": cursor, "reset": True})
     except Exception as e:
         return jsonify({"error": str(e)})
 
+# ========== Worker IPC ========== #
+def _notify_worker(cmd, **args):
+    """Best-effort command to every worker; returns False (and logs) if one can't be reached."""
+    delivered = True
+    for shard, result in enumerate(worker_call_all(cmd, **args)):
+        if isinstance(result, IPCError):
+            logging.warning(f"Worker {shard} command '{cmd}' not delivered: {result}")
+            delivered = False
+    return delivered
+
+def _sum_into(total, part):
+    for key, value in part.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+
+def worker_metrics(timeout=3):
+    """Metrics of all workers added up, with per-worker health under "workers"."""
+    workers, online = [], []
+    for shard, result in enumerate(worker_call_all("metrics", timeout=timeout)):
+        if isinstance(result, IPCError):
+            workers.append({"shard": shard, "online": False, "error": str(result)})
+        else:
+            workers.append({"shard": shard, "online": True, "pid": result["pid"], "state": result["state"],
+                            "uptime": result["uptime"], "ingest": result.get("ingest")})
+            online.append(result)
+    if not online:
+        return {"online": False, "workers": workers}
+
+    memory, llm, outbound = {}, {}, {}
+    for result in online:
+        _sum_into(memory, result["memory"])
+        _sum_into(llm, result["llm"])
+        _sum_into(outbound, result["outbound"])
+    lookups = memory.get("hits", 0) + memory.get("misses", 0)
+    memory["hit_rate"] = round(memory["hits"] / lookups, 3) if lookups else None
+    return {
+        "online": True,
+        "workers": workers,
+        "threads": sum(r["threads"] for r in online),
+        "memory": memory,
+        "llm": llm,
+        "outbound": outbound,
+        "scheduled": sum(r["scheduled"] for r in online),
+        "broadcast": next((r["broadcast"] for r in online if r["broadcast"] is not None), None),
+    }
+
+@dashboard_bp.route('/api/worker/metrics')
+@login_required
+def api_worker_metrics():
+    metrics = worker_metrics()
+    return jsonify(metrics), (200 if metrics["online"] else 503)
+
+# ========== Profiling ========== #
+@dashboard_bp.route('/api/worker/profile', methods=['GET'])
+@login_required
+def api_profile_status():
+    """Profiling state and cumulative handler times of every worker."""
+    workers = []
+    for shard, result in enumerate(worker_call_all("profile_status")):
+        if isinstance(result, IPCError):
+            workers.append({"shard": shard, "online": False, "error": str(result)})
+        else:
+            workers.append({"online": True, **result})
+    return jsonify({"workers": workers})
+
+@dashboard_bp.route('/api/worker/profile', methods=['POST'])
+@login_required
+def api_profile_start():
+    """Starts the same profiling session on every worker."""
+    data = request.get_json(silent=True) or {}
+    results = worker_call_all("profile", seconds=data.get("seconds", 30), mode=data.get("mode", "sample"))
+    failed = [f"worker {shard}: {result}" for shard, result in enumerate(results) if isinstance(result, IPCError)]
+    if len(failed) == len(results):
+        return jsonify({"error": "; ".join(failed)}), 400
+    return jsonify({"success": True, "failed": failed})
+
+@dashboard_bp.route('/api/worker/profile/<int:shard>/download')
+@login_required
+def api_profile_download(shard):
+    """The newest profile file a worker wrote (collapsed stacks or pstats)."""
+    files = result_files(shard)
+    if not files:
+        return jsonify({"error": "No profile yet"}), 404
+    return send_file(files[0], as_attachment=True, download_name=os.path.basename(files[0]))
+
+# ========== Live Events (SSE) ========== #
+@dashboard_bp.route('/api/events')
+@login_required
+def api_events():
+    """One long-lived stream per browser: status, system, stats, logs and memory events."""
+    response = Response(stream_with_context(hub.stream()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Don't let a reverse proxy buffer the stream
+    return response
+
+@hub.source("stats", interval=5)
+def _stats_event():
+    return get_stats()
+
+_log_cursor = None
+
+@hub.source("logs", interval=1, replay=False)
+def _logs_event():
+    global _log_cursor
+    if _log_cursor is None:
+        _, _log_cursor = tail_lines(LOG_PATH, 1)
+        return None
+    lines, cursor, truncated = read_since(LOG_PATH, _log_cursor)
+    if cursor == _log_cursor:
+        return None
+    previous, _log_cursor = _log_cursor, cursor
+    # Clients append only if "from" matches their own cursor, otherwise they refetch
+    return {"logs": lines, "from": previous, "cursor": cursor, "truncated": truncated}
+
+@hub.source("worker", interval=2)
+def _worker_event():
+    metrics = worker_metrics(timeout=1)
+    for worker in metrics["workers"]:
+        worker.pop("uptime", None)  # Changes every sample; keep the event change-driven
+    return metrics
+
+@hub.source("memory", interval=3)
+def _memory_event():
+    with closing(sqlite3.connect(DB_FILE)) as conn:
+        updated, count = conn.execute("SELECT MAX(last_updated), COUNT(*) FROM chat_memory").fetchone()
+    return {"updated": updated, "count": count}
+
 @dashboard_bp.route('/api/logs/clear', methods=['POST'])
 @login_required
 def clear_logs():
     try:
         if os.path.exists(LOG_PATH):
-            with open(LOG_PATH, 'w') as f:
-                f.write('')
+            clear_log_files(LOG_PATH)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)})
@@ -134,10 +296,77 @@ def api_data(type):
                 content = data.get('content', '')
                 with open(file_path, 'w') as f:
                     f.write(content)
+            _notify_worker("reload", target=type)
             return jsonify({"success": True})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+# --- Moderation Log Routes ---
+
+@dashboard_bp.route('/api/modlog', methods=['GET'])
+@login_required
+def api_modlog():
+    """Paginated moderation events, newest first. Filters: chat, user, since, until; cursor via `before`."""
+    try:
+        events, next_cursor = modlog.query_events(
+            chat_id=request.args.get('chat'),
+            user_id=request.args.get('user'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            before_id=request.args.get('before'),
+            limit=request.args.get('limit', 50)
+        )
+        return jsonify({"events": events, "next": next_cursor})
+    except ValueError:
+        return jsonify({"error": "Invalid filter"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/api/modlog/stats', methods=['GET'])
+@login_required
+def api_modlog_stats():
+    """Per-chat action totals"""
+    try:
+        return jsonify({"chats": modlog.chat_counts(request.args.get('chat'))})
+    except ValueError:
+        return jsonify({"error": "Invalid filter"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- Notes Backup Routes ---
+
+@dashboard_bp.route('/api/notes/export', methods=['GET'])
+@login_required
+def notes_export():
+    """Streams a tar.gz of every chat's notes"""
+    return Response(
+        stream_with_context(iter_notes_archive()),
+        mimetype='application/gzip',
+        headers={"Content-Disposition": f"attachment; filename={archive_filename()}"}
+    )
+
+@dashboard_bp.route('/api/notes/import', methods=['POST'])
+@login_required
+def notes_import():
+    """Validates and applies an uploaded notes archive"""
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({"error": "No file uploaded"}), 400
+    try:
+        # Queued edits go to disk before the archive replaces the files; the reload
+        # after it drops whatever was queued in between
+        _notify_worker("flush")
+        chat_ids = import_notes_archive(upload.stream)
+        reloaded = _notify_worker("reload", target="notes", chat_ids=chat_ids)
+        message = f"Imported notes for {len(chat_ids)} chats."
+        if not reloaded:
+            message += " The bot worker is not running; it will load them on start."
+        return jsonify({"success": True, "chats": len(chat_ids), "message": message})
+    except ArchiveError as e:
+        return jsonify({"error": f"Backup rejected, nothing was changed: {e}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # --- Memory Access Routes ---
 
 @dashboard_bp.route('/api/memory/auth', methods=['POST'])
@@ -152,59 +381,131 @@ def memory_auth():
     
     if pwd == current_mem_password or pwd == MEMORY_ACCESS_PASSWORD:
         session['memory_unlocked'] = True
+        session['memory_session'] = secrets.token_hex(8)
         return jsonify({"success": True})
     return jsonify({"success": False, "error": "Invalid password"}), 403
 
 @dashboard_bp.route('/api/memory/list', methods=['GET'])
 @login_required
 def memory_list():
-    """List all available memory keys"""
+    """
+    One page of memory keys, newest first, from columns only (nothing is decrypted).
+    Args: type=group|dm, limit, cursor (the "next" value of the previous page).
+    """
     if not session.get('memory_unlocked'):
         return jsonify({"error": "Locked"}), 403
-        
+
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT memory_key, last_updated FROM chat_memory ORDER BY last_updated DESC")
-        rows = cursor.fetchall()
-        conn.close()
-        
+        limit = max(1, min(request.args.get('limit', MEMORY_PAGE_SIZE, type=int), MEMORY_PAGE_LIMIT))
+        clauses, params = [], []
+        kind = request.args.get('type')
+        if kind in ('group', 'dm'):
+            # Walks idx_chat_memory_kind in page order
+            clauses.append("kind = ?")
+            params.append(kind)
+        cursor_arg = request.args.get('cursor')
+        if cursor_arg:
+            updated, _, after_key = cursor_arg.partition('|')
+            clauses.append("(last_updated, memory_key) < (?, ?)")
+            params += [updated, after_key]
+
+        query = "SELECT memory_key, last_updated, message_count, size_bytes FROM chat_memory"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY last_updated DESC, memory_key DESC LIMIT ?"
+        rows = _memory_db().execute(query, params + [limit + 1]).fetchall()
+
+        next_cursor = f"{rows[limit - 1][1]}|{rows[limit - 1][0]}" if len(rows) > limit else None
         return jsonify({
-            "chats": [{"key": r[0], "updated": r[1]} for r in rows]
+            "chats": [{"key": r[0], "updated": r[1], "messages": r[2], "bytes": r[3]} for r in rows[:limit]],
+            "next": next_cursor
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _memory_version(key):
+    """
+    Cheap change marker for one key: a Fernet token ends in its HMAC, so the last 43
+    characters change with every write. SQLite still reads the whole TEXT value to take
+    the substr, but only the tail reaches Python and nothing is decrypted.
+    """
+    row = _memory_db().execute(
+        "SELECT last_updated, message_count, size_bytes, substr(messages, -43) FROM chat_memory WHERE memory_key = ?",
+        (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    return hashlib.sha1("|".join(map(str, row)).encode()).hexdigest()[:16]
+
+def _cached_messages(key, version):
+    """
+    Decrypted messages for `key` at `version`, cached briefly for this dashboard session.
+    Returns None if the blob can't be decrypted; failures are never cached.
+    """
+    session_id = session.setdefault('memory_session', secrets.token_hex(8))
+    cache_key = (session_id, key)
+    now = time.monotonic()
+    with _view_cache_lock:
+        entry = _view_cache.get(cache_key)
+        if entry and entry[0] == version and entry[2] > now:
+            _view_cache.move_to_end(cache_key)
+            return entry[1]
+
+    row = _memory_db().execute("SELECT messages FROM chat_memory WHERE memory_key = ?", (key,)).fetchone()
+    try:
+        messages = decode_messages(row[0]) if row else []
+    except Exception as e:
+        logging.warning(f"Memory view: can't decrypt {key}: {e}")
+        return None
+
+    with _view_cache_lock:
+        _view_cache[cache_key] = (version, messages, now + MEMORY_VIEW_TTL)
+        _view_cache.move_to_end(cache_key)
+        while len(_view_cache) > MEMORY_VIEW_CACHE_SIZE:
+            _view_cache.popitem(last=False)
+    return messages
+
+def _drop_cached_view(key):
+    with _view_cache_lock:
+        for cache_key in [k for k in _view_cache if k[1] == key]:
+            del _view_cache[cache_key]
+
 @dashboard_bp.route('/api/memory/view/<key>', methods=['GET'])
 @login_required
 def memory_view(key):
-    """View encrypted memory for a specific key"""
+    """
+    One page of a key's messages. Args: offset, limit (default: the newest `limit` messages).
+    Answers 304 when If-None-Match still matches, without reading or decrypting the blob.
+    """
     if not session.get('memory_unlocked'):
         return jsonify({"error": "Locked"}), 403
-        
+
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT messages FROM chat_memory WHERE memory_key = ?", (key,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if not row:
-             return jsonify({"messages": []})
-             
-        # Decrypt logic duplicated from memory logic to keep dashboard independent or reusing component
-        encrypted_blob = row[0]
-        try:
-             decrypted_json = CIPHER.decrypt(encrypted_blob.encode()).decode()
-             messages = json.loads(decrypted_json)
-        except:
-             # Fallback
-             try:
-                 messages = json.loads(encrypted_blob)
-             except:
-                 messages = [{"role": "system", "content": "Error decrypting memory."}]
-                 
-        return jsonify({"messages": messages})
+        version = _memory_version(key)
+        if version is None:
+            return jsonify({"messages": [], "offset": 0, "total": 0})
+
+        limit = max(1, min(request.args.get('limit', MEMORY_VIEW_PAGE, type=int), MEMORY_VIEW_PAGE_LIMIT))
+        offset = request.args.get('offset', type=int)
+        etag = f"{version}-{offset if offset is not None else 'tail'}-{limit}"
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            messages = _cached_messages(key, version)
+            if messages is None:
+                # No ETag: the next request retries instead of revalidating the failure
+                return jsonify({
+                    "messages": [{"role": "system", "content": "Error decrypting memory."}], "offset": 0, "total": 1
+                })
+            total = len(messages)
+            if offset is None:
+                offset = max(0, total - limit)
+            offset = max(0, min(offset, total))
+            response = jsonify({"messages": messages[offset:offset + limit], "offset": offset, "total": total})
+        response.set_etag(etag)
+        # Always revalidate; the browser resends the ETag and gets a 304 if nothing changed
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -223,17 +524,13 @@ def memory_save():
         return jsonify({"error": "Invalid data"}), 400
         
     try:
-        # Encrypt
-        encrypted_data = CIPHER.encrypt(json.dumps(messages).encode()).decode()
-        
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO chat_memory (memory_key, messages, last_updated) VALUES (?, ?, CURRENT_TIMESTAMP)",
-            (key, encrypted_data)
-        )
+        write_memory(cursor, key, messages)
         conn.commit()
         conn.close()
+        _drop_cached_view(key)
+        _notify_worker("invalidate_memory", key=key)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -254,6 +551,8 @@ def memory_delete():
         cursor.execute("DELETE FROM chat_memory WHERE memory_key = ?", (key,))
         conn.commit()
         conn.close()
+        _drop_cached_view(key)
+        _notify_worker("invalidate_memory", key=key)
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -266,30 +565,12 @@ def memory_force_commit():
         return jsonify({"error": "Locked"}), 403
         
     try:
-        # We need to access the running bot's memory instance.
-        # Since this runs in the same process as the supervisor but the bot logic is in a subprocess/thread 
-        # (Wait, actually in supervisor mode, dashboard is main.py, worker is subprocess)
-        # We cannot access the worker's memory object directly.
-        # However, the worker writes to DB automatically.
-        # If the user wants to trigger a save from dashboard, we might need IPC or just rely on worker's nature.
-        
-        # But wait! The dashboard is editing the DB directly via SQL.
-        # The worker reads/writes to DB.
-        # If we "edit" via dashboard, we are writing to DB.
-        # The worker might have cached old data.
-        
-        # This architecture (Dashboard in Main, Bot in Subprocess) makes shared memory tricky.
-        # The Dashboard writes to SQLite.
-        # The Worker has an in-memory CACHE.
-        
-        # If Dashboard updates DB, Worker doesn't know.
-        # Worker might overwrite Dashboard changes on next save if it thinks its cache is newer.
-        # Ideally, we need to signal the Worker to RELOAD from DB or restart.
-        
-        # For now, let's implement a "Reload Memory" signal?
-        # Or just a restart.
-        
-        return jsonify({"success": True, "message": "Changes saved to DB. Note: Active bot process may need restart to pick up external DB edits."})
+        results = worker_call_all("flush")
+        failed = [str(r) for r in results if isinstance(r, IPCError)]
+        if failed:
+            return jsonify({"error": f"Could not reach the bot worker: {'; '.join(failed)}"}), 503
+        saved = sum(r["memory_saved"] for r in results)
+        return jsonify({"success": True, "message": f"Worker flushed memory (saved: {saved})."})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
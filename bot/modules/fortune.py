@@ -1,3 +1,4 @@
+import logging
 import telebot
 import random
 import json
@@ -5,13 +6,13 @@ import time
 import threading
 from datetime import datetime, timedelta
 from openai import OpenAI
-from config import OPENROUTER_API_KEY, AI_MODEL, MEMORY_LIMIT
+from config import OPENROUTER_API_KEY, AI_BASE_URL, AI_MODEL, MEMORY_LIMIT
 from core.bot_instance import bot
 from core.helper import load_from_file
 import core.memory as memory
 
 client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=AI_BASE_URL,
     api_key=OPENROUTER_API_KEY,
 )
 
@@ -53,4 +54,4 @@ def fortune(message):
         memory.chat_memory[key] = mem_list[-MEMORY_LIMIT:]
         memory.save_memory()
     except Exception as e:
-        print(f"Error saving fortune memory: {e}")
+        logging.error(f"Error saving fortune memory: {e}")
@@ -1,3 +1,4 @@
+import logging
 import json
 import random
 import time
@@ -35,7 +36,7 @@ def load_fun_content():
             with open(FUN_FILE, "r") as f:
                 return json.load(f)
     except Exception as e:
-        print(f"Error loading fun file: {e}")
+        logging.error(f"Error loading fun file: {e}")
     return {
         "roasts": ["You are barely worth roasting."],
         "motivations": ["You can do it!"]
@@ -45,6 +46,12 @@ fun_content = load_fun_content()
 roasts = fun_content.get("roasts", ["You are barely worth roasting."])
 motivations = fun_content.get("motivations", ["You can do it!"])
 
+def reload_fun_content():
+    global fun_content, roasts, motivations
+    fun_content = load_fun_content()
+    roasts = fun_content.get("roasts", ["You are barely worth roasting."])
+    motivations = fun_content.get("motivations", ["You can do it!"])
+
 # ——— AI Prompts —————————————————————————————————————————
 ROAST_SYSTEM = "You are a professional roaster. You are mean, funny, witty, and savage. Your goal is to absolutely destroy the person based on their name or just general insults. Keep it short (1-2 sentences) but deadly."
 MOTIVATE_SYSTEM = "You are a high-energy life coach and hype man. You give aggressive, powerful, and iconic motivation. Make them feel like a god. Keep it short and punchy."
@@ -100,7 +107,7 @@ def register_fun_handlers(bot):
             memory.chat_memory[key] = mem_list[-MEMORY_LIMIT:]
             memory.save_memory()
         except Exception as e:
-            print(f"Error saving roast memory: {e}")
+            logging.error(f"Error saving roast memory: {e}")
 
     @bot.message_handler(commands=['motivate'])
     def motivate_cmd(message):
@@ -149,6 +156,6 @@ def register_fun_handlers(bot):
             memory.chat_memory[key] = mem_list[-MEMORY_LIMIT:]
             memory.save_memory()
         except Exception as e:
-            print(f"Error saving motivate memory: {e}")
+            logging.error(f"Error saving motivate memory: {e}")
 
-    print("✅ Fun handlers registered.")
+    logging.info("✅ Fun handlers registered.")
@@ -1,17 +1,31 @@
+import json
 import requests
-import time
+import logging
+import aiohttp
 from telebot.types import Message
+from core.bot_instance import bot
+from core.scheduler import scheduler
+from core.dispatcher import after_send
+from core.async_engine import engine
 
+# Stable Horde status polling: every 5s, give up after ~10 minutes
+POLL_INTERVAL = 5
+MAX_POLLS = 120
 
-def imagine(bot, message: Message):
-    prompt = message.text.replace("/imagine", "", 1).strip()
-    if not prompt:
-        bot.reply_to(message, "Hit me with a prompt, and I shall paint it! 🎨")
-        return
 
-    bot.send_chat_action(message.chat.id, 'upload_photo')
+GENERATE_URL = "https://stablehorde.net/api/v2/generate/async"
+HEADERS = {
+    "apikey": "0000000000"  # anonymous access
+}
+SUBMIT_TIMEOUT = 30
 
-    payload = {
+
+def _prompt(message):
+    return message.text.replace("/imagine", "", 1).strip()
+
+
+def _payload(prompt):
+    return {
         "prompt": prompt,
         "params": {
             "n": 1,
@@ -27,35 +41,92 @@ def imagine(bot, message: Message):
         "censor_nsfw": False
     }
 
-    headers = {
-        "apikey": "0000000000"  # anonymous access
-    }
+
+def _queued(bot, message, gen_id, prompt):
+    # Poll from the scheduler instead of sleeping on this handler thread, once the
+    # status message (edited and deleted by the poll) is out
+    def poll(status):
+        scheduler.schedule(
+            POLL_INTERVAL, "imagine_poll",
+            chat_id=message.chat.id, reply_to=message.message_id,
+            status_id=status["message_id"], gen_id=gen_id, prompt=prompt, polls=1
+        )
+
+    with after_send(poll):
+        bot.reply_to(message, f"🛠️ Working on it... (ID: `{gen_id}`)", parse_mode="Markdown")
+
+
+def imagine(bot, message: Message):
+    prompt = _prompt(message)
+    if not prompt:
+        bot.reply_to(message, "Hit me with a prompt, and I shall paint it! 🎨")
+        return
+
+    bot.send_chat_action(message.chat.id, 'upload_photo')
 
     try:
-        res = requests.post("https://stablehorde.net/api/v2/generate/async", json=payload, headers=headers)
+        res = requests.post(GENERATE_URL, json=_payload(prompt), headers=HEADERS, timeout=SUBMIT_TIMEOUT)
         if res.status_code != 202:
             bot.reply_to(message, f"I said no 🙇🏻\nStatus: {res.status_code}\n{res.text}")
             return
 
-        gen_id = res.json().get("id")
-        status_msg = bot.reply_to(message, f"🛠️ Working on it... (ID: `{gen_id}`)", parse_mode="Markdown")
-
-        while True:
-            time.sleep(5)
-            status = requests.get(f"https://stablehorde.net/api/v2/generate/status/{gen_id}").json()
-            if status.get("done"):
-                images = status.get("generations", [])
-                if images:
-                    image_url = images[0]["img"]
-                    bot.send_photo(message.chat.id, image_url, caption=f"🌀 Dummy Here is You Image you begged for it - *{prompt}*", parse_mode="Markdown")
-                    # Delete the status message
-                    try:
-                        bot.delete_message(chat_id=message.chat.id, message_id=status_msg.message_id)
-                    except:
-                        pass
-                else:
-                    bot.reply_to(message, "I am not in the mood 😞")
-                break
+        _queued(bot, message, res.json().get("id"), prompt)
 
     except Exception as e:
         bot.reply_to(message, f"My skills choked 😩\n{e}")
+
+
+async def imagine_async(message: Message):
+    """imagine() for the asyncio engine: the Stable Horde request is awaited on the loop."""
+    prompt = _prompt(message)
+    if not prompt:
+        await engine.run_blocking(bot.reply_to, message, "Hit me with a prompt, and I shall paint it! 🎨")
+        return
+
+    await engine.run_blocking(bot.send_chat_action, message.chat.id, 'upload_photo')
+
+    try:
+        timeout = aiohttp.ClientTimeout(total=SUBMIT_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(GENERATE_URL, json=_payload(prompt), headers=HEADERS) as res:
+                status, text = res.status, await res.text()
+        if status != 202:
+            await engine.run_blocking(bot.reply_to, message, f"I said no 🙇🏻\nStatus: {status}\n{text}")
+            return
+
+        await engine.run_blocking(_queued, bot, message, json.loads(text).get("id"), prompt)
+
+    except Exception as e:
+        await engine.run_blocking(bot.reply_to, message, f"My skills choked 😩\n{e}")
+
+
+@scheduler.action("imagine_poll")
+def poll_generation(chat_id, reply_to, status_id, gen_id, prompt, polls):
+    try:
+        status = requests.get(f"https://stablehorde.net/api/v2/generate/status/{gen_id}", timeout=15).json()
+    except Exception as e:
+        status = {}
+        logging.warning(f"Stable Horde status check failed for {gen_id}: {e}")
+
+    if not status.get("done"):
+        if polls >= MAX_POLLS:
+            bot.send_message(chat_id, "I am not in the mood 😞", reply_to_message_id=reply_to)
+            return
+        scheduler.schedule(
+            POLL_INTERVAL, "imagine_poll",
+            chat_id=chat_id, reply_to=reply_to, status_id=status_id,
+            gen_id=gen_id, prompt=prompt, polls=polls + 1
+        )
+        return
+
+    images = status.get("generations", [])
+    if images:
+        image_url = images[0]["img"]
+        bot.send_photo(chat_id, image_url, caption=f"🌀 Dummy Here is You Image you begged for it - *{prompt}*", parse_mode="Markdown")
+        # Delete the status message
+        try:
+            bot.delete_message(chat_id=chat_id, message_id=status_id)
+        except:
+            pass
+    else:
+        bot.send_message(chat_id, "I am not in the mood 😞", reply_to_message_id=reply_to)
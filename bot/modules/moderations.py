@@ -4,19 +4,43 @@ import time
 import json
 import os
 import threading
+import logging
+from collections import deque, Counter, OrderedDict
 from datetime import datetime, timedelta
-from core.helper import load_from_file
+from core.helper import load_from_file, get_retry_after, atomic_write
 from core.bot_instance import bot
+from core.scheduler import scheduler
+from core.dispatcher import after_send, send_later
+from core.modlog import log_action
 from config import BADWORDS_FILE
 
 muted_users = {}
 user_messages = {}
 message_timestamps = {}
-user_warnings = {}
+
+# /purge bounds: Telegram's deleteMessages accepts at most 100 ids per call
+PURGE_LIMIT = 1000
+PURGE_CHUNK = 100
+
+# How long bot notices (purge confirmations, language warnings) stay visible
+NOTICE_TTL = 3
+WARNING_TTL = 30
+
+# Media flood control: the same sticker/GIF/photo (by file_unique_id) repeated in a chat
+MEDIA_WINDOW = 30              # seconds
+MEDIA_CHAT_REPEAT_LIMIT = 5    # same file from anyone in the chat
+MEDIA_USER_REPEAT_LIMIT = 3    # same file from one user (also gets muted)
+MEDIA_MUTE_DURATION = 300
+MEDIA_MAX_EVENTS = 200         # window entries kept per chat
+MEDIA_MAX_CHATS = 1000         # chats tracked at once (least recently active dropped)
 
 # Load global badwords (defaults)
 global_badwords = load_from_file(BADWORDS_FILE)
 
+def reload_badwords():
+    # In place, so every reference to the list sees the new words
+    global_badwords[:] = load_from_file(BADWORDS_FILE)
+
 # Configuration for Welcome/Moderation settings
 MOD_CONFIG_FILE = "moderation_config.json"
 
@@ -30,8 +54,8 @@ def load_mod_config():
         return {}
 
 def save_mod_config(config):
-    with open(MOD_CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=4)
+    # Other workers read this file at any time; never let them see it half-written
+    atomic_write(MOD_CONFIG_FILE, json.dumps(config, indent=4).encode())
 
 def get_effective_badwords(chat_id):
     conf = load_mod_config()
@@ -66,6 +90,43 @@ def check_perm(message):
         return True
     return is_admin(message.chat.id, message.from_user.id)
 
+@scheduler.action("delete_message")
+def _safe_delete(chat_id, message_id):
+    try:
+        bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+@scheduler.action("mute_expired")
+def _mute_expired_notice(chat_id, name):
+    bot.send_message(chat_id, f"🗣️ {name}'s mute is over. Behave this time.")
+
+def delete_messages_bulk(chat_id, message_ids):
+    """
+    Deletes messages with the bulk `deleteMessages` call, PURGE_CHUNK ids at a time.
+    Waits out `retry_after` on 429s. Returns (attempted, rejected, last error):
+    Telegram answers True even when it skips ids it can't delete, so only chunks it
+    rejects as a whole (permissions, bad request) are known to have failed.
+    """
+    attempted = rejected = 0
+    error = None
+    for i in range(0, len(message_ids), PURGE_CHUNK):
+        chunk = message_ids[i:i + PURGE_CHUNK]
+        for attempt in range(3):
+            try:
+                bot.delete_messages(chat_id, chunk)
+                attempted += len(chunk)
+                break
+            except Exception as e:
+                wait = get_retry_after(e)
+                if wait is None or attempt == 2:
+                    logging.warning(f"Bulk delete failed in {chat_id} for {len(chunk)} messages: {e}")
+                    rejected += len(chunk)
+                    error = e
+                    break
+                time.sleep(wait)
+    return attempted, rejected, error
+
 def register_moderation_handlers(bot):
     
     # --- Welcome Handling ---
@@ -115,7 +176,7 @@ def register_moderation_handlers(bot):
             try:
                 bot.send_message(message.chat.id, welcome_msg)
             except Exception as e:
-                print(f"Failed to send welcome: {e}")
+                logging.warning(f"Failed to send welcome: {e}")
 
     # --- Configuration Commands ---
     @bot.message_handler(commands=['welcome'])
@@ -180,6 +241,7 @@ def register_moderation_handlers(bot):
         try:
             bot.unban_chat_member(message.chat.id, target.id) # Unban immediately kicks without perma-ban
             bot.reply_to(message, f"👢 {target.first_name} has been kicked.")
+            log_action(message.chat.id, "kick", actor_id=message.from_user.id, target_id=target.id)
         except Exception as e:
             bot.reply_to(message, f"❌ Failed: {e}")
 
@@ -201,6 +263,7 @@ def register_moderation_handlers(bot):
         try:
             bot.ban_chat_member(message.chat.id, target.id)
             bot.reply_to(message, f"⛔ {target.first_name} banned.")
+            log_action(message.chat.id, "ban", actor_id=message.from_user.id, target_id=target.id)
         except Exception as e:
             bot.reply_to(message, f"❌ Failed: {e}")
 
@@ -226,6 +289,8 @@ def register_moderation_handlers(bot):
         try:
             bot.restrict_chat_member(message.chat.id, target.id, until_date=time.time()+duration, can_send_messages=False)
             bot.reply_to(message, f"🤐 {target.first_name} muted for {duration//60} mins.")
+            log_action(message.chat.id, "mute", actor_id=message.from_user.id, target_id=target.id, reason=f"{duration//60}m")
+            scheduler.schedule(duration, "mute_expired", chat_id=message.chat.id, name=target.first_name)
         except Exception as e:
             bot.reply_to(message, f"❌ Failed: {e}")
 
@@ -241,6 +306,7 @@ def register_moderation_handlers(bot):
         try:
             bot.restrict_chat_member(message.chat.id, target.id, can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True)
             bot.reply_to(message, f"🗣️ {target.first_name} unmuted.")
+            log_action(message.chat.id, "unmute", actor_id=message.from_user.id, target_id=target.id)
         except Exception as e:
             bot.reply_to(message, f"❌ Failed: {e}")
 
@@ -253,20 +319,19 @@ def register_moderation_handlers(bot):
         try:
             args = message.text.split()
             count = int(args[1]) if len(args) > 1 else 10
-            if count > 100: count = 100 # Safe limit
+            if count > PURGE_LIMIT: count = PURGE_LIMIT # Safe limit
             
             message_ids = [k for k in range(message.message_id - count, message.message_id + 1)]
-            # Needs delete_messages (plural) or loop
-            # Telebot might not support plural delete easily in older versions, loop is safer
-            for mid in message_ids:
-                try:
-                    bot.delete_message(message.chat.id, mid)
-                except:
-                    pass
+            attempted, rejected, error = delete_messages_bulk(message.chat.id, message_ids)
+            log_action(message.chat.id, "purge", actor_id=message.from_user.id, reason=f"{attempted} attempted, {rejected} rejected")
             
-            confirm = bot.send_message(message.chat.id, f"🗑️ Purged {count} messages.")
-            time.sleep(3)
-            bot.delete_message(message.chat.id, confirm.message_id)
+            # Telegram doesn't say which ids it skipped (too old, already gone), so this is an upper bound
+            report = f"🗑️ Asked Telegram to delete {attempted} messages."
+            if rejected:
+                report += f" ⚠️ Telegram rejected {rejected}: {getattr(error, 'description', error)}"
+            # Clean up the confirmation later without holding this handler thread
+            with after_send(lambda confirm: scheduler.schedule(NOTICE_TTL, "delete_message", chat_id=message.chat.id, message_id=confirm["message_id"])):
+                bot.send_message(message.chat.id, report)
         except Exception as e:
              bot.reply_to(message, f"❌ Error: {e}")
 
@@ -340,6 +405,102 @@ def register_moderation_handlers(bot):
         save_mod_config(conf)
         bot.reply_to(message, f"✅ `{word}` removed from this group's bad words list.", parse_mode="Markdown")
 
+def _remove_offending_message(message, reason, mute_for=None):
+    """Shared enforcement for auto-moderation: delete, optionally mute, and log."""
+    chat_id = message.chat.id
+    user = message.from_user
+    try:
+        bot.delete_message(chat_id, message.message_id)
+    except Exception:
+        return False
+    log_action(chat_id, "auto_delete", target_id=user.id, reason=reason)
+
+    if mute_for:
+        try:
+            bot.restrict_chat_member(chat_id, user.id, until_date=time.time()+mute_for, can_send_messages=False)
+            log_action(chat_id, "mute", target_id=user.id, reason=f"{reason} ({mute_for//60}m)")
+            # A flooded chat's send queue can be long; don't hold the handler for the notice
+            with send_later(), after_send(lambda notice: scheduler.schedule(WARNING_TTL, "delete_message", chat_id=chat_id, message_id=notice["message_id"])):
+                bot.send_message(chat_id, f"🤐 {user.first_name} muted for {mute_for//60} mins. Enough spam.")
+            scheduler.schedule(mute_for, "mute_expired", chat_id=chat_id, name=user.first_name)
+        except Exception as e:
+            logging.warning(f"Failed to mute {user.id} in {chat_id} for {reason}: {e}")
+    return True
+
+class MediaFloodTracker:
+    """
+    Sliding-window counts of file_unique_id per chat. Each chat keeps a bounded
+    deque of recent (time, file, user) events plus running counters, so a check
+    is O(1) amortized and memory is capped at MEDIA_MAX_CHATS * MEDIA_MAX_EVENTS.
+    """
+    def __init__(self, window=MEDIA_WINDOW, max_events=MEDIA_MAX_EVENTS, max_chats=MEDIA_MAX_CHATS):
+        self.window = window
+        self.max_events = max_events
+        self.max_chats = max_chats
+        self.chats = OrderedDict()  # chat_id -> (events deque, file counter, (file, user) counter)
+        self.lock = threading.Lock()
+
+    def _evict(self, events, files, pairs, cutoff):
+        while events and (events[0][0] < cutoff or len(events) >= self.max_events):
+            _, fid, uid = events.popleft()
+            files[fid] -= 1
+            if not files[fid]: del files[fid]
+            pairs[(fid, uid)] -= 1
+            if not pairs[(fid, uid)]: del pairs[(fid, uid)]
+
+    def hit(self, chat_id, user_id, file_id, now=None):
+        """Records one sighting and returns (chat_count, user_count) for that file in the window."""
+        now = now or time.time()
+        with self.lock:
+            state = self.chats.get(chat_id)
+            if state is None:
+                state = (deque(), Counter(), Counter())
+                self.chats[chat_id] = state
+                if len(self.chats) > self.max_chats:
+                    self.chats.popitem(last=False)
+            else:
+                self.chats.move_to_end(chat_id)
+
+            events, files, pairs = state
+            self._evict(events, files, pairs, now - self.window)
+            events.append((now, file_id, user_id))
+            files[file_id] += 1
+            pairs[(file_id, user_id)] += 1
+            return files[file_id], pairs[(file_id, user_id)]
+
+media_tracker = MediaFloodTracker()
+
+def _media_fingerprint(message):
+    if message.sticker: return message.sticker.file_unique_id
+    if message.animation: return message.animation.file_unique_id
+    if message.photo: return message.photo[-1].file_unique_id
+    if message.video: return message.video.file_unique_id
+    return None
+
+def auto_moderate_media(message):
+    """Flood control for stickers, GIFs, photos and videos. Returns True if the message was removed."""
+    if message.chat.type == "private" or not message.from_user:
+        return False
+
+    file_id = _media_fingerprint(message)
+    if not file_id:
+        return False
+
+    user_id = message.from_user.id
+    chat_count, user_count = media_tracker.hit(message.chat.id, user_id, file_id)
+    if chat_count < MEDIA_CHAT_REPEAT_LIMIT and user_count < MEDIA_USER_REPEAT_LIMIT:
+        return False
+
+    # Only pay for the admin lookup once a threshold is crossed
+    if is_admin(message.chat.id, user_id):
+        return False
+
+    if user_count >= MEDIA_USER_REPEAT_LIMIT:
+        # Mute once when the user crosses the limit; later repeats are just deleted
+        mute_for = MEDIA_MUTE_DURATION if user_count == MEDIA_USER_REPEAT_LIMIT else None
+        return _remove_offending_message(message, "media_flood", mute_for=mute_for)
+    return _remove_offending_message(message, "media_flood")
+
 # Auto-moderation (Logic Refined)
 def auto_moderate(message):
     chat_id = message.chat.id
@@ -354,12 +515,9 @@ def auto_moderate(message):
     # 1. Spam Filter (Simple: < 0.7s between messages)
     if now - last_time < 0.7:
         if not is_admin(chat_id, int(user_id)):
-            try:
-                bot.delete_message(chat_id, message.message_id)
-                # Don't warn every time, just delete
+            # Don't warn every time, just delete
+            if _remove_offending_message(message, "flood"):
                 return True
-            except:
-                pass
     
     message_timestamps[user_id] = now
     
@@ -374,11 +532,13 @@ def auto_moderate(message):
         if not is_admin(chat_id, int(user_id)):
             try:
                 bot.delete_message(chat_id, message.message_id)
-                bot.send_message(chat_id, f"🚫 Watch your language, {message.from_user.first_name}!")
+                log_action(chat_id, "auto_delete", target_id=int(user_id), reason="badword")
+                with send_later(), after_send(lambda warning: scheduler.schedule(WARNING_TTL, "delete_message", chat_id=chat_id, message_id=warning["message_id"])):
+                    bot.send_message(chat_id, f"🚫 Watch your language, {message.from_user.first_name}!")
                 return True
             except:
                 pass
                 
     return False
 
-print("✅ Moderation handlers registered.")
+logging.info("✅ Moderation handlers registered.")
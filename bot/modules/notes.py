@@ -1,17 +1,122 @@
+import logging
 import os
 import json
 import re
+import hashlib
+import atexit
+import threading
+from contextlib import contextmanager
+from bisect import bisect_left
+from collections import Counter
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from core.bot_instance import bot
+from core.helper import atomic_write
 from modules.moderations import is_admin
 from config import NOTES_DIR
 
 if not os.path.exists(NOTES_DIR):
     os.makedirs(NOTES_DIR)
 
+HASHTAG_RE = re.compile(r"#(\w+)")
+MAX_HASHTAG_NOTES = 5  # notes sent for a single message with several #tags
+NOTES_PAGE_SIZE = 30
+CALLBACK_DATA_BYTES = 64     # Telegram's limit on callback_data, in UTF-8 bytes
+MAX_STORED_QUERIES = 1000
+MAX_SEARCH_RESULTS = 100
+FUZZY_FALLBACK_BELOW = 5     # add fuzzy matches when prefix search finds fewer than this
+FUZZY_MIN_SIMILARITY = 0.5
+
+class NoteIndex:
+    """
+    Note names of one chat: a set for lookups, a pre-sorted tuple for paging and
+    prefix search, and a trigram map (built on first search) for fuzzy matches.
+    """
+    __slots__ = ("enabled", "names", "sorted_names", "_trigrams")
+
+    def __init__(self, enabled, names):
+        self.enabled = enabled
+        self.names = frozenset(names)
+        self.sorted_names = tuple(sorted(self.names))
+        self._trigrams = None
+
+    @staticmethod
+    def trigrams(text):
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def prefix(self, query):
+        results = []
+        i = bisect_left(self.sorted_names, query)
+        while i < len(self.sorted_names) and self.sorted_names[i].startswith(query):
+            results.append(self.sorted_names[i])
+            i += 1
+        return results
+
+    def search(self, query, limit=MAX_SEARCH_RESULTS):
+        """Prefix matches (alphabetical); falls back to fuzzy trigram matches when there are few."""
+        results = self.prefix(query)[:limit]
+        if len(results) >= FUZZY_FALLBACK_BELOW:
+            return results
+
+        if self._trigrams is None:
+            grams = {}
+            for name in self.sorted_names:
+                for gram in self.trigrams(name):
+                    grams.setdefault(gram, []).append(name)
+            self._trigrams = grams
+
+        query_grams = self.trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._trigrams.get(gram, ()))
+        # Dice similarity on trigram sets (a name of length n has n + 1 trigrams)
+        scores = {
+            name: 2 * count / (len(query_grams) + len(name) + 1)
+            for name, count in shared.items() if name not in results
+        }
+        fuzzy = sorted((n for n, score in scores.items() if score >= FUZZY_MIN_SIMILARITY), key=lambda n: (-scores[n], n))
+        return results + fuzzy[:limit - len(results)]
+
+# Writes are coalesced: a save parks a serialized snapshot in _pending_writes and a
+# timer writes it once after NOTES_WRITE_DELAY, however many edits came in between.
+# The snapshot stays there until it is on disk, so readers never fall back to an
+# older file. _generations counts saves per chat, so a reader that read the file
+# while a save happened doesn't replace the newer index with what it read.
+NOTES_WRITE_DELAY = 0.5
+_pending_writes = {}
+_generations = {}
+_pending_lock = threading.Lock()
+_chat_locks = {}
+
+# In-memory note index per chat: chat_id -> NoteIndex.
+# Refreshed whenever notes are loaded or saved, so a #tag miss never touches the disk.
+_notes_index = {}
+_index_lock = threading.Lock()
+
+# Search queries too long for a button's callback_data, by short key.
+# Bounded, oldest first out; a button whose key is gone asks for a new search.
+_stored_queries = {}
+_queries_lock = threading.Lock()
+
 def get_notes_file(chat_id):
     return os.path.join(NOTES_DIR, f"{chat_id}.json")
 
-def load_notes(chat_id):
+def _chat_lock(chat_id):
+    with _pending_lock:
+        return _chat_locks.setdefault(str(chat_id), threading.Lock())
+
+@contextmanager
+def notes_lock(chat_id):
+    """Hold around load -> modify -> save so concurrent edits to a chat can't overwrite each other."""
+    with _chat_lock(chat_id):
+        yield
+
+def _read_notes(chat_id):
+    with _pending_lock:
+        pending = _pending_writes.get(str(chat_id))
+    if pending is not None:
+        return json.loads(pending)  # Not on disk yet
+
     file_path = get_notes_file(chat_id)
     if not os.path.exists(file_path):
         # Default structure with 'enabled' set to True
@@ -27,10 +132,109 @@ def load_notes(chat_id):
     except Exception:
          return {"notes": {}, "pinned": None, "enabled": True}
 
+def index_notes(chat_id, data):
+    """Updates the in-memory name index for a chat from its notes data."""
+    _notes_index[str(chat_id)] = NoteIndex(data.get("enabled", True), data.get("notes", {}))
+
+def load_notes(chat_id):
+    chat_id = str(chat_id)
+    with _pending_lock:
+        generation = _generations.get(chat_id, 0)
+    data = _read_notes(chat_id)
+    with _pending_lock:
+        if _generations.get(chat_id, 0) == generation:
+            index_notes(chat_id, data)
+    return data
+
+def get_note_index(chat_id):
+    """Returns the NoteIndex for a chat, reading the file only on first use."""
+    chat_id = str(chat_id)
+    entry = _notes_index.get(chat_id)
+    if entry is None:
+        with _index_lock:
+            entry = _notes_index.get(chat_id)
+            if entry is None:
+                load_notes(chat_id)
+                entry = _notes_index[chat_id]
+    return entry
+
+def reload_notes(chat_ids=None):
+    """
+    Forgets cached indexes and queued writes (all chats, or the given ones) after the
+    files were replaced, e.g. by a backup import. Queued writes hold older data and
+    would land on top of the new files, so they are dropped, not flushed.
+    """
+    with _pending_lock:
+        chat_ids = set(_pending_writes) | set(_notes_index) if chat_ids is None else {str(c) for c in chat_ids}
+    dropped = 0
+    for cid in chat_ids:
+        with _chat_lock(cid):   # Let a write already under way finish first
+            with _pending_lock:
+                dropped += _pending_writes.pop(cid, None) is not None
+                _generations[cid] = _generations.get(cid, 0) + 1
+                _notes_index.pop(cid, None)
+    if dropped:
+        logging.warning(f"Dropped queued notes edits for {dropped} chats replaced by an import")
+
 def save_notes_to_file(chat_id, data):
-    file_path = get_notes_file(chat_id)
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=4)
+    """Queues a chat's notes for writing; edits within NOTES_WRITE_DELAY share one write."""
+    chat_id = str(chat_id)
+    snapshot = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    with _pending_lock:
+        _generations[chat_id] = _generations.get(chat_id, 0) + 1
+        index_notes(chat_id, data)
+        first = chat_id not in _pending_writes
+        _pending_writes[chat_id] = snapshot
+    if first:
+        _schedule_flush(chat_id)
+
+def _schedule_flush(chat_id):
+    timer = threading.Timer(NOTES_WRITE_DELAY, flush_notes, args=(chat_id,))
+    timer.daemon = True
+    timer.start()
+
+def flush_notes(chat_id=None):
+    """Writes queued notes to disk now (one chat, or all of them)."""
+    with _pending_lock:
+        chat_ids = [str(chat_id)] if chat_id is not None else list(_pending_writes)
+    for cid in chat_ids:
+        with _chat_lock(cid):
+            with _pending_lock:
+                snapshot = _pending_writes.get(cid)
+            if snapshot is None:
+                continue
+            try:
+                atomic_write(get_notes_file(cid), snapshot)
+                written = True
+            except Exception as e:
+                logging.error(f"Error writing notes for {cid}, will retry: {e}")
+                written = False
+            with _pending_lock:
+                # Stays queued if the write failed or a save came in during it
+                done = written and _pending_writes.get(cid) is snapshot
+                if done:
+                    del _pending_writes[cid]
+        if not done:
+            _schedule_flush(cid)
+
+atexit.register(flush_notes)
+
+def page_callback_data(page, query=None):
+    """
+    callback_data for a notes page button. A query that doesn't fit in Telegram's
+    64 bytes is kept here and the button carries its key instead, so later pages
+    search for exactly the same text.
+    """
+    data = f"notes:{page}:{query}" if query else f"notes:{page}"
+    if len(data.encode("utf-8")) <= CALLBACK_DATA_BYTES:
+        return data
+    key = hashlib.blake2b(query.encode("utf-8"), digest_size=8).hexdigest()
+    with _queries_lock:
+        _stored_queries.pop(key, None)
+        _stored_queries[key] = query
+        while len(_stored_queries) > MAX_STORED_QUERIES:
+            del _stored_queries[next(iter(_stored_queries))]
+    return f"notesq:{page}:{key}"
 
 def check_perm(message):
     """Returns True if user is admin or chat is private"""
@@ -84,9 +288,10 @@ def register_notes_handlers(bot):
             return
             
         chat_id = str(message.chat.id)
-        data = load_notes(chat_id)
-        data["enabled"] = not data["enabled"]
-        save_notes_to_file(chat_id, data)
+        with notes_lock(chat_id):
+            data = load_notes(chat_id)
+            data["enabled"] = not data["enabled"]
+            save_notes_to_file(chat_id, data)
         
         status = "enabled" if data["enabled"] else "disabled"
         bot.reply_to(message, f"📝 Notes feature has been {status} for this chat!")
@@ -168,8 +373,10 @@ def register_notes_handlers(bot):
             "file_id": file_id
         }
 
-        data["notes"][note_name] = note_data
-        save_notes_to_file(chat_id, data)
+        with notes_lock(chat_id):
+            data = load_notes(chat_id)
+            data["notes"][note_name] = note_data
+            save_notes_to_file(chat_id, data)
         bot.reply_to(message, f"✅ Note `{note_name}` saved successfully!", parse_mode="Markdown")
 
     @bot.message_handler(commands=['note', 'get'])
@@ -200,7 +407,6 @@ def register_notes_handlers(bot):
             return
             
         chat_id = str(message.chat.id)
-        data = load_notes(chat_id)
 
         parts = message.text.split(" ", 1)
         if len(parts) < 2:
@@ -210,42 +416,97 @@ def register_notes_handlers(bot):
         title = parts[1].strip().lower()
 
         if title == "all" and message.text.startswith("/clear"):
-             data["notes"] = {}
-             data["pinned"] = None
-             save_notes_to_file(chat_id, data)
+             with notes_lock(chat_id):
+                 data = load_notes(chat_id)
+                 data["notes"] = {}
+                 data["pinned"] = None
+                 save_notes_to_file(chat_id, data)
              bot.reply_to(message, "🗑️ All notes deleted successfully!")
              return
 
-        if title in data["notes"]:
-            del data["notes"][title]
-            if data["pinned"] == title:
-                data["pinned"] = None
-            save_notes_to_file(chat_id, data)
+        with notes_lock(chat_id):
+            data = load_notes(chat_id)
+            found = title in data["notes"]
+            if found:
+                del data["notes"][title]
+                if data["pinned"] == title:
+                    data["pinned"] = None
+                save_notes_to_file(chat_id, data)
+
+        if found:
             bot.reply_to(message, f"🗑️ Note `{title}` deleted successfully!", parse_mode="Markdown")
         else:
             bot.reply_to(message, "❌ Note not found!")
 
+    def render_notes_page(index, page, query=None):
+        """Builds (text, keyboard) for one page of the note list or of search results."""
+        names = index.search(query) if query else index.sorted_names
+        pages = max(1, -(-len(names) // NOTES_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        shown = names[page * NOTES_PAGE_SIZE:(page + 1) * NOTES_PAGE_SIZE]
+
+        if query:
+            header = f"🔎 **Notes matching** `{query}` ({len(names)})"
+        else:
+            header = f"📝 **Saved Notes** ({len(names)})"
+        if pages > 1:
+            header += f" — page {page + 1}/{pages}"
+        notes_str = "\n".join(f"- `{n}`" for n in shown)
+        text = f"{header}:\n\n{notes_str}\n\nUse `#notename` to retrieve."
+
+        markup = None
+        if pages > 1:
+            buttons = []
+            if page > 0:
+                buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=page_callback_data(page - 1, query)))
+            if page < pages - 1:
+                buttons.append(InlineKeyboardButton("Next ▶️", callback_data=page_callback_data(page + 1, query)))
+            markup = InlineKeyboardMarkup()
+            markup.row(*buttons)
+        return text, markup
+
     @bot.message_handler(commands=['notes'])
     def list_notes_handler(message):
         chat_id = str(message.chat.id)
-        data = load_notes(chat_id)
+        index = get_note_index(chat_id)
         
-        if not data["enabled"]:
+        if not index.enabled:
             return
 
-        if data["notes"]:
-            note_len = len(data["notes"])
-            # Format nicely
-            note_list = sorted(data["notes"].keys())
-            notes_str = "\n".join(f"- `{n}`" for n in note_list)
-            
-            bot.reply_to(
-                message,
-                f"📝 **Saved Notes** ({note_len}):\n\n{notes_str}\n\nUse `#notename` to retrieve.",
-                parse_mode="Markdown"
-            )
-        else:
+        if not index.names:
             bot.reply_to(message, "📭 No saved notes found!")
+            return
+
+        parts = message.text.split(None, 1)
+        query = parts[1].strip().lower() if len(parts) > 1 else None
+        if query and not index.search(query):
+            bot.reply_to(message, f"🔎 No notes matching `{query}`.", parse_mode="Markdown")
+            return
+
+        text, markup = render_notes_page(index, 0, query)
+        bot.reply_to(message, text, parse_mode="Markdown", reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda call: call.data and call.data.startswith(("notes:", "notesq:")))
+    def notes_page_callback(call):
+        kind, page, *rest = call.data.split(":", 2)
+        query = rest[0] if rest else None
+        if kind == "notesq":
+            with _queries_lock:
+                query = _stored_queries.get(query)
+            if query is None:
+                bot.answer_callback_query(call.id, "This search has expired, run /notes again.")
+                return
+        index = get_note_index(str(call.message.chat.id))
+        if not index.enabled or not page.isdigit():
+            bot.answer_callback_query(call.id)
+            return
+
+        text, markup = render_notes_page(index, int(page), query)
+        try:
+            bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=markup)
+        except Exception:
+            pass  # Unchanged page (double tap) or message too old
+        bot.answer_callback_query(call.id)
 
     @bot.message_handler(commands=['pinnote'])
     def pin_note_handler(message):
@@ -260,11 +521,14 @@ def register_notes_handlers(bot):
 
         chat_id = str(message.chat.id)
         title = parts[1].strip().lower()
-        data = load_notes(chat_id)
-
-        if title in data["notes"]:
-            data["pinned"] = title
-            save_notes_to_file(chat_id, data)
+        with notes_lock(chat_id):
+            data = load_notes(chat_id)
+            found = title in data["notes"]
+            if found:
+                data["pinned"] = title
+                save_notes_to_file(chat_id, data)
+
+        if found:
             bot.reply_to(message, f"📌 Note `{title}` has been pinned!", parse_mode="Markdown")
         else:
             bot.reply_to(message, "❌ Note not found!")
@@ -285,20 +549,24 @@ def register_notes_handlers(bot):
     @bot.message_handler(func=lambda msg: msg.text and msg.text.startswith("#"))
     def hashtag_note_handler(message):
         chat_id = str(message.chat.id)
-        data = load_notes(chat_id)
+        index = get_note_index(chat_id)
         
-        if not data["enabled"]:
+        if not index.enabled or not index.names:
             return
             
-        # Extract the first hashtag word
-        match = re.search(r"#(\w+)", message.text)
-        if not match:
+        # Resolve every hashtag against the index; misses cost no I/O
+        titles = []
+        for tag in HASHTAG_RE.findall(message.text):
+            title = tag.lower()
+            if title in index.names and title not in titles:
+                titles.append(title)
+        if not titles:
             return
-            
-        title = match.group(1).lower()
         
-        if title in data["notes"]:
-            message_thread_id = message.message_thread_id if message.chat.is_forum and hasattr(message, 'message_thread_id') else None
-            send_note(chat_id, data["notes"][title], reply_to=message.message_id, message_thread_id=message_thread_id)
+        data = load_notes(chat_id)
+        message_thread_id = message.message_thread_id if message.chat.is_forum and hasattr(message, 'message_thread_id') else None
+        for title in titles[:MAX_HASHTAG_NOTES]:
+            if title in data["notes"]:
+                send_note(chat_id, data["notes"][title], reply_to=message.message_id, message_thread_id=message_thread_id)
 
-    print("✅ Notes handlers registered.")
+    logging.info("✅ Notes handlers registered.")
@@ -2,17 +2,29 @@ import telebot
 import os
 import subprocess
 import sys
+import signal
 import logging
 import threading
 import requests
+from functools import wraps
 from core.ai_response import process_ai_response
 import time
 import random
 from modules.moderations import is_admin
-from modules.notes import load_notes, save_notes_to_file
-from config import BASE_DIR, OWNER_ID, GROUPS_FILE, NOTES_DIR, HOST_DOMAIN
+import json
+import tempfile
+from modules.notes import save_notes_to_file, flush_notes, notes_lock, reload_notes
+import core.broadcast as broadcast_engine
+from core.notes_archive import write_notes_archive, import_notes_archive, validate_notes, archive_filename, ArchiveError
+from core.logfile import tail_lines
+from core.ipc import peer_call_all, IPCError
+from config import BASE_DIR, OWNER_ID, GROUPS_FILE, NOTES_DIR, HOST_DOMAIN, LOG_FILE, WORKER_COUNT, WORKER_SHARD
+from core.profiler import profiler, handler_stats
 from core.bot_instance import bot
 
+IMPORT_WINDOW = 300     # seconds an /importall waits for its archive
+_pending_imports = {}   # (chat id, owner id) -> deadline
+
 # Ensure groups.txt exists
 if not os.path.exists(GROUPS_FILE):
     with open(GROUPS_FILE, "w") as f:
@@ -22,16 +34,7 @@ if not os.path.exists(GROUPS_FILE):
 def save_group_id(message):
     """Saves group ID when the bot is added to a new group."""
     chat_id = str(message.chat.id)
-    
-    try:
-        with open(GROUPS_FILE, "r") as file:
-            existing_groups = {line.strip() for line in file.readlines()}
-    except FileNotFoundError:
-        existing_groups = set()
-    
-    if chat_id not in existing_groups:
-        with open(GROUPS_FILE, "a") as file:
-            file.write(f"{chat_id}\n")
+    if broadcast_engine.add_group_id(chat_id):
         logging.info(f"Added new group ID: {chat_id}")
 
 # ✅ Fetch and Save IDs from Existing Joined Groups
@@ -49,6 +52,7 @@ def fetch_existing_groups():
 
 # ✅ Owner-Only Decorator
 def owner_only(func):
+    @wraps(func)  # Keeps the command's name in handler stats
     def wrapper(message):
         if message.from_user.id == OWNER_ID:
             return func(message)
@@ -57,6 +61,26 @@ def owner_only(func):
     return wrapper
 
 
+def _notify_peers(cmd, **args):
+    """Runs an IPC command on the other shards' workers. Returns how many couldn't be reached."""
+    missed = 0
+    for shard, result in peer_call_all(cmd, **args).items():
+        if isinstance(result, IPCError):
+            logging.warning(f"Worker {shard} command '{cmd}' not delivered: {result}")
+            missed += 1
+    return missed
+
+def send_profile(chat_id, result):
+    if "error" in result:
+        bot.send_message(chat_id, f"❌ Profiling failed: {result['error']}")
+        return
+    slowest = handler_stats.snapshot(limit=5)["handlers"]
+    lines = [f"{h['name']}: {h['total_s']}s total, {h['avg_ms']}ms avg, {h['calls']} calls" for h in slowest]
+    caption = f"🔬 {result['mode']} profile, {result['seconds']:g}s"
+    if lines:
+        caption += "\n\nSlowest handlers since start:\n" + "\n".join(lines)
+    with open(result["path"], "rb") as f:
+        bot.send_document(chat_id, f, visible_file_name=result["file"], caption=caption[:1024])
 
 # ✅ Register All Owner Commands
 def register_owner_commands(bot):
@@ -69,6 +93,7 @@ def register_owner_commands(bot):
         """Exports the notes of a group as a .json file."""
         chat_id = str(message.chat.id)
         notes_file = os.path.join(NOTES_DIR, f"{chat_id}.json")
+        flush_notes(chat_id) # Make sure queued edits are on disk first
         
         if os.path.exists(notes_file):
             try:
@@ -85,12 +110,64 @@ def register_owner_commands(bot):
         """Instructs the user to upload a `.json` file."""
         bot.reply_to(message, "📥 Please send a `.json` file to import notes.")
 
+    @bot.message_handler(commands=['exportall'])
+    @owner_only
+    def export_all_notes(message):
+        """Exports every chat's notes as one compressed archive."""
+        flush_notes() # Make sure queued edits are on disk first
+        try:
+            with tempfile.TemporaryFile() as archive:
+                write_notes_archive(archive)
+                archive.seek(0)
+                bot.send_document(message.chat.id, archive, visible_file_name=archive_filename(), caption="📦 Notes backup for all chats.")
+        except Exception as e:
+            bot.reply_to(message, f"❌ Error exporting notes: {e}")
+
+    @bot.message_handler(commands=['importall'])
+    @owner_only
+    def request_import_all(message):
+        """Waits IMPORT_WINDOW for the owner to upload a backup archive in this chat."""
+        _pending_imports[(message.chat.id, message.from_user.id)] = time.time() + IMPORT_WINDOW
+        bot.reply_to(message, f"📥 Please send a `.tar.gz` backup made by /exportall within {IMPORT_WINDOW // 60} minutes. It replaces the notes of every chat it contains.")
+
+    def import_notes_backup(message):
+        """Applies an all-chats backup archive (owner only)."""
+        try:
+            file_info = bot.get_file(message.document.file_id)
+            downloaded_file = bot.download_file(file_info.file_path)
+            # Queued edits, here and on the other shards, would otherwise land on top of the imported files
+            flush_notes()
+            _notify_peers("flush")
+            with tempfile.TemporaryFile() as archive:
+                archive.write(downloaded_file)
+                archive.seek(0)
+                chat_ids = import_notes_archive(archive)
+            # Edits queued during the import are older than the files now
+            reload_notes(chat_ids)
+            missed = _notify_peers("reload", target="notes", chat_ids=chat_ids)
+            reply = f"✅ Imported notes for {len(chat_ids)} chats."
+            if missed:
+                reply += f" ⚠️ {missed} other worker(s) didn't answer and may serve the old notes until they restart."
+            bot.reply_to(message, reply)
+        except ArchiveError as e:
+            bot.reply_to(message, f"❌ Backup rejected, nothing was changed: {e}")
+        except Exception as e:
+            bot.reply_to(message, f"❌ Error importing backup: {e}")
+
     @bot.message_handler(content_types=['document'])
     def import_notes(message):
         """Imports a new notes file for the group when uploaded via /import."""
+        file_name = message.document.file_name or ""
+        if file_name.endswith(".tar.gz") and message.from_user.id == OWNER_ID:
+            # Only right after /importall in this chat, so a stray upload can't replace every chat's notes
+            deadline = _pending_imports.pop((message.chat.id, message.from_user.id), None)
+            if deadline is not None and deadline > time.time():
+                import_notes_backup(message)
+            return
+
         # Simple check if this is a reply to the import command could be added, 
         # but for now we trust the user knows what they are doing or we check file name closely.
-        if not message.document.file_name.endswith(".json"):
+        if not file_name.endswith(".json"):
              # Ignore non-json files or logging
              return
 
@@ -104,14 +181,16 @@ def register_owner_commands(bot):
 
         try:
             chat_id = str(message.chat.id)
-            notes_file = os.path.join(NOTES_DIR, f"{chat_id}.json")
-            
-            # ✅ Save the uploaded file as the group's notes
-            with open(notes_file, "wb") as file:
-                file.write(downloaded_file)
+            try:
+                data = validate_notes(json.loads(downloaded_file))
+            except (ValueError, ArchiveError) as e:
+                bot.reply_to(message, f"❌ That doesn't look like a notes export: {e}")
+                return
 
-            # Reload notes after import (optional if load_notes reads from file every time)
-            load_notes(chat_id)
+            # ✅ Save the uploaded notes through the atomic writer (also refreshes the name index)
+            with notes_lock(chat_id):
+                save_notes_to_file(chat_id, data)
+            flush_notes(chat_id)
             bot.reply_to(message, f"✅ Notes imported successfully for group {chat_id}!")
         except Exception as e:
             bot.reply_to(message, f"❌ Error importing notes: {e}")
@@ -133,30 +212,43 @@ def register_owner_commands(bot):
       if remove_header:
         text = text.replace("--no-header", "").strip()
     
-      try:
-        with open(GROUPS_FILE, "r") as file:
-            group_ids = file.readlines()
-        
-        if not group_ids:
-            bot.reply_to(message, "🚫 No groups found to broadcast.")
+      if broadcast_engine.active_job() is not None:
+        bot.reply_to(message, "⏳ A broadcast is already running. Check /broadcaststatus.")
+        return
+
+      broadcast_text = text if remove_header else f"📢 Broadcast from the owner:\n\n{text}"
+      # Sending happens in the background; progress is reported by editing a status message
+      job_id = broadcast_engine.start_broadcast(broadcast_text, message.chat.id)
+      if job_id is None:
+        bot.reply_to(message, "🚫 No groups found to broadcast.")
+
+    @bot.message_handler(commands=['broadcaststatus'])
+    @owner_only
+    def broadcast_status(message):
+        progress = broadcast_engine.job_progress()
+        if not progress:
+            bot.reply_to(message, "📭 No broadcasts yet.")
             return
-        
-        for group_id in group_ids:
-            gid = group_id.strip()
-            if not gid: continue
-            try:
-                broadcast_text = text if remove_header else f"📢 Broadcast from the owner:\n\n{text}"
-                bot.send_message(gid, broadcast_text)
-            except Exception as e:
-                logging.error(f"Failed to send to {gid}: {e}")
+        bot.reply_to(message, broadcast_engine.format_progress(progress))
 
-        bot.reply_to(message, "✅ Broadcast sent successfully!")
-      except FileNotFoundError:
-        bot.reply_to(message, "🚫 `groups.txt` not found.")
+    @bot.message_handler(commands=['prunegroups'])
+    @owner_only
+    def prune_groups(message):
+        if broadcast_engine.active_job() is not None:
+            bot.reply_to(message, "⏳ Wait for the running broadcast to finish first.")
+            return
+        removed, migrated = broadcast_engine.prune_dead_groups()
+        bot.reply_to(message, f"🧹 Removed {removed} dead groups, updated {migrated} migrated ones.")
 
     @bot.message_handler(commands=['restart'])
     @owner_only
     def restart_bot(message):
+        if os.environ.get("SUPERVISED") == "1":
+            # The supervisor boots a new worker and hands polling over without a gap
+            bot.reply_to(message, "♻️ Restarting bot (no downtime)...")
+            logging.info("Bot restart requested, signalling supervisor...")
+            os.kill(os.getppid(), signal.SIGUSR1)
+            return
         bot.reply_to(message, "♻️ Restarting bot...")
         logging.info("Bot is restarting...")
         # Start new process then exit
@@ -166,13 +258,8 @@ def register_owner_commands(bot):
     @owner_only
     def fetch_logs(message):
         try:
-            log_path = os.path.join(os.path.dirname(BASE_DIR), "bot.log") # Assuming log in root
-            if not os.path.exists(log_path):
-                 log_path = "bot.log"
-                 
-            with open(log_path, "r") as log_file:
-                logs = log_file.readlines()[-15:]  # Get last 15 log lines
-            
+            logs, _ = tail_lines(LOG_FILE, 15)  # Reads only the end of the file
+
             # chunking if needed
             msg = "📜 Last logs:\n\n" + "".join(logs)
             if len(msg) > 4000: msg = msg[-4000:]
@@ -180,6 +267,22 @@ def register_owner_commands(bot):
         except Exception as e:
             bot.reply_to(message, f"❌ Error reading logs: {e}")
 
+    @bot.message_handler(commands=['profile'])
+    @owner_only
+    def profile_worker(message):
+        """Profiles this worker on live traffic and sends back the result file."""
+        args = message.text.split()[1:]
+        chat_id = message.chat.id
+        try:
+            seconds = float(args[0]) if args else 30
+            mode = args[1] if len(args) > 1 else "sample"
+            profiler.start(seconds, mode, on_done=lambda result: send_profile(chat_id, result))
+        except ValueError as e:
+            bot.reply_to(message, f"❌ {e}\nUsage: /profile <seconds> [sample|cprofile]")
+            return
+        worker = f" (worker {WORKER_SHARD})" if WORKER_COUNT > 1 else ""
+        bot.reply_to(message, f"🔬 Profiling{worker} for {seconds:g}s ({mode})...")
+
     @bot.message_handler(commands=['dashboard'])
     @owner_only
     def get_dashboard_url(message):
@@ -204,13 +307,7 @@ def register_owner_commands(bot):
         chat_id = str(message.chat.id)
         # Append only if not exists
         try:
-            lines = []
-            if os.path.exists(GROUPS_FILE):
-                with open(GROUPS_FILE, "r") as f: lines = f.read().splitlines()
-            
-            if chat_id not in lines:
-                with open(GROUPS_FILE, "a") as file:
-                    file.write(f"{chat_id}\n")
+            if broadcast_engine.add_group_id(chat_id):
                 bot.reply_to(message, "✅ This group has been registered successfully!")
             else:
                 bot.reply_to(message, "✅ Already registered.")
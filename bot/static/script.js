@@ -25,12 +25,38 @@ async function fetchStats() {
     document.getElementById('group-count').innerText = data.groups;
 }
 
-async function fetchLogs() {
-    const res = await fetch('/api/logs');
+let logCursor = null;
+let logLines = [];
+const MAX_LOG_LINES = 1000;
+
+// LOG_FORMAT=json lines are rendered like the plain text format
+function formatLogLine(line) {
+    if (line[0] !== '{') return line;
+    try {
+        const e = JSON.parse(line);
+        const ctx = ['chat_id', 'user_id', 'latency_ms'].filter(k => e[k] !== undefined).map(k => `${k}=${e[k]}`);
+        return `${e.ts} - ${e.level} - [${e.proc}] ${e.msg}${ctx.length ? ' (' + ctx.join(' ') + ')' : ''}\n${e.exc ? e.exc + '\n' : ''}`;
+    } catch (err) {
+        return line;
+    }
+}
+
+async function fetchLogs(reset = false) {
+    if (reset) logCursor = null;
+    const url = logCursor ? '/api/logs?since=' + encodeURIComponent(logCursor) : '/api/logs';
+    const res = await fetch(url);
     const data = await res.json();
+    if (data.error) return;
     const container = document.getElementById('log-container');
-    container.innerText = data.logs.join('');
-    container.scrollTop = container.scrollHeight;
+    const atBottom = container.scrollTop + container.clientHeight >= container.scrollHeight - 20;
+    if (data.reset) logLines = [];
+    if (data.truncated) logLines.push('… (skipped older lines)\n');
+    logLines = logLines.concat(data.logs.map(formatLogLine)).slice(-MAX_LOG_LINES);
+    logCursor = data.cursor;
+    if (data.reset || data.logs.length || data.truncated) {
+        container.innerText = logLines.join('');
+        if (atBottom || data.reset) container.scrollTop = container.scrollHeight;
+    }
 }
 
 // Prompt Handles
@@ -111,40 +137,70 @@ async function unlockMemory() {
     }
 }
 
-async function loadMemoryList() {
-    const res = await fetch('/api/memory/list');
+let memoryListCursor = null;
+
+async function loadMemoryList(more = false) {
+    const type = document.getElementById('memory-filter').value;
+    const params = new URLSearchParams({limit: 50});
+    if (type) params.set('type', type);
+    if (more && memoryListCursor) params.set('cursor', memoryListCursor);
+    const res = await fetch('/api/memory/list?' + params);
     if (res.status === 403) return showLockScreen();
     
     const data = await res.json();
     const listContainer = document.getElementById('memory-list-container');
-    listContainer.innerHTML = '';
+    if (!more) listContainer.innerHTML = '';
+    const oldButton = document.getElementById('memory-load-more');
+    if (oldButton) oldButton.remove();
     
     if (data.chats) {
         data.chats.forEach(chat => {
             const el = document.createElement('div');
             el.className = 'memory-item';
-            el.innerHTML = `<i class="fa-solid fa-comments"></i> <div><strong>${chat.key}</strong><br><small>${chat.updated}</small></div>`;
+            const size = chat.bytes != null ? ` · ${(chat.bytes / 1024).toFixed(1)} KB` : '';
+            const count = chat.messages != null ? `${chat.messages} msgs` : '';
+            el.innerHTML = `<i class="fa-solid fa-comments"></i> <div><strong>${chat.key}</strong><br><small>${chat.updated}</small><br><small style="opacity:0.6;">${count}${size}</small></div>`;
             el.onclick = () => loadMemoryChat(chat.key);
             listContainer.appendChild(el);
         });
     }
+    memoryListCursor = data.next;
+    if (data.next) {
+        const button = document.createElement('button');
+        button.id = 'memory-load-more';
+        button.className = 'btn-micro';
+        button.style.margin = '0.5rem';
+        button.innerText = 'Load more';
+        button.onclick = () => loadMemoryList(true);
+        listContainer.appendChild(button);
+    }
 }
 
 let currentMemoryKey = null;
 let currentMessages = [];
+let currentOffset = 0; // index of currentMessages[0] in the full memory
 let selectedMessages = new Set();
+const MEMORY_VIEW_PAGE = 100;
+
+async function fetchMemoryPage(key, offset, limit) {
+    let url = '/api/memory/view/' + encodeURIComponent(key) + '?limit=' + limit;
+    if (offset !== null) url += '&offset=' + offset;
+    // The server sends an ETag; the browser revalidates and reuses its copy when unchanged
+    const res = await fetch(url);
+    if (res.status === 403) {
+        showLockScreen();
+        return null;
+    }
+    return res.json();
+}
 
 async function loadMemoryChat(key) {
     currentMemoryKey = key;
     selectedMessages.clear();
     updateDeleteSelectedState();
     
-    const res = await fetch('/api/memory/view/' + encodeURIComponent(key));
-    if (res.status === 403) return showLockScreen();
-    
-    const data = await res.json();
-    const container = document.getElementById('chat-messages');
-    container.innerHTML = '';
+    const data = await fetchMemoryPage(key, null, MEMORY_VIEW_PAGE);
+    if (!data) return;
     document.getElementById('chat-header-title').innerText = key;
     document.getElementById('memory-actions').style.display = 'flex';
     
@@ -152,34 +208,73 @@ async function loadMemoryChat(key) {
     document.getElementById('chat-messages').style.display = 'flex';
     document.getElementById('memory-editor-container').style.display = 'none';
     
-    // Store data for editor and deletion
+    // Newest page first; older pages are fetched on demand
     currentMessages = data.messages || [];
-    // document.getElementById('memory-json-editor').value = JSON.stringify(currentMessages, null, 4);
+    currentOffset = data.offset || 0;
+    renderChatMessages();
+    const container = document.getElementById('chat-messages');
+    container.scrollTop = container.scrollHeight;
+}
+
+async function loadEarlierMessages() {
+    if (currentOffset === 0) return;
+    const offset = Math.max(0, currentOffset - MEMORY_VIEW_PAGE);
+    const data = await fetchMemoryPage(currentMemoryKey, offset, currentOffset - offset);
+    if (!data) return;
+    const container = document.getElementById('chat-messages');
+    const fromBottom = container.scrollHeight - container.scrollTop;
+    currentMessages = (data.messages || []).concat(currentMessages);
+    currentOffset = offset;
+    renderChatMessages();
+    container.scrollTop = container.scrollHeight - fromBottom;
+}
+
+async function ensureAllMessages() {
+    // Editing and deleting work on the whole list
+    while (currentOffset > 0) {
+        const before = currentOffset;
+        await loadEarlierMessages();
+        if (currentOffset === before) return false;
+    }
+    return true;
+}
+
+function renderChatMessages() {
+    const container = document.getElementById('chat-messages');
+    container.innerHTML = '';
     
-    if (currentMessages) {
-        currentMessages.forEach((msg, index) => {
-            const el = document.createElement('div');
-            el.className = `chat-bubble ${msg.role}`;
-            el.dataset.index = index;
-            el.onclick = () => toggleMessageSelection(index, el);
-            
-            if (msg.role === 'assistant') {
-                el.innerHTML = `
-                    <div style="display:flex; align-items:flex-start; gap:10px; pointer-events: none;">
-                        <img src="/static/logo.jpeg" style="width:30px; min-width:30px; height:30px; border-radius:50%; object-fit:cover; border: 1px solid rgba(255,255,255,0.2);">
-                        <div>
-                            <div>${msg.content}</div>
-                            <small style="opacity:0.5; font-size:0.7rem; display:block; margin-top:2px;">${msg.timestamp || ''}</small>
-                        </div>
-                    </div>`;
-            } else {
-                el.innerHTML = `<div>${msg.content}</div>
-                                <small style="opacity:0.5; font-size:0.7rem; display:block; margin-top:5px; text-align:right;">${msg.timestamp || ''}</small>`;
-            }
-            container.appendChild(el);
-        });
+    if (currentOffset > 0) {
+        const more = document.createElement('button');
+        more.className = 'btn-micro';
+        more.style.alignSelf = 'center';
+        more.innerText = `Load earlier (${currentOffset} more)`;
+        more.onclick = loadEarlierMessages;
+        container.appendChild(more);
     }
-    container.scrollTop = container.scrollHeight;
+    
+    currentMessages.forEach((msg, i) => {
+        const index = currentOffset + i;
+        const el = document.createElement('div');
+        el.className = `chat-bubble ${msg.role}`;
+        if (selectedMessages.has(index)) el.classList.add('selected');
+        el.dataset.index = index;
+        el.onclick = () => toggleMessageSelection(index, el);
+        
+        if (msg.role === 'assistant') {
+            el.innerHTML = `
+                <div style="display:flex; align-items:flex-start; gap:10px; pointer-events: none;">
+                    <img src="/static/logo.jpeg" style="width:30px; min-width:30px; height:30px; border-radius:50%; object-fit:cover; border: 1px solid rgba(255,255,255,0.2);">
+                    <div>
+                        <div>${msg.content}</div>
+                        <small style="opacity:0.5; font-size:0.7rem; display:block; margin-top:2px;">${msg.timestamp || ''}</small>
+                    </div>
+                </div>`;
+        } else {
+            el.innerHTML = `<div>${msg.content}</div>
+                            <small style="opacity:0.5; font-size:0.7rem; display:block; margin-top:5px; text-align:right;">${msg.timestamp || ''}</small>`;
+        }
+        container.appendChild(el);
+    });
 }
 
 function toggleMessageSelection(index, el) {
@@ -207,6 +302,7 @@ async function deleteSelectedMessages() {
     if (selectedMessages.size === 0) return;
     Modal.confirm(`Delete ${selectedMessages.size} selected messages?`, async (ok) => {
         if (!ok) return;
+        if (!(await ensureAllMessages())) return;
 
         // Filter out messages where index is in selectedMessages
         const newMessages = currentMessages.filter((_, index) => !selectedMessages.has(index));
@@ -244,6 +340,7 @@ function createNewMemory() {
         document.getElementById('memory-actions').style.display = 'none'; // Hide delete until saved
         
         // Default template
+        currentOffset = 0;
         const timeNow = new Date().toISOString().slice(0, 19).replace('T', ' ');
         currentMessages = [
             {"role": "system", "content": "You are ZUZU Bot.", "timestamp": timeNow},
@@ -254,7 +351,7 @@ function createNewMemory() {
     });
 }
 
-function toggleEditMemory() {
+async function toggleEditMemory() {
     const visualView = document.getElementById('chat-messages');
     const editorView = document.getElementById('memory-editor-container');
     
@@ -262,6 +359,7 @@ function toggleEditMemory() {
         visualView.style.display = 'flex';
         editorView.style.display = 'none';
     } else {
+        if (!(await ensureAllMessages())) return;
         visualView.style.display = 'none';
         editorView.style.display = 'flex';
         currentPage = 1; // Reset to page 1
@@ -445,16 +543,27 @@ async function restartBot() {
 async function checkStatus() {
     try {
         const res = await fetch('/api/control/status');
-        const data = await res.json();
+        applyStatus(await res.json());
+    } catch(e) {
+        console.error("Status check failed", e);
+    }
+}
+
+function applyStatus(data) {
+    {
         const startBtn = document.getElementById('btn-toggle-bot');
         const statusEl = document.getElementById('bot-status');
 
-        const isRunning = data.status === 'running';
+        // Degraded: some shards are up, so the button still offers Stop
+        const isRunning = data.status === 'running' || data.status === 'degraded';
 
         // Update Status Text
         if(statusEl) {
-            statusEl.innerText = data.status.toUpperCase();
-            statusEl.style.color = isRunning ? 'var(--success)' : 'var(--danger)';
+            let text = data.status.toUpperCase().replace('_', ' ');
+            if (data.workers_total > 1) text += ` (${data.workers_running}/${data.workers_total})`;
+            statusEl.innerText = text;
+            statusEl.style.color = data.status === 'running' ? 'var(--success)'
+                : data.status === 'degraded' ? '#eab308' : 'var(--danger)';
         }
 
         // Update Toggle Button
@@ -473,9 +582,6 @@ async function checkStatus() {
                 startBtn.onclick = startBot;
             }
         }
-
-    } catch(e) {
-        console.error("Status check failed", e);
     }
 }
 
@@ -485,8 +591,7 @@ async function toggleBot() {
     await checkStatus();
 }
 
-// Poll status every 5 seconds
-setInterval(checkStatus, 5000);
+document.addEventListener('DOMContentLoaded', checkStatus);
 
 async function forceCommitMemory() {
     Modal.confirm("Are you sure you want to force save all memory from cache to disk? This might be needed if the bot is running but data isn't showing up yet.", async (ok) => {
@@ -547,7 +652,6 @@ async function startBot() {
 }
 
 // --- Live Graphs ---
-let liveGraphInterval = null;
 let systemChart = null;
 
 async function loadMemoryRangeGraph() {
@@ -588,10 +692,9 @@ async function loadMemoryRangeGraph() {
     } catch(e) { console.error("Error loading memory graph:", e); }
 }
 
-async function updateSystemGraph() {
+function updateSystemGraph(data) {
+    if (typeof Chart === 'undefined') return;
     try {
-        const res = await fetch('/api/stats/system');
-        const data = await res.json();
         const el = document.getElementById('systemGraph');
         if (!el) return;
 
@@ -633,11 +736,7 @@ async function updateSystemGraph() {
 }
 
 function startLiveGraphs() {
-    loadMemoryRangeGraph(); // Load once
-    // Update system graph every 2 seconds
-    liveGraphInterval = setInterval(() => {
-        updateSystemGraph();
-    }, 2000);
+    loadMemoryRangeGraph(); // Load once; the system graph is fed by the event stream
 }
 
 // Hook into DOMContentLoaded
@@ -777,36 +876,179 @@ async function saveSettings() {
     });
 }
 
-// --- Logs ---
-let logsInterval = null;
-
-function startLogsAutoRefresh() {
-    if (logsInterval) clearInterval(logsInterval);
-    logsInterval = setInterval(() => {
-        // Only refresh if logs tab is active
-        const logsTab = document.getElementById('tab-logs');
-        if (logsTab && logsTab.classList.contains('active')) {
-            fetchLogs();
-        }
-    }, 2000); // every 2 seconds
+// --- Notes Backup ---
+function exportNotesBackup() {
+    window.location.href = '/api/notes/export';
 }
 
-function stopLogsAutoRefresh() {
-    if (logsInterval) clearInterval(logsInterval);
+async function importNotesBackup(input) {
+    const file = input.files[0];
+    input.value = '';
+    if (!file) return;
+
+    Modal.confirm(`Import ${file.name}? Notes of every chat in the backup will be replaced.`, async (ok) => {
+        if (!ok) return;
+        const form = new FormData();
+        form.append('file', file);
+        try {
+            const res = await fetch('/api/notes/import', {method: 'POST', body: form});
+            const data = await res.json();
+            if (data.success) {
+                Modal.alert(data.message);
+            } else {
+                Modal.alert('Error: ' + data.error);
+            }
+        } catch (e) {
+            Modal.alert('Error importing backup: ' + e);
+        }
+    });
 }
 
+// --- Logs ---
 // Hook into tab switching
 const origSwitchTab = switchTab;
 switchTab = function(tabId) {
     origSwitchTab(tabId);
-    if (tabId === 'logs') {
-        fetchLogs();
-        startLogsAutoRefresh();
-    } else {
-        stopLogsAutoRefresh();
+    if (tabId === 'memory' && document.getElementById('memory-viewer').style.display !== 'none') {
+        loadMemoryList();
+    }
+}
+
+function isTabActive(tabId) {
+    const tab = document.getElementById('tab-' + tabId);
+    return tab && tab.classList.contains('active');
+}
+
+function renderWorkerMetrics(m) {
+    const el = document.getElementById('worker-metrics');
+    if (!el) return;
+    if (!m.online) {
+        el.innerText = 'Unreachable';
+        return;
+    }
+    const hitRate = m.memory.hit_rate != null ? Math.round(m.memory.hit_rate * 100) + '%' : '–';
+    let html = `LLM in flight: ${m.llm.in_flight} · Send queue: ${m.outbound.queued || 0}<br>` +
+        `Cache: ${m.memory.cached_keys} keys, ${hitRate} hits · Scheduled: ${m.scheduled}`;
+    if (m.workers.length > 1) {
+        // One dot per shard: green when it answers, red when it doesn't
+        const dots = m.workers.map(w =>
+            `<span title="Worker ${w.shard}: ${w.online ? w.state : w.error}" style="color:${w.online ? 'var(--success)' : 'var(--danger)'}">●</span>`
+        ).join('');
+        html += `<br>Workers: ${dots}`;
+    }
+    el.innerHTML = html;
+}
+
+// --- Profiling ---
+let profileTimer = null;
+const escapeText = s => String(s).replace(/[&<>"]/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]));
+
+async function loadProfileStatus() {
+    const statusEl = document.getElementById('profile-status');
+    if (!statusEl) return;
+    try {
+        const res = await fetch('/api/worker/profile');
+        renderProfileStatus((await res.json()).workers);
+    } catch (e) {
+        statusEl.innerText = 'Unreachable';
     }
 }
 
+function renderProfileStatus(workers) {
+    const running = workers.some(w => w.online && w.running);
+    const now = Date.now() / 1000;
+    document.getElementById('profile-status').innerHTML = workers.map(w => {
+        const label = workers.length > 1 ? `Worker ${w.shard}: ` : '';
+        if (!w.online) return label + 'unreachable';
+        if (w.running) return label + `profiling (${w.running.mode}), ${Math.max(0, Math.round(w.running.ends - now))}s left`;
+        if (!w.last) return label + 'no profile yet';
+        if (w.last.error) return label + 'last profile failed: ' + escapeText(w.last.error);
+        return label + `<a href="/api/worker/profile/${w.shard}/download">${escapeText(w.last.file)}</a>`;
+    }).join(' · ');
+    document.getElementById('btn-profile').disabled = running;
+
+    // Cumulative handler times since each worker started, summed over workers
+    const merged = {};
+    workers.filter(w => w.online).forEach(w => w.handlers.forEach(h => {
+        const m = merged[h.name] || (merged[h.name] = {name: h.name, calls: 0, errors: 0, total_s: 0, max_ms: 0});
+        m.calls += h.calls;
+        m.errors += h.errors;
+        m.total_s += h.total_s;
+        m.max_ms = Math.max(m.max_ms, h.max_ms);
+    }));
+    const rows = Object.values(merged).sort((a, b) => b.total_s - a.total_s).slice(0, 10);
+    document.getElementById('handler-stats').innerHTML = rows.length ? `
+        <table style="width:100%; border-collapse:collapse;">
+            <tr style="color:var(--text-secondary); text-align:left;">
+                <th>Handler</th><th>Calls</th><th>Errors</th><th>Total</th><th>Avg</th><th>Max</th>
+            </tr>
+            ${rows.map(r => `<tr>
+                <td>${escapeText(r.name)}</td><td>${r.calls}</td><td>${r.errors}</td><td>${r.total_s.toFixed(1)}s</td>
+                <td>${(r.total_s * 1000 / r.calls).toFixed(1)}ms</td><td>${r.max_ms}ms</td>
+            </tr>`).join('')}
+        </table>` : '';
+
+    clearTimeout(profileTimer);
+    if (running) profileTimer = setTimeout(loadProfileStatus, 2000);
+}
+
+async function startProfile() {
+    const seconds = Number(document.getElementById('profile-seconds').value);
+    const mode = document.getElementById('profile-mode').value;
+    try {
+        const res = await fetch('/api/worker/profile', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({seconds, mode})
+        });
+        const data = await res.json();
+        if (!data.success) {
+            Modal.alert("Error: " + data.error);
+            return;
+        }
+        if (data.failed.length) Modal.alert("Some workers did not start: " + data.failed.join('; '));
+        loadProfileStatus();
+    } catch (e) {
+        Modal.alert("Request failed: " + e);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', loadProfileStatus);
+
+// --- Live Events ---
+// One Server-Sent Events stream replaces the polling loops; EventSource reconnects on its own.
+function connectEvents() {
+    const source = new EventSource('/api/events');
+    const on = (name, handler) => source.addEventListener(name, e => handler(JSON.parse(e.data)));
+
+    on('status', applyStatus);
+    on('system', updateSystemGraph);
+    on('stats', data => { document.getElementById('group-count').innerText = data.groups; });
+    on('logs', data => {
+        if (!isTabActive('logs')) return;  // Caught up through the cursor on the next tab switch
+        if (logCursor !== data.from) return fetchLogs();
+        const container = document.getElementById('log-container');
+        const atBottom = container.scrollTop + container.clientHeight >= container.scrollHeight - 20;
+        if (data.truncated) logLines.push('… (skipped older lines)\n');
+        logLines = logLines.concat(data.logs.map(formatLogLine)).slice(-MAX_LOG_LINES);
+        logCursor = data.cursor;
+        container.innerText = logLines.join('');
+        if (atBottom) container.scrollTop = container.scrollHeight;
+    });
+    on('worker', renderWorkerMetrics);
+    on('memory', () => {
+        if (isTabActive('memory') && document.getElementById('memory-viewer').style.display !== 'none') {
+            loadMemoryList();
+        }
+    });
+    on('resync', () => {
+        checkStatus();
+        if (isTabActive('logs')) fetchLogs();
+    });
+}
+
+document.addEventListener('DOMContentLoaded', connectEvents);
+
 async function clearLogs() {
     Modal.confirm('Clear all logs? This cannot be undone.', async (confirmed) => {
         if (!confirmed) return;
@@ -814,7 +1056,7 @@ async function clearLogs() {
             const res = await fetch('/api/logs/clear', {method: 'POST'});
             const data = await res.json();
             if (data.success) {
-                fetchLogs();
+                fetchLogs(true);
                 Modal.alert('Logs cleared.');
             } else {
                 Modal.alert('Error: ' + data.error);
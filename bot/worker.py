@@ -1,14 +1,42 @@
 import logging
+import os
+import signal
+import sys
 import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from core.log_setup import setup_logging, log_context
+from config import WORKER_COUNT, WORKER_SHARD
+
+# Before the module imports below, so their startup messages are captured
+setup_logging("worker" if WORKER_COUNT == 1 else f"worker-{WORKER_SHARD}")
+
 from core.bot_instance import bot
-from config import BOT_TOKEN, OWNER_ID
-from core.ai_response import process_ai_response
+from telebot import types
+from config import BOT_TOKEN, OWNER_ID, POLLING_TIMEOUT, WORKER_DRAIN_TIMEOUT, SUPERVISOR_INGEST, WORKER_ENGINE
+from core.ai_response import process_ai_response, process_ai_response_async
+from core.async_engine import engine, native
+from core.scheduler import scheduler
+from core.broadcast import resume_broadcasts
 from modules.fortune import fortune
-from modules.moderations import register_moderation_handlers, auto_moderate
+from modules.moderations import register_moderation_handlers, auto_moderate, auto_moderate_media
 from modules.fun import register_fun_handlers
 from modules.owner import register_owner_commands, fetch_existing_groups
 from modules.notes import register_notes_handlers
 import modules.image_gen as image_gen
+import core.memory as memory
+import core.ai_response as ai_response
+import core.modlog as modlog
+import modules.notes as notes
+import modules.moderations as moderations
+import modules.fun as fun
+from core.dispatcher import dispatcher
+from core.broadcast import active_job, stop_runner as stop_broadcasts
+from core.ipc import ipc_server, IPCError
+from core.profiler import profiler, handler_stats
+
+STARTED = time.time()
 
 # --- Basic Commands ---
 @bot.message_handler(commands=['start'])
@@ -59,7 +87,7 @@ def help_message(message):
         "<b>📜 Notes Commands:</b>\n"
         "/save &lt;title&gt; &lt;content&gt; - Save a note 💾\n"
         "/delnote &lt;title&gt; - Delete a note ❌\n"
-        "/notes - List all notes 📜\n"
+        "/notes [query] - List or search notes 📜\n"
         "/toggle_notes - Enable/Disable notes in the group 📝\n\n"
         "<b>🛠 Contribute:</b>\n"
         "/contribute - Contribute to my sass!!\n"
@@ -69,8 +97,13 @@ def help_message(message):
             "\n<b>👑 Owner Commands:</b>\n"
             "/dashboard - Get the URL for the Admin Dashboard 🖥️\n"
             "/broadcast &lt;message&gt; - Send a message to all groups\n"
+            "/broadcaststatus - Progress of the last broadcast\n"
+            "/prunegroups - Drop dead groups found by broadcasts\n"
+            "/exportall - Back up every chat's notes 📦\n"
+            "/importall - Restore notes from a backup\n"
             "/restart - Restart the bot\n"
             "/logs - Fetch the last 10 logs\n"
+            "/profile [sec] [sample|cprofile] - Profile the worker 🔬\n"
         )
     bot.reply_to(message, help_text, parse_mode="HTML")
 
@@ -87,8 +120,15 @@ bot.register_message_handler(fortune, commands=['fortune'])
 def handle_imagine(message):
     image_gen.imagine(bot, message)
 
+@native(handle_imagine)
+async def handle_imagine_async(message):
+    await image_gen.imagine_async(message)
+
 @bot.message_handler(content_types=['sticker'])
 def handle_sticker(message):
+    if auto_moderate_media(message):
+        return
+
     # Only reply if in a group and either:
     if message.chat.type in ["group", "supergroup"]:
         # If this sticker is a reply to a message
@@ -101,6 +141,9 @@ def handle_sticker(message):
 
 @bot.message_handler(content_types=['animation'])
 def handle_gif(message):
+    if auto_moderate_media(message):
+        return
+
     if message.chat.type in ["group", "supergroup"]:
         if message.reply_to_message:
             if message.reply_to_message.from_user and message.reply_to_message.from_user.id == bot.get_me().id:
@@ -108,6 +151,11 @@ def handle_gif(message):
     elif message.chat.type == "private":
         bot.reply_to(message, "A GIF? Classic move. Still not as funny as my comebacks!")
 
+@bot.message_handler(content_types=['photo', 'video'])
+def handle_media(message):
+    # Photos and videos only need flood control
+    auto_moderate_media(message)
+
 # --- Fallback & Auto-Moderation ---
 # This handler catches all text messages to perform moderation AND AI response.
 @bot.message_handler(func=lambda message: message.text is not None)
@@ -119,8 +167,235 @@ def handle_text(message):
     # 2. If message survived moderation, process for AI response
     process_ai_response(message)
 
+@native(handle_text)
+async def handle_text_async(message):
+    # Moderation reads SQLite and calls the Bot API, so it runs on the engine's IO pool
+    if await engine.run_blocking(auto_moderate, message):
+        return
+
+    await process_ai_response_async(message)
+
+# --- Handler Instrumentation ---
+_in_flight = 0
+_in_flight_cond = threading.Condition()
+
+@contextmanager
+def _handling(update, name):
+    """
+    Wraps every handler run: tags log records with the chat and user it serves, counts
+    running handlers so a drain can wait for them and adds its time to handler_stats.
+    """
+    global _in_flight
+    message = getattr(update, "message", None) or update  # callback queries carry the message
+    chat = getattr(message, "chat", None)
+    user = getattr(update, "from_user", None)
+    with _in_flight_cond:
+        _in_flight += 1
+    started = time.perf_counter()
+    failed = False
+    try:
+        with log_context(chat_id=chat.id if chat else None, user_id=user.id if user else None):
+            yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        handler_stats.record(name, time.perf_counter() - started, failed)
+        with _in_flight_cond:
+            _in_flight -= 1
+            _in_flight_cond.notify_all()
+
+def _instrument(func):
+    @wraps(func)
+    def wrapper(update, *args, **kwargs):
+        with _handling(update, func.__name__):
+            return profiler.call(func, update, *args, **kwargs)
+    return wrapper
+
+for handlers in (bot.message_handlers, bot.callback_query_handlers):
+    for handler in handlers:
+        handler['function'] = _instrument(handler['function'])
+
+def _wait_for_handlers(deadline):
+    """Waits until no handler runs, no update is queued and no send is waiting (twice in a row, to cover hand-off gaps)."""
+    quiet = 0
+    while quiet < 2 and time.monotonic() < deadline:
+        with _in_flight_cond:
+            _in_flight_cond.wait_for(lambda: _in_flight == 0, timeout=max(0, deadline - time.monotonic()))
+            idle = _in_flight == 0
+        quiet = quiet + 1 if idle and bot.worker_pool.tasks.empty() and engine.idle() and dispatcher.idle() else 0
+        time.sleep(0.2)
+    return quiet >= 2
+
+# --- Supervisor Commands (IPC) ---
+RELOADERS = {
+    "notes": notes.reload_notes,
+    "prompt": ai_response.reload_prompt,
+    "badwords": moderations.reload_badwords,
+    "fun": fun.reload_fun_content,
+}
+
+# --- Handoff (blue/green restarts) ---
+# A worker started with WORKER_STANDBY=1 loads everything and waits. The supervisor then
+# drains the old worker (stop polling, finish handlers, scheduler and broadcast, flush)
+# and activates the new one at the old worker's next update offset.
+state = "standby" if os.environ.get("WORKER_STANDBY") == "1" else "active"
+_activated = threading.Event()
+_polling_stopped = threading.Event()   # no more updates will be taken (polling ended or intake closed)
+_start_offset = None
+ingest_mode = None
+_ingest_lock = threading.Lock()
+
+@ipc_server.command("ping")
+def ipc_ping():
+    return {"state": state, "pid": os.getpid()}
+
+@ipc_server.command("activate")
+def ipc_activate(offset=None):
+    global state, _start_offset
+    if state != "standby":
+        raise ValueError(f"worker is {state}")
+    _start_offset = offset
+    state = "active"
+    _activated.set()
+    return True
+
+@ipc_server.command("drain")
+def ipc_drain(timeout=WORKER_DRAIN_TIMEOUT):
+    """Stops taking updates and finishes all work. Returns the update offset the next worker starts at."""
+    global state
+    if state != "active":
+        raise ValueError(f"worker is {state}")
+    state = "draining"
+    deadline = time.monotonic() + timeout
+    if ingest_mode == "forwarded":
+        with _ingest_lock:  # Let a batch being handed over finish; later ones are refused
+            _polling_stopped.set()
+    else:
+        bot.stop_polling()
+    _polling_stopped.wait(timeout=max(0, deadline - time.monotonic()))
+    clean = _polling_stopped.is_set() and _wait_for_handlers(deadline)
+    scheduler.stop()
+    stop_broadcasts()
+    flushed = ipc_flush()
+    state = "drained"
+    logging.info(f"Worker drained (clean: {clean}), next update offset {bot.last_update_id + 1}")
+    return {"offset": bot.last_update_id + 1, "clean": clean, **flushed}
+
+@ipc_server.command("metrics")
+def ipc_metrics():
+    return {
+        "pid": os.getpid(),
+        "shard": WORKER_SHARD,
+        "state": state,
+        "ingest": ingest_mode,
+        "uptime": round(time.time() - STARTED, 1),
+        "threads": threading.active_count(),
+        "engine": engine.snapshot(),
+        "memory": memory.chat_memory.stats(),
+        "llm": dict(ai_response.llm_stats),
+        "outbound": dispatcher.snapshot(),
+        "scheduled": scheduler.pending(),
+        "broadcast": active_job(),
+    }
+
+@ipc_server.command("updates")
+def ipc_updates(updates):
+    """Updates forwarded by the supervisor (webhook mode or several workers). Redelivered ones are skipped."""
+    with _ingest_lock:
+        if state != "active" or _polling_stopped.is_set():
+            raise IPCError(f"worker is {state}")
+        fresh = []
+        for data in updates:
+            if data.get("update_id", 0) <= bot.last_update_id:
+                continue
+            try:
+                fresh.append(types.Update.de_json(data))
+            except Exception as e:
+                logging.error(f"Skipping malformed update {data.get('update_id')}: {e}")
+        bot.process_new_updates(fresh)
+    return len(fresh)
+
+@ipc_server.command("profile")
+def ipc_profile(seconds=30, mode="sample"):
+    """Starts a profiling session; the result is written under STATE_DIR/profiles."""
+    try:
+        return profiler.start(seconds, mode)
+    except ValueError as e:
+        raise IPCError(str(e))
+
+@ipc_server.command("profile_status")
+def ipc_profile_status():
+    return {"shard": WORKER_SHARD, **profiler.status(), **handler_stats.snapshot()}
+
+@ipc_server.command("flush")
+def ipc_flush():
+    """Writes everything held in memory: chat memory, pending notes, moderation events."""
+    saved = memory.chat_memory.commit()
+    notes.flush_notes()
+    modlog.flush()
+    return {"memory_saved": saved}
+
+@ipc_server.command("invalidate_memory")
+def ipc_invalidate_memory(key):
+    memory.chat_memory.invalidate(key)
+    return True
+
+@ipc_server.command("reload")
+def ipc_reload(target="all", chat_ids=None):
+    targets = list(RELOADERS) if target == "all" else [target]
+    for name in targets:
+        if name not in RELOADERS:
+            raise ValueError(f"unknown reload target {name!r}")
+        if name == "notes":
+            RELOADERS[name](chat_ids)
+        else:
+            RELOADERS[name]()
+    return targets
+
+def _terminate(signum, frame):
+    """SIGTERM (the supervisor stopping us): write what is held in memory, then exit."""
+    logging.info("Worker stopping, flushing...")
+    try:
+        ipc_flush()
+    except Exception as e:
+        logging.error(f"Flush on shutdown failed: {e}")
+    sys.exit(0)
+
 # --- Start Everything ---
-if __name__ == "__main__":
+def start_services():
     fetch_existing_groups()
-    logging.info("Worker Process Started...")
-    bot.infinity_polling()
+    scheduler.start()
+    resume_broadcasts()
+
+def start_ingestion():
+    """Polls for updates unless the supervisor receives them and forwards them here."""
+    global ingest_mode
+    if SUPERVISOR_INGEST:
+        ingest_mode = "forwarded"
+    else:
+        bot.remove_webhook()  # getUpdates is refused while a webhook is registered
+        ingest_mode = "polling"
+    return ingest_mode
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _terminate)
+    ipc_server.start()
+    if state == "standby":
+        bot.get_me()  # Fail here, before the handoff, if the token or network is broken
+        logging.info("Worker warmed up, waiting for handoff...")
+        _activated.wait()
+        if _start_offset:
+            bot.last_update_id = _start_offset - 1
+    start_services()
+    if WORKER_ENGINE == "asyncio":
+        engine.start(bot, _handling)
+    if start_ingestion() == "forwarded":
+        logging.info("Worker Process Started, receiving updates from the supervisor...")
+        _polling_stopped.wait()
+    else:
+        logging.info("Worker Process Started...")
+        bot.infinity_polling(long_polling_timeout=POLLING_TIMEOUT)
+        _polling_stopped.set()
+    # Drained: stay alive (IPC still answers) until the supervisor stops us
+    threading.Event().wait()
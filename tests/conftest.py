@@ -0,0 +1,18 @@
+"""
+Runs the bot's modules in-process against a throwaway STATE_DIR, with the repo's .env
+ignored so the config comes only from here.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix="zuzu-test-")
+os.environ["ENV_FILE"] = os.devnull
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ["STATE_DIR"] = STATE_DIR
+os.environ["LOG_FILE"] = os.path.join(STATE_DIR, "bot.log")
+sys.path.insert(0, os.path.join(ROOT_DIR, "bot"))
@@ -0,0 +1,83 @@
+import threading
+import time
+import pytest
+from telebot.apihelper import ApiTelegramException
+import core.broadcast as broadcast
+
+def telegram_error(code, description, **parameters):
+    return ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": code, "description": description, "parameters": parameters
+    })
+
+@pytest.mark.parametrize("error, expected", [
+    (telegram_error(429, "Too Many Requests: retry after 7", retry_after=7), ("retry", 7)),
+    (telegram_error(400, "Bad Request: group chat was upgraded", migrate_to_chat_id=-1002), ("migrated", "-1002")),
+    (telegram_error(403, "Forbidden: bot was kicked from the group chat"), ("dead", None)),
+    (telegram_error(400, "Bad Request: chat not found"), ("dead", None)),
+    (telegram_error(502, "Bad Gateway"), ("retry", 1)),
+    (ConnectionError("reset by peer"), ("retry", 1)),
+    (telegram_error(400, "Bad Request: message is too long"), ("failed", None)),
+])
+def test_classify_error(error, expected):
+    assert broadcast._classify_error(error) == expected
+
+@pytest.fixture
+def groups(tmp_path, monkeypatch):
+    path = tmp_path / "groups.txt"
+    monkeypatch.setattr(broadcast, "GROUPS_FILE", str(path))
+    broadcast.init_db()
+    with broadcast.DB_LOCK:
+        for table in ("broadcast_jobs", "broadcast_targets", "group_joins"):
+            broadcast.DB_CONN.execute(f"DELETE FROM {table}")
+        broadcast.DB_CONN.commit()
+    return path
+
+def job(created, outcomes):
+    """Records a finished broadcast job with {chat_id: status or ("migrated", new id)}."""
+    job_id = broadcast._execute(
+        "INSERT INTO broadcast_jobs (text, status, created) VALUES ('x', 'done', ?)", (created,)
+    )
+    for chat_id, outcome in outcomes.items():
+        status, new_chat_id = outcome if isinstance(outcome, tuple) else (outcome, None)
+        broadcast._execute(
+            "INSERT INTO broadcast_targets (job_id, chat_id, status, new_chat_id) VALUES (?, ?, ?, ?)",
+            (job_id, chat_id, status, new_chat_id)
+        )
+
+def test_prune_uses_each_groups_latest_outcome(groups):
+    groups.write_text("-1\n-2\n-3\n-4\n")
+    job(100, {"-1": "dead", "-2": "sent", "-3": "sent", "-4": ("migrated", "-40")})
+    job(200, {"-1": "sent", "-2": "dead"})
+    assert broadcast.prune_dead_groups() == (1, 1)
+    assert broadcast.load_group_ids() == ["-1", "-3", "-40"]
+
+def test_prune_keeps_a_dead_group_that_has_the_bot_back(groups):
+    job(time.time() - 60, {"-1": "dead", "-2": "dead"})
+    broadcast.add_group_id("-1")     # bot re-added after the job
+    groups.write_text("-1\n-2\n")
+    assert broadcast.prune_dead_groups() == (1, 0)
+    assert broadcast.load_group_ids() == ["-1"]
+
+def test_add_group_id_once(groups):
+    assert broadcast.add_group_id(-5) is True
+    assert broadcast.add_group_id("-5") is False
+    assert groups.read_text() == "-5\n"
+
+def test_appends_during_a_prune_are_not_lost(groups):
+    job(time.time() + 60, {str(-i): "dead" for i in range(1, 51)})
+    groups.write_text("".join(f"{-i}\n" for i in range(1, 51)))
+    added = [str(-1000 - i) for i in range(200)]
+
+    def add(ids):
+        for chat_id in ids:
+            broadcast.add_group_id(chat_id)
+
+    threads = [threading.Thread(target=add, args=(added[i::4],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20):
+        broadcast.prune_dead_groups()
+    for thread in threads:
+        thread.join()
+    broadcast.prune_dead_groups()
+    assert sorted(broadcast.load_group_ids()) == sorted(added)
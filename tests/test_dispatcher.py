@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+import pytest
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from core.dispatcher import OutboundDispatcher, _Send, send_later
+
+API = "https://api.telegram.org/bot123456:TEST/"
+
+class StubAPI:
+    """Records each call that reaches 'Telegram'; answers from `replies` (status, body) first."""
+    def __init__(self, replies=(), delay=0):
+        self.calls = []
+        self.replies = list(replies)
+        self.delay = delay
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        self.gate.wait()
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append((url.rsplit("/", 1)[-1], dict(params or {})))
+            status, body = self.replies.pop(0) if self.replies else (200, {"ok": True, "result": {"message_id": len(self.calls)}})
+        response = apihelper.requests.models.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        return response
+
+def make(stub, **kwargs):
+    options = dict(global_rate=1000, chat_rate=1000, group_rate=1000, burst=1000, senders=4)
+    options.update(kwargs)
+    return OutboundDispatcher(sender=stub, **options)
+
+def send(dispatcher, chat_id, text):
+    return dispatcher.request("post", API + "sendMessage", params={"chat_id": chat_id, "text": text})
+
+def wait_idle(dispatcher, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not dispatcher.idle():
+        assert time.monotonic() < deadline, "dispatcher never drained"
+        time.sleep(0.01)
+
+def test_caller_gets_telegrams_answer():
+    stub = StubAPI()
+    response = send(make(stub), 5, "hi")
+    assert response.json()["result"]["message_id"] == 1
+    assert stub.calls == [("sendMessage", {"chat_id": 5, "text": "hi"})]
+
+def test_reads_skip_the_queues():
+    stub = StubAPI()
+    dispatcher = make(stub, senders=0)     # nothing would drain a queued call
+    dispatcher.request("get", API + "getMe")
+    assert stub.calls == [("getMe", {})]
+
+def test_chat_keeps_order():
+    stub = StubAPI(delay=0.01)
+    dispatcher = make(stub)
+    with send_later():
+        for i in range(10):
+            send(dispatcher, 5, str(i))
+    wait_idle(dispatcher)
+    assert [params["text"] for _, params in stub.calls] == [str(i) for i in range(10)]
+
+def test_lanes_take_turns():
+    dispatcher = make(StubAPI(), senders=0)
+    for chat_id, count in (("1", 3), ("2", 1), ("3", 2)):
+        lane = dispatcher._lane(chat_id)
+        for _ in range(count):
+            lane.sends.append(_Send("post", API + "sendMessage", {}, False))
+        dispatcher.backlog[chat_id] = lane
+
+    order = []
+    with dispatcher.cond:
+        while True:
+            send_, lane, _ = dispatcher._next_send()
+            if send_ is None:
+                break
+            order.append(lane.chat_id)
+            lane.busy = False
+    assert order == ["1", "2", "3", "1", "3", "1"]
+
+def test_replies_go_before_background_traffic():
+    dispatcher = make(StubAPI(), senders=0)
+    for chat_id, background in (("1", True), ("2", False)):
+        lane = dispatcher._lane(chat_id)
+        lane.sends.append(_Send("post", API + "sendMessage", {}, background))
+        dispatcher.backlog[chat_id] = lane
+    with dispatcher.cond:
+        first = dispatcher._next_send()[1].chat_id
+    assert first == "2"
+
+def test_429_is_retried_after_retry_after():
+    stub = StubAPI(replies=[(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                   "parameters": {"retry_after": 0.2}})])
+    dispatcher = make(stub)
+    started = time.monotonic()
+    response = send(dispatcher, 5, "hi")
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.2
+    assert len(stub.calls) == 2
+    assert dispatcher.stats["retried"] == 1
+
+def test_429_gives_up_after_max_retries():
+    too_many = (429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                      "parameters": {"retry_after": 0}})
+    stub = StubAPI(replies=[too_many] * 10)
+    response = send(make(stub), 5, "hi")
+    assert response.status_code == 429
+    assert len(stub.calls) == 4     # the call plus MAX_RETRIES
+
+def test_full_chat_queue_fails_like_telegram():
+    stub = StubAPI()
+    stub.gate.clear()                       # hold the first send on the wire
+    dispatcher = make(stub, chat_queue=1)
+    first = threading.Thread(target=send, args=(dispatcher, 5, "first"))
+    first.start()
+    while not dispatcher.in_flight:
+        time.sleep(0.01)
+    with send_later():
+        assert send(dispatcher, 5, "queued").json()["result"]["message_id"] == 0
+    refused = send(dispatcher, 5, "refused")
+    with pytest.raises(ApiTelegramException) as error:
+        apihelper._check_result("sendMessage", refused)
+    assert error.value.error_code == 429
+    assert error.value.result_json["parameters"]["retry_after"] >= 1
+    stub.gate.set()
+    first.join()
+    wait_idle(dispatcher)
+    assert [params["text"] for _, params in stub.calls] == ["first", "queued"]
+
+def test_send_that_waits_too_long_is_withdrawn():
+    stub = StubAPI()
+    dispatcher = make(stub, chat_rate=0.01, burst=1, send_timeout=0.2)
+    send(dispatcher, 5, "uses the token")
+    response = send(dispatcher, 5, "never sent")
+    assert response.status_code == 429
+    assert dispatcher.idle()
+    assert [params["text"] for _, params in stub.calls] == ["uses the token"]
+
+def test_send_later_only_detaches_for_a_backlogged_chat():
+    stub = StubAPI()
+    dispatcher = make(stub, chat_rate=0.01, burst=1)
+    with send_later():
+        assert send(dispatcher, 5, "now").json()["result"]["message_id"] == 1
+        assert send(dispatcher, 5, "later").json()["result"]["message_id"] == 0
+    assert dispatcher.stats["queued"] == 1
+
+def test_repeated_chat_action_is_answered_locally():
+    stub = StubAPI()
+    dispatcher = make(stub)
+    for _ in range(3):
+        dispatcher.request("post", API + "sendChatAction", params={"chat_id": 5, "action": "typing"})
+    assert len(stub.calls) == 1
+    assert dispatcher.stats["collapsed"] == 2
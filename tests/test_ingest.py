@@ -0,0 +1,40 @@
+from collections import Counter
+from core.ingest import HashRing, UpdateForwarder, _Lane, update_chat_id
+
+def test_update_chat_id():
+    assert update_chat_id({"update_id": 1, "message": {"chat": {"id": -100}, "from": {"id": 5}}}) == -100
+    assert update_chat_id({"update_id": 1, "edited_message": {"chat": {"id": -7}}}) == -7
+    assert update_chat_id({"update_id": 1, "my_chat_member": {"chat": {"id": -8}, "from": {"id": 5}}}) == -8
+    assert update_chat_id({"update_id": 1, "callback_query": {"from": {"id": 5}, "message": {"chat": {"id": -9}}}}) == -9
+    # Chat-less updates go by sender, so one user's inline queries stay in order
+    assert update_chat_id({"update_id": 1, "inline_query": {"from": {"id": 5}, "query": "x"}}) == 5
+    assert update_chat_id({"update_id": 1, "poll_answer": {"user": {"id": 6}}}) == 6
+    assert update_chat_id({"update_id": 42, "poll": {"id": "p"}}) == 42
+
+def test_ring_is_stable():
+    first, second, single = HashRing(4), HashRing(4), HashRing(1)
+    assert all(first.node_for(chat) == second.node_for(chat) for chat in range(-500, 500))
+    assert {single.node_for(chat) for chat in range(-500, 500)} == {0}
+
+def test_ring_spreads_chats():
+    counts = Counter(HashRing(4).node_for(chat) for chat in range(-100000, -90000))
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > 10000 / 4 * 0.6
+
+def test_adding_a_worker_only_moves_chats_to_it():
+    before, after = HashRing(3), HashRing(4)
+    chats = range(-100000, -90000)
+    moved = [chat for chat in chats if before.node_for(chat) != after.node_for(chat)]
+    assert {after.node_for(chat) for chat in moved} == {3}
+    assert len(moved) < len(chats) * 0.4
+
+def test_forwarder_keeps_a_chat_on_one_worker():
+    forwarder = UpdateForwarder(size=2)
+    forwarder.ring = HashRing(3)
+    forwarder.lanes = [_Lane(shard, forwarder.size) for shard in range(3)]
+    update = {"update_id": 1, "message": {"chat": {"id": -100}}}
+    shard = forwarder.ring.node_for(-100)
+    assert forwarder.submit(update) and forwarder.submit(update)
+    assert forwarder.lanes[shard].buffer.qsize() == 2
+    assert forwarder.submit(update) is False    # full: the webhook answers 503
+    assert forwarder.lanes[shard].stats == {"received": 2, "forwarded": 0, "rejected": 1, "retries": 0}
@@ -0,0 +1,78 @@
+import os
+import pytest
+from core.logfile import tail_lines, read_since, clear_logs
+
+@pytest.fixture
+def log(tmp_path):
+    return str(tmp_path / "bot.log")
+
+def append(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+def rotate(path):
+    if os.path.exists(path + ".1"):
+        os.replace(path + ".1", path + ".2")
+    os.replace(path, path + ".1")
+    open(path, "w").close()
+
+def test_tail_then_only_new_lines(log):
+    append(log, "".join(f"line {i}\n" for i in range(10)))
+    lines, cursor = tail_lines(log, count=3)
+    assert lines == ["line 7\n", "line 8\n", "line 9\n"]
+    append(log, "line 10\n")
+    lines, cursor, truncated = read_since(log, cursor)
+    assert lines == ["line 10\n"] and not truncated
+    assert read_since(log, cursor)[0] == []
+
+def test_a_line_still_being_written_waits(log):
+    append(log, "done\n")
+    _, cursor = tail_lines(log)
+    append(log, "half")
+    lines, cursor, _ = read_since(log, cursor)
+    assert lines == []
+    append(log, " a line\n")
+    assert read_since(log, cursor)[0] == ["half a line\n"]
+
+def test_cursor_follows_a_rotation(log):
+    append(log, "old 1\n")
+    _, cursor = tail_lines(log)
+    append(log, "old 2\n")
+    rotate(log)
+    append(log, "new 1\n")
+    lines, cursor, truncated = read_since(log, cursor)
+    assert lines == ["old 2\n", "new 1\n"] and not truncated
+    append(log, "new 2\n")
+    assert read_since(log, cursor)[0] == ["new 2\n"]
+
+def test_two_rotations_are_reported_as_a_gap(log):
+    append(log, "old\n")
+    _, cursor = tail_lines(log)
+    rotate(log)
+    append(log, "middle\n")
+    rotate(log)
+    append(log, "new\n")
+    lines, _, truncated = read_since(log, cursor)
+    assert lines == ["new\n"] and truncated
+
+def test_a_long_backlog_is_skipped_at_a_line_boundary(log):
+    append(log, "start\n")
+    _, cursor = tail_lines(log)
+    append(log, "".join(f"line {i:04}\n" for i in range(1000)))
+    lines, cursor, truncated = read_since(log, cursor, limit=100)
+    assert truncated
+    assert lines[-1] == "line 0999\n"
+    assert all(line.startswith("line ") and line.endswith("\n") for line in lines)
+    assert len("".join(lines)) <= 100
+
+def test_cleared_log_starts_over(log):
+    append(log, "before clear\n")
+    _, cursor = tail_lines(log)
+    clear_logs(log)
+    append(log, "after\n")
+    assert read_since(log, cursor)[0] == ["after\n"]
+
+def test_bad_cursor_falls_back_to_the_tail(log):
+    append(log, "a\nb\n")
+    lines, cursor, truncated = read_since(log, "garbage")
+    assert lines == ["a\n", "b\n"] and not truncated
@@ -0,0 +1,114 @@
+import itertools
+import json
+import time
+import pytest
+import modules.notes as notes
+from core.helper import atomic_write
+
+_chat_ids = itertools.count(-1001)
+
+@pytest.fixture
+def chat_id():
+    return str(next(_chat_ids))
+
+class Writes(list):
+    """Every atomic_write of a notes file, as (chat id, data). The next `fail` writes raise."""
+    fail = 0
+
+    def of(self, chat_id):
+        return [value for chat, value in self if chat == chat_id]
+
+@pytest.fixture
+def writes(monkeypatch):
+    log = Writes()
+
+    def write(path, data):
+        if log.fail:
+            log.fail -= 1
+            raise OSError("disk full")
+        atomic_write(path, data)
+        log.append((path.rsplit("/", 1)[-1][:-len(".json")], json.loads(data)))
+
+    monkeypatch.setattr(notes, "atomic_write", write)
+    monkeypatch.setattr(notes, "NOTES_WRITE_DELAY", 0.05)
+    return log
+
+def data(*names):
+    return {"notes": {name: {"type": "text", "content": name} for name in names}, "pinned": None, "enabled": True}
+
+def save(chat_id, value):
+    with notes.notes_lock(chat_id):
+        notes.save_notes_to_file(chat_id, value)
+
+def wait_written(chat_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while chat_id in notes._pending_writes:
+        assert time.monotonic() < deadline, "queued notes never written"
+        time.sleep(0.01)
+
+def on_disk(chat_id):
+    with open(notes.get_notes_file(chat_id)) as f:
+        return json.load(f)
+
+def test_saves_within_the_delay_share_one_write(chat_id, writes):
+    for i in range(5):
+        save(chat_id, data(*[f"n{j}" for j in range(i + 1)]))
+    wait_written(chat_id)
+    assert writes.of(chat_id) == [data("n0", "n1", "n2", "n3", "n4")]
+
+def test_queued_notes_are_read_back_before_the_write(chat_id, writes):
+    save(chat_id, data("queued"))
+    assert notes.load_notes(chat_id) == data("queued")
+    assert notes.get_note_index(chat_id).names == {"queued"}
+    assert writes.of(chat_id) == []
+
+def test_later_changes_to_the_callers_dict_are_not_saved(chat_id, writes):
+    value = data("kept")
+    save(chat_id, value)
+    value["notes"]["leaked"] = {"type": "text", "content": "x"}
+    notes.flush_notes(chat_id)
+    assert on_disk(chat_id) == data("kept")
+
+def test_failed_write_stays_queued_and_is_retried(chat_id, writes):
+    writes.fail = 2
+    save(chat_id, data("survives"))
+    notes.flush_notes(chat_id)
+    assert chat_id in notes._pending_writes
+    assert notes.load_notes(chat_id) == data("survives")
+    wait_written(chat_id)
+    assert on_disk(chat_id) == data("survives")
+
+def test_save_during_a_write_is_written_after_it(chat_id, writes, monkeypatch):
+    first_write = notes.atomic_write
+
+    def write_then_save(path, value):
+        monkeypatch.setattr(notes, "atomic_write", first_write)
+        notes.save_notes_to_file(chat_id, data("newer"))   # a save racing the write
+        first_write(path, value)
+
+    save(chat_id, data("older"))
+    monkeypatch.setattr(notes, "atomic_write", write_then_save)
+    notes.flush_notes(chat_id)
+    wait_written(chat_id)
+    assert on_disk(chat_id) == data("newer")
+    assert writes.of(chat_id) == [data("older"), data("newer")]
+
+def test_reload_drops_queued_writes(chat_id, writes):
+    save(chat_id, data("on disk"))
+    notes.flush_notes(chat_id)
+    save(chat_id, data("stale edit"))
+    notes.reload_notes([chat_id])
+    time.sleep(notes.NOTES_WRITE_DELAY * 3)
+    assert on_disk(chat_id) == data("on disk")
+    assert notes.get_note_index(chat_id).names == {"on disk"}
+
+def test_index_prefix_search_is_sorted():
+    index = notes.NoteIndex(True, ["rules", "rule2", "faq", "rulebook", "links", "mods", "about"])
+    assert index.prefix("rule") == ["rule2", "rulebook", "rules"]
+    assert index.prefix("zzz") == []
+
+def test_index_search_adds_fuzzy_matches_when_few_prefix_hits():
+    index = notes.NoteIndex(True, ["welcome", "rules", "faq"])
+    assert index.search("welcom") == ["welcome"]
+    assert index.search("wlecome") == ["welcome"]
+    assert index.search("xyz") == []
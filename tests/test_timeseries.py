@@ -0,0 +1,50 @@
+from core.timeseries import RingBuffer, TimeSeries
+
+def test_ring_buffer_keeps_the_newest_points_in_order():
+    ring = RingBuffer(3, fields=("cpu",))
+    for ts in range(5):
+        ring.append(ts, {"cpu": ts * 10})
+    assert ring.oldest() == 2
+    assert list(ring.points()) == [(2, {"cpu": 20}), (3, {"cpu": 30}), (4, {"cpu": 40})]
+    assert list(ring.points(since=3, until=3)) == [(3, {"cpu": 30})]
+
+def test_missing_readings_come_back_as_none():
+    ring = RingBuffer(2, fields=("cpu", "fds"))
+    ring.append(1, {"cpu": 5.0})
+    assert list(ring.points()) == [(1, {"cpu": 5.0, "fds": None})]
+
+def test_query_averages_down_to_the_requested_points():
+    series = TimeSeries()
+    for i in range(100):
+        series.add(1000 + i, {"cpu": i, "cpu_max": i})
+    result = series.query(1000, 1099.999, points=10)
+    assert result["resolution"] == 1
+    assert len(result["points"]) == 10
+    first_ts, first = result["points"][0]
+    assert first_ts == 1000
+    assert first["cpu"] == sum(range(10)) / 10
+    assert first["cpu_max"] == 9     # peaks keep the max, not the mean
+    assert first["rss"] is None
+
+def test_query_falls_back_to_a_coarser_level_for_older_data():
+    series = TimeSeries(resolutions=((1, 10), (5, 100)))
+    for ts in range(60):
+        series.add(ts, {"cpu": 1.0, "rss_max": ts})
+    fine = series.query(55, 59)
+    assert fine["resolution"] == 1 and [ts for ts, _ in fine["points"]] == [55, 56, 57, 58, 59]
+
+    coarse = series.query(0, 59, points=500)
+    assert coarse["resolution"] == 5
+    # Eleven closed 5s buckets plus the one still being filled
+    assert [ts for ts, _ in coarse["points"]] == list(range(0, 60, 5))
+    assert coarse["points"][-1][1]["rss_max"] == 59
+    assert all(values["cpu"] == 1.0 for _, values in coarse["points"])
+
+def test_closed_buckets_roll_up_to_the_next_level():
+    series = TimeSeries(resolutions=((1, 5), (2, 5), (4, 5)))
+    for ts in range(9):
+        series.add(ts, {"cpu": ts})
+    two_seconds, four_seconds = series.levels[1][1], series.levels[2][1]
+    # 2s buckets 0..6 are closed (8 is still filling); of the 4s ones only 0 is
+    assert [(ts, values["cpu"]) for ts, values in two_seconds.points()] == [(0, 0.5), (2, 2.5), (4, 4.5), (6, 6.5)]
+    assert [(ts, values["cpu"]) for ts, values in four_seconds.points()] == [(0, 1.5)]